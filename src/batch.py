@@ -0,0 +1,306 @@
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+from utils.bootstrap import DEFAULT_CONFIDENCE, DEFAULT_RESAMPLES
+from utils.cache import QueryCache
+from utils.catalog import DEFAULT_CHUNK_SIZE, DEFAULT_TOP_ITEMS, CatalogPriceComp
+from utils.config import CONTRACTS_CSV, get_db_connection
+from utils.contracts import get_contract_registry
+from utils.instrument import StageRecorder
+from utils.converter import ConverterPool, close_default_converter
+from utils.fingerprint import ReportManifest
+from utils.market_index import MarketIndex
+from utils.queries import get_query_registry
+from utils.render import get_docx_renderer, get_html_renderer
+from utils.report import QUERY_NAMES, REPORT_FORMATS, SamplePriceComp
+from utils.sampling import REFERENCE_ITEMS_SQL, SampleSpec
+from utils.snapshot import ProductSnapshot
+"""
+Generate sample price comparison reports for many contracts from one invocation.
+
+Contracts can be read from a file (one contract number per line), from stdin,
+or from the product extract in the database. Each worker process owns its own
+database connection for the lifetime of the pool.
+
+    EXAMPLE -$ python3 src/batch.py --file contracts.txt --workers 8
+    EXAMPLE -$ cat contracts.txt | python3 src/batch.py --stdin
+    EXAMPLE -$ python3 src/batch.py --db --defer-convert
+    EXAMPLE -$ python3 src/batch.py --file contracts.txt --format html
+    EXAMPLE -$ python3 src/batch.py --db --incremental
+
+Inside docker:
+    docker run --rm -it -v $(pwd)/output:/app/output gsads python3 src/batch.py --db
+"""
+
+CONTRACT_NUMBERS_QUERY = 'contract_numbers'
+
+# Worker processes are spawned, not forked: main() has already run Polars (contract registry, contract
+# numbers), and Polars' thread pool does not survive a fork, so forked workers deadlock in their first query
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# Connection and contract metadata of the current worker process (set by init_worker)
+_worker_conn = None
+_worker_contracts = None
+
+
+def init_worker(connect=True, contracts_csv=CONTRACTS_CSV):
+    """Open one database connection per worker process (not needed for snapshot runs) and load the
+    contract registry once per worker.
+    """
+    global _worker_conn, _worker_contracts
+    if connect:
+        _worker_conn = get_db_connection()
+    _worker_contracts = get_contract_registry(contracts_csv)
+    # Pool workers exit without running the atexit handlers; multiprocessing runs its finalizers instead
+    Finalize(None, shutdown_worker, exitpriority=10)
+
+
+def shutdown_worker():
+    """Close the worker's connection and remove its LibreOffice profile when the worker process exits."""
+    global _worker_conn
+    close_default_converter()
+    if _worker_conn is not None:
+        _worker_conn.close()
+        _worker_conn = None
+
+
+def reset_worker_connection():
+    """Roll back an aborted transaction, reconnecting if the connection itself is gone."""
+    global _worker_conn
+    if _worker_conn is None:
+        return
+    try:
+        _worker_conn.rollback()
+    except Exception:
+        _worker_conn = get_db_connection()
+
+
+def run_contract(contract_number, output_path, convert=True, report_options=None, report_class=SamplePriceComp,
+                 output_format=None):
+    """Run a single report in a worker and return a result dictionary.
+
+    With convert=False the worker stops at the Word document so the conversions can be batched.
+    output_format ('pdf', 'docx' or 'html') overrides convert.
+    report_options are passed on to the report class (query_mode, sample, ...).
+    """
+    start = time.perf_counter()
+    # Worker processes run one report at a time, so the registry's time delta is this report's query time
+    queries = get_query_registry()
+    query_seconds = queries.total_seconds()
+    try:
+        price_comp = report_class(_worker_conn, contract_number, output_path=output_path,
+                                  contracts=_worker_contracts, **(report_options or {}))
+        report_path = price_comp.run_sample_report(convert=convert, output_format=output_format)
+        return {'contract_number': contract_number, 'ok': True, 'report_path': report_path,
+                'error': None, 'seconds': time.perf_counter() - start,
+                'query_seconds': queries.total_seconds() - query_seconds, 'reused': price_comp.reused}
+    except Exception as exc:
+        reset_worker_connection()
+        return {'contract_number': contract_number, 'ok': False, 'report_path': None,
+                'error': f"{type(exc).__name__}: {exc}", 'seconds': time.perf_counter() - start,
+                'query_seconds': queries.total_seconds() - query_seconds, 'reused': None}
+
+
+def read_contract_lines(lines):
+    """Strip blank lines, comments and duplicates while keeping the input order."""
+    contracts = []
+    seen = set()
+    for line in lines:
+        contract_number = line.strip()
+        if not contract_number or contract_number.startswith('#') or contract_number in seen:
+            continue
+        seen.add(contract_number)
+        contracts.append(contract_number)
+    return contracts
+
+
+def get_db_contracts(query_name=CONTRACT_NUMBERS_QUERY):
+    """Get every contract number found in the product extract."""
+    conn = get_db_connection()
+    try:
+        contracts_df = get_query_registry().fetch_df(conn, query_name)
+        return contracts_df.get_column("contract_number").to_list()
+    finally:
+        conn.close()
+
+
+def convert_results(results, instances, output_path):
+    """Convert the Word documents of the successful results to PDF with warm LibreOffice converters."""
+    converted = [result for result in results if result['ok']]
+    if not converted:
+        return
+
+    start = time.perf_counter()
+    max_batch = math.ceil(len(converted) / instances)
+    with ConverterPool(instances=instances, max_batch=max_batch) as pool:
+        futures = [pool.submit(result['report_path'], output_path) for result in converted]
+        for result, future in zip(converted, futures):
+            word_file_path = result['report_path']
+            try:
+                result['report_path'] = future.result()
+            except Exception as exc:
+                result['ok'] = False
+                result['report_path'] = None
+                result['error'] = f"{type(exc).__name__}: {exc}"
+                print(f"FAIL {result['contract_number']} conversion: {result['error']}", flush=True)
+            os.remove(word_file_path)
+    print(f"Converted {len(converted)} documents in {time.perf_counter() - start:.1f}s "
+          f"with {instances} LibreOffice instance(s)")
+
+
+def run_batch(contracts, workers=4, output_path="/app/output/", defer_convert=False, report_options=None,
+              contracts_csv=CONTRACTS_CSV, report_class=SamplePriceComp, output_format=None):
+    """Fan the contracts out across a process pool and print progress as reports finish.
+
+    With defer_convert the workers only render Word documents, which are converted to PDF at the end
+    in a few large LibreOffice calls instead of one LibreOffice start per report. output_format 'docx'
+    or 'html' writes those files instead of PDFs (no conversion).
+    """
+    results = []
+    start = time.perf_counter()
+    connect = (report_options or {}).get('snapshot') is None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT, initializer=init_worker,
+                             initargs=(connect, contracts_csv)) as pool:
+        futures = [pool.submit(run_contract, contract_number, output_path, not defer_convert, report_options,
+                               report_class, output_format)
+                   for contract_number in contracts]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = "OK  " if result['ok'] else "FAIL"
+            detail = result['report_path'] if result['ok'] else result['error']
+            reused = [name for name, unchanged in (result['reused'] or {}).items() if unchanged]
+            if reused:
+                detail += f" (reused {' and '.join(reused)})"
+            print(f"[{len(results)}/{len(contracts)}] {status} {result['contract_number']} "
+                  f"({result['seconds']:.2f}s, query {result['query_seconds']:.2f}s) {detail}", flush=True)
+
+    if defer_convert:
+        convert_results(results, workers, output_path)
+
+    elapsed = time.perf_counter() - start
+    succeeded = sum(1 for result in results if result['ok'])
+    failed = len(results) - succeeded
+    rate = len(results) / elapsed if elapsed else 0.0
+    query_seconds = sum(result['query_seconds'] for result in results)
+    print(f"Finished {len(results)} contracts in {elapsed:.1f}s: {succeeded} succeeded, {failed} failed "
+          f"({rate * 60:.1f} reports/min, {query_seconds:.1f}s in queries across workers)")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sample price comparison reports for many contracts.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', help="File with one contract number per line.")
+    source.add_argument('--stdin', action='store_true', help="Read contract numbers from stdin.")
+    source.add_argument('--db', action='store_true', help="Use every contract number in the product extract.")
+    parser.add_argument('--workers', type=int, default=4, help="Number of worker processes (default: 4).")
+    parser.add_argument('--output', default="/app/output/", help="Directory for the generated reports.")
+    parser.add_argument('--defer-convert', action='store_true',
+                        help="Render all Word documents first, then convert them to PDF in batches.")
+    parser.add_argument('--format', choices=list(REPORT_FORMATS), default='pdf',
+                        help="Report file format (default: pdf). 'html' needs neither Word nor LibreOffice.")
+    parser.add_argument('--query-mode', choices=list(QUERY_NAMES), default='rows',
+                        help="Pull competitor rows ('rows'), let Postgres summarize them ('aggregate'), "
+                             "look them up in the market price index ('index') or match them on the "
+                             "normalized part number ('normalized', see utils.part_keys).")
+    parser.add_argument('--match-manufacturer', action='store_true',
+                        help="In 'normalized' mode, only match competitors of the same manufacturer.")
+    parser.add_argument('--sample-size', type=int, default=100, help="Reference items per contract (default: 100).")
+    parser.add_argument('--sample-method', choices=list(REFERENCE_ITEMS_SQL), default='random',
+                        help="'random_key' needs the sample_key migration (utils.sampling.ensure_sample_key), "
+                             "'stratified' samples every manufacturer in proportion.")
+    parser.add_argument('--seed', default=None, help="Seed for reproducible samples.")
+    parser.add_argument('--deviation-thresholds', type=float, nargs='+', default=[1.0, 10.0, 100.0],
+                        help="Price deviation thresholds counted in the report (default: 1 10 100).")
+    parser.add_argument('--bootstrap-resamples', type=int, default=DEFAULT_RESAMPLES,
+                        help=f"Resamples of the confidence intervals (default: {DEFAULT_RESAMPLES}, 0 for none).")
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help=f"Confidence level of the intervals (default: {DEFAULT_CONFIDENCE}).")
+    parser.add_argument('--lazy', action='store_true', help="Run the analysis as one LazyFrame query.")
+    parser.add_argument('--streaming', action='store_true', help="Collect the lazy query with the streaming engine.")
+    parser.add_argument('--catalog', action='store_true',
+                        help="Compare every item of the contract (in chunks of part numbers) instead of a sample.")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Part numbers per chunk in --catalog mode (default: {DEFAULT_CHUNK_SIZE}).")
+    parser.add_argument('--top-items', type=int, default=DEFAULT_TOP_ITEMS,
+                        help=f"Items listed in a --catalog report (default: {DEFAULT_TOP_ITEMS}).")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Cache query results here (reused until the extract version changes).")
+    parser.add_argument('--cache-max-gb', type=float, default=2.0, help="Size limit of the query cache.")
+    parser.add_argument('--market-index', default=None,
+                        help="Market index file (utils.market_index export) for --snapshot runs in 'index' mode.")
+    parser.add_argument('--contracts-csv', default=CONTRACTS_CSV,
+                        help="Contract metadata CSV (utils.contracts export) instead of the database.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip the stages whose inputs are unchanged since the last run (manifest in the output).")
+    parser.add_argument('--stages', default=None,
+                        help="Append per-stage time, rows and memory of every report to this JSON lines file.")
+    parser.add_argument('--snapshot', default=None,
+                        help="Read products from a local Parquet snapshot (utils.snapshot) instead of the DB.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.catalog and args.snapshot:
+        print("--catalog needs the database, it cannot run on a --snapshot.")
+        return 2
+    if args.defer_convert and args.format != 'pdf':
+        print("--defer-convert only applies to PDF reports.")
+        return 2
+    if args.incremental and (args.catalog or args.snapshot or args.defer_convert):
+        print("--incremental cannot be combined with --catalog, --snapshot or --defer-convert.")
+        return 2
+    # Load and validate the SQL files, the contract metadata and the report template before starting the
+    # workers, so a broken file fails the run at once instead of every report
+    get_query_registry()
+    get_contract_registry(args.contracts_csv)
+    get_html_renderer() if args.format == 'html' else get_docx_renderer()
+
+    if args.file:
+        with open(args.file, 'r') as file:
+            contracts = read_contract_lines(file)
+    elif args.stdin:
+        contracts = read_contract_lines(sys.stdin)
+    else:
+        contracts = get_db_contracts()
+
+    if not contracts:
+        print("No contract numbers to process.")
+        return 0
+
+    report_options = {
+        'query_mode': args.query_mode,
+        'match_manufacturer': args.match_manufacturer,
+        'lazy': args.lazy or args.streaming,
+        'streaming': args.streaming,
+        'deviation_thresholds': [int(threshold) if float(threshold).is_integer() else threshold
+                                 for threshold in args.deviation_thresholds],
+        'bootstrap_resamples': args.bootstrap_resamples,
+        'confidence': args.confidence,
+        'sample': SampleSpec(size=args.sample_size, seed=args.seed, method=args.sample_method),
+        'snapshot': ProductSnapshot(args.snapshot) if args.snapshot else None,
+        'market_index': MarketIndex(args.market_index) if args.market_index else None,
+        'cache': QueryCache(args.cache_dir, int(args.cache_max_gb * 1024 ** 3)) if args.cache_dir else None,
+        'instrument': StageRecorder(args.stages) if args.stages else None,
+        'manifest': ReportManifest(args.output) if args.incremental else None,
+    }
+    report_class = SamplePriceComp
+    if args.catalog:
+        report_class = CatalogPriceComp
+        report_options.update(chunk_size=args.chunk_size, top_items=args.top_items)
+    results = run_batch(contracts, workers=args.workers, output_path=args.output,
+                        defer_convert=args.defer_convert, report_options=report_options,
+                        contracts_csv=args.contracts_csv, report_class=report_class, output_format=args.format)
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
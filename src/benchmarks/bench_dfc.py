@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import numpy as np
+import polars as pl
+
+from utils.dfc import DataFrameCleaner
+"""
+Micro-benchmark of the DataFrameCleaner formatting against the previous per-cell implementation.
+
+Run from the project root:
+    EXAMPLE -$ PYTHONPATH=src python3 -m benchmarks.bench_dfc --rows 500000
+"""
+
+PERCENT_COLUMNS = ["percent_difference"]
+PRICE_COLUMNS = ["price", "average_price_on_gsa", "price_deviation"]
+
+
+def legacy_format_percent_columns(df, column_list):
+    # Previous implementation: one with_columns and one Python lambda call per cell
+    for column in column_list:
+        df = df.with_columns(
+            (pl.col(column) * 100).round(2).map_elements(
+                lambda x: f"{x:.2f}%" if x is not None else "N/A",
+                return_dtype=pl.Utf8
+            )
+        )
+    return df
+
+
+def legacy_format_price_columns(df, column_list):
+    for column in column_list:
+        df = df.with_columns(
+            pl.col(column).round(2).map_elements(
+                lambda x: f"${x:.2f}" if x is not None else "N/A",
+                return_dtype=pl.Utf8
+            )
+        )
+    return df
+
+
+def make_comparison_df(rows, null_fraction=0.05, seed=0):
+    """Build a comparison_df shaped frame with random prices and some missing competitor values."""
+    rng = np.random.default_rng(seed)
+    price = rng.lognormal(3, 1.5, rows)
+    average = price * rng.normal(1, 0.2, rows)
+    missing = rng.random(rows) < null_fraction
+    return pl.DataFrame({
+        "price": price,
+        "average_price_on_gsa": average,
+        "price_deviation": np.abs(price - average),
+        "percent_difference": (price - average) / average,
+    }).with_columns(
+        pl.when(pl.lit(pl.Series(missing))).then(None).otherwise(pl.col(column)).alias(column)
+        for column in ["average_price_on_gsa", "price_deviation", "percent_difference"]
+    )
+
+
+def time_best(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DataFrameCleaner formatting.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 100_000, 500_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>10} {'legacy (s)':>12} {'native (s)':>12} {'speedup':>9}")
+    for rows in args.rows:
+        df = make_comparison_df(rows)
+        legacy = time_best(lambda: legacy_format_price_columns(
+            legacy_format_percent_columns(df, PERCENT_COLUMNS), PRICE_COLUMNS), args.repeat)
+        native = time_best(lambda: DataFrameCleaner.format_columns(
+            df, percent_columns=PERCENT_COLUMNS, price_columns=PRICE_COLUMNS), args.repeat)
+        print(f"{rows:>10} {legacy:>12.4f} {native:>12.4f} {legacy / native:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import importlib
+import importlib.metadata
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import polars as pl
+
+from benchmarks.synthetic import contract_numbers, generate_extract, load_postgres, synthetic_registry, write_snapshot
+from utils.config import get_db_connection
+from utils.dfc import DataFrameCleaner
+from utils.render import get_docx_renderer, get_html_renderer
+from utils.report import SamplePriceComp
+from utils.sampling import SampleSpec
+from utils.snapshot import ProductSnapshot
+"""
+Benchmark of the report steps on synthetic extracts of several sizes, recorded for regression tracking.
+
+For every scale a synthetic extract (benchmarks.synthetic) is written to a temporary Parquet snapshot,
+or loaded into the local Postgres with --postgres, and the largest contracts are run through the
+report steps: get_sample_products, get_contractor_items, calculate_comparison_df, comparison_statements,
+calculate_confidence_intervals (the bootstrap), the DataFrameCleaner formatting and the Word and HTML
+rendering. The median and best time of every step are printed and appended as JSON lines to the results
+file, together with the git commit and the Python and library versions (LIBRARIES), and compared with
+the previous result of the same configuration.
+
+Run from the project root:
+    EXAMPLE -$ PYTHONPATH=src python3 -m benchmarks.bench_report --rows 100000 1000000
+    EXAMPLE -$ PYTHONPATH=src python3 -m benchmarks.bench_report --rows 1000000 --postgres --replace --query-mode aggregate
+"""
+
+STEPS = ('get_sample_products', 'get_contractor_items', 'calculate_comparison_df', 'comparison_statements',
+         'calculate_confidence_intervals', 'DataFrameCleaner', 'render_docx', 'render_html')
+DEFAULT_RESULTS = "output/bench_report.jsonl"
+# Distributions of requirements.txt whose versions are recorded with the results
+LIBRARIES = ('polars', 'numpy', 'psycopg2', 'docxtpl')
+# Fields identifying a configuration, results are compared with the previous run of the same one
+CONFIG_FIELDS = ('source', 'rows', 'contracts', 'overlap_skew', 'sample_size', 'query_mode', 'step')
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def library_versions():
+    """Installed version of every library of LIBRARIES (None when it is not installed)."""
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            # Installed under another distribution name (e.g. psycopg2-binary)
+            try:
+                versions[name] = importlib.import_module(name).__version__.split()[0]
+            except (ImportError, AttributeError):
+                versions[name] = None
+    return versions
+
+
+def timed(timings, step, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[step].append(time.perf_counter() - start)
+    return result
+
+
+def bench_contract(conn, contract_number, registry, snapshot, args, timings):
+    """Run the report steps of one contract once, adding the time of every step to timings."""
+    price_comp = SamplePriceComp(conn, contract_number, snapshot=snapshot, contracts=registry,
+                                 query_mode=args.query_mode, sample=SampleSpec(size=args.sample_size, seed=1))
+    price_comp.get_contractor_info()
+    timed(timings, 'get_sample_products', price_comp.get_sample_products)
+    timed(timings, 'get_contractor_items', price_comp.get_contractor_items)
+    timed(timings, 'calculate_comparison_df', price_comp.calculate_comparison_df)
+    timed(timings, 'comparison_statements', price_comp.comparison_statements)
+    price_comp.calculate_manufacture_average_diff()
+    timed(timings, 'calculate_confidence_intervals', price_comp.calculate_confidence_intervals)
+    timed(timings, 'DataFrameCleaner', DataFrameCleaner.format_columns, price_comp.comparison_df,
+          percent_columns=["percent_difference"], price_columns=["price", "average_price_on_gsa", "price_deviation"])
+    price_comp.get_analysis_results_dict()
+    timed(timings, 'render_docx', get_docx_renderer().render, price_comp.analysis_results)
+    timed(timings, 'render_html', get_html_renderer().render, price_comp.analysis_results)
+    return price_comp.query_results_df.height
+
+
+def bench_scale(rows, args):
+    """Generate an extract of rows rows and time the report steps of its largest contracts."""
+    df = generate_extract(rows, args.contracts, overlap_skew=args.overlap_skew, seed=args.seed)
+    registry = synthetic_registry(df)
+    contracts = contract_numbers(args.contracts)[:args.reports]
+    timings = defaultdict(list)
+    query_rows = []
+    with tempfile.TemporaryDirectory(prefix="bench_report_") as tmp:
+        conn, snapshot = None, None
+        if args.postgres:
+            conn = get_db_connection()
+            load_postgres(conn, df, replace_table=args.replace)
+        else:
+            write_snapshot(df, tmp, args.partitions)
+            snapshot = ProductSnapshot(tmp)
+        del df
+        try:
+            for _ in range(args.repeat):
+                for contract_number in contracts:
+                    query_rows.append(bench_contract(conn, contract_number, registry, snapshot, args, timings))
+        finally:
+            if conn is not None:
+                conn.close()
+    return timings, statistics.mean(query_rows)
+
+
+def previous_results(path):
+    """Latest earlier result of every configuration in the results file."""
+    previous = {}
+    if os.path.exists(path):
+        for record in pl.read_ndjson(path).iter_rows(named=True):
+            previous[tuple(record.get(field) for field in CONFIG_FIELDS)] = record
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the report steps on synthetic extracts.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000], help="Extract sizes.")
+    parser.add_argument('--contracts', type=int, default=1_000)
+    parser.add_argument('--overlap-skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample-size', type=int, default=100)
+    parser.add_argument('--reports', type=int, default=3, help="Largest contracts benchmarked per scale.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--partitions', type=int, default=64)
+    parser.add_argument('--query-mode', choices=['rows', 'aggregate'], default='rows',
+                        help="'aggregate' needs --postgres.")
+    parser.add_argument('--postgres', action='store_true',
+                        help="Load each extract into the local Postgres (gsa_product_extract_jan2024) and query it.")
+    parser.add_argument('--replace', action='store_true', help="Allow dropping the existing extract table.")
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="JSON lines file the results are appended to.")
+    args = parser.parse_args(argv)
+    if args.query_mode != 'rows' and not args.postgres:
+        parser.error("--query-mode aggregate needs --postgres")
+
+    previous = previous_results(args.results)
+    run = {
+        'benchmark': 'report',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        **library_versions(),
+        'source': 'postgres' if args.postgres else 'parquet',
+        'contracts': args.contracts,
+        'overlap_skew': args.overlap_skew,
+        'sample_size': args.sample_size,
+        'query_mode': args.query_mode,
+    }
+    records = []
+    print(f"{'rows':>10} {'step':<30} {'median (s)':>11} {'best (s)':>10} {'vs previous':>12}")
+    for rows in args.rows:
+        timings, query_rows = bench_scale(rows, args)
+        for step in STEPS:
+            seconds = timings[step]
+            record = {**run, 'rows': rows, 'query_rows': round(query_rows), 'step': step, 'runs': len(seconds),
+                      'median_seconds': round(statistics.median(seconds), 6), 'min_seconds': round(min(seconds), 6)}
+            records.append(record)
+            before = previous.get(tuple(record.get(field) for field in CONFIG_FIELDS))
+            change = (f"{record['median_seconds'] / before['median_seconds'] - 1:+.1%}"
+                      if before and before['median_seconds'] else "")
+            print(f"{rows:>10} {step:<30} {record['median_seconds']:>11.4f} {record['min_seconds']:>10.4f} "
+                  f"{change:>12}")
+
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    with open(args.results, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+    print(f"Appended {len(records)} results to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
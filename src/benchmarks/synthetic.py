@@ -0,0 +1,206 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import time
+from dataclasses import replace
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from utils.config import get_db_connection
+from utils.contracts import ContractRegistry
+from utils.sampling import ensure_sample_key
+from utils.snapshot import METADATA_FILE, PARTITION_COLUMN, part_number_bucket
+from test.sampleCompany import sample_companies
+"""
+Generator of synthetic data shaped like gsa_product_extract_jan2024, for benchmarks without the real extract.
+
+Every row is an item of a contract with a manufacturer part number. Contract sizes and part number
+popularity both follow a Zipf-like law: with overlap_skew 0 every part number is about equally common,
+so few items have competitors, and the larger the skew the more contracts sell the same popular part
+numbers. Prices scatter around a base price per part number. The first contracts carry the contract
+numbers of the sample companies, so the default registry finds them too.
+
+The data is written as a Parquet snapshot (the layout of utils.snapshot, usable with --snapshot) or
+loaded into a Postgres table.
+
+Run from the project root:
+    EXAMPLE -$ PYTHONPATH=src python3 -m benchmarks.synthetic parquet /tmp/synthetic --rows 1000000 --contracts 2000
+    EXAMPLE -$ PYTHONPATH=src python3 -m benchmarks.synthetic postgres --rows 1000000 --replace
+"""
+
+EXTRACT_TABLE = "gsa_product_extract_jan2024"
+EXTRACT_COLUMNS = ["jprod_id", "contract_number", "contractor_name", "manufacturer_part_number",
+                   "manufacturer_name", "product_name", "price", "sample_key"]
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE {table} (
+        jprod_id bigint PRIMARY KEY,
+        contract_number text,
+        contractor_name text,
+        manufacturer_part_number text,
+        manufacturer_name text,
+        product_name text,
+        price numeric(12, 2),
+        sample_key double precision
+    )
+"""
+CREATE_INDEXES_SQL = """
+    CREATE INDEX ON {table} (contract_number);
+    CREATE INDEX ON {table} (manufacturer_part_number)
+"""
+
+
+def zipf_weights(n, skew):
+    """Probabilities proportional to 1 / rank ** skew (uniform for skew 0)."""
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** skew
+    return weights / weights.sum()
+
+
+def contract_numbers(contracts):
+    """The sample companies' contract numbers, then synthetic ones."""
+    numbers = [company.contract_number for company in sample_companies()][:contracts]
+    return numbers + [f"47QSYN{index:07d}" for index in range(len(numbers), contracts)]
+
+
+def generate_extract(rows, contracts=1_000, part_numbers=None, overlap_skew=1.1, contract_skew=1.0, seed=0):
+    """Synthetic product extract with rows items over contracts contracts.
+
+    part_numbers defaults to rows // 5 distinct manufacturer part numbers, overlap_skew sets how much
+    the contracts share part numbers and contract_skew how uneven the contract sizes are.
+    """
+    rng = np.random.default_rng(seed)
+    part_numbers = part_numbers or max(rows // 5, 1)
+    manufacturers = max(part_numbers // 50, 10)
+
+    contract = rng.choice(contracts, size=rows, p=zipf_weights(contracts, contract_skew))
+    part = rng.choice(part_numbers, size=rows, p=zipf_weights(part_numbers, overlap_skew))
+    # The part numbers are shuffled so that popularity is not tied to the part number order
+    part_labels = rng.permutation(part_numbers)
+    base_price = rng.lognormal(3.5, 1.3, part_numbers)
+    price = np.round(base_price[part] * rng.lognormal(0.0, 0.15, rows), 2)
+
+    numbers = pl.Series("contract_number", contract_numbers(contracts), dtype=pl.Utf8)
+    return pl.DataFrame({
+        "jprod_id": np.arange(1, rows + 1, dtype=np.int64),
+        "contract_number": numbers.gather(pl.Series(contract)),
+        "contract_index": contract,
+        "part_index": part_labels[part],
+        "price": np.maximum(price, 0.01),
+        "sample_key": rng.random(rows),
+    }).select(
+        pl.col("jprod_id"),
+        pl.col("contract_number"),
+        pl.format("Synthetic Contractor {}", pl.col("contract_index")).alias("contractor_name"),
+        pl.format("MPN-{}", pl.col("part_index").cast(pl.Utf8).str.zfill(8)).alias("manufacturer_part_number"),
+        pl.format("Manufacturer {}", pl.col("part_index") % manufacturers).alias("manufacturer_name"),
+        pl.format("Synthetic Product {}", pl.col("part_index")).alias("product_name"),
+        pl.col("price"),
+        pl.col("sample_key"),
+    )
+
+
+def synthetic_registry(df):
+    """Contract registry of the contracts of a synthetic extract (sample companies keep their metadata)."""
+    companies = {company.contract_number: company for company in sample_companies()}
+    template = next(iter(companies.values()))
+    contractors = df.select("contract_number", "contractor_name").unique("contract_number", maintain_order=True)
+    return ContractRegistry.from_companies([
+        companies.get(number) or replace(template, contract_number=number, vendor=name, sam_uei=number[-12:])
+        for number, name in contractors.iter_rows()
+    ])
+
+
+def write_snapshot(df, path, partitions=64):
+    """Write the extract as a Parquet snapshot (the layout export_snapshot() writes) and return its metadata."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    start = time.perf_counter()
+    parts = df.select(pl.col("manufacturer_part_number").unique())
+    parts = parts.with_columns(pl.Series(PARTITION_COLUMN, [
+        part_number_bucket(part_number, partitions) for part_number in parts.get_column("manufacturer_part_number")
+    ], dtype=pl.Int64))
+    buckets = df.join(parts, on="manufacturer_part_number").partition_by(PARTITION_COLUMN, as_dict=True,
+                                                                          include_key=False)
+    for (bucket,), bucket_df in buckets.items():
+        bucket_dir = os.path.join(path, f"{PARTITION_COLUMN}={bucket}")
+        os.makedirs(bucket_dir)
+        bucket_df.sort("manufacturer_part_number").write_parquet(
+            os.path.join(bucket_dir, "data.parquet"), statistics=True, row_group_size=50_000)
+
+    metadata = {
+        'source_table': 'synthetic',
+        'partitions': partitions,
+        'row_count': df.height,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'export_seconds': round(time.perf_counter() - start, 1),
+    }
+    with open(os.path.join(path, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+def load_postgres(conn, df, table=EXTRACT_TABLE, replace_table=False, batch_rows=500_000):
+    """Load the extract into a Postgres table with COPY, then index it and add the sample_key indexes.
+
+    An existing table is only dropped with replace_table=True (never point this at the real extract).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [table])
+        if cursor.fetchone()[0] is not None:
+            if not replace_table:
+                raise RuntimeError(f"Table {table} already exists, pass replace_table=True to drop it.")
+            cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(CREATE_TABLE_SQL.format(table=table))
+        for offset in range(0, df.height, batch_rows):
+            buffer = io.BytesIO()
+            df.slice(offset, batch_rows).select(EXTRACT_COLUMNS).write_csv(buffer, include_header=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} ({', '.join(EXTRACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(CREATE_INDEXES_SQL.format(table=table))
+    conn.commit()
+    if table == EXTRACT_TABLE:
+        ensure_sample_key(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic product extract.")
+    parser.add_argument('target', choices=['parquet', 'postgres'])
+    parser.add_argument('path', nargs='?', help="Snapshot directory (parquet target).")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--contracts', type=int, default=1_000)
+    parser.add_argument('--part-numbers', type=int, default=None, help="Distinct part numbers (default: rows / 5).")
+    parser.add_argument('--overlap-skew', type=float, default=1.1,
+                        help="Zipf exponent of the part number popularity (0: uniform, little overlap).")
+    parser.add_argument('--contract-skew', type=float, default=1.0, help="Zipf exponent of the contract sizes.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partitions', type=int, default=64)
+    parser.add_argument('--table', default=EXTRACT_TABLE, help="Postgres table to load (postgres target).")
+    parser.add_argument('--replace', action='store_true', help="Drop the Postgres table if it exists.")
+    args = parser.parse_args(argv)
+    if args.target == 'parquet' and not args.path:
+        parser.error("the parquet target needs a path")
+
+    start = time.perf_counter()
+    df = generate_extract(args.rows, args.contracts, args.part_numbers, args.overlap_skew, args.contract_skew,
+                          args.seed)
+    print(f"Generated {df.height} rows in {time.perf_counter() - start:.1f}s")
+
+    if args.target == 'parquet':
+        print(json.dumps(write_snapshot(df, args.path, args.partitions), indent=2))
+        return
+    conn = get_db_connection()
+    try:
+        start = time.perf_counter()
+        load_postgres(conn, df, args.table, args.replace)
+    finally:
+        conn.close()
+    print(f"Loaded {df.height} rows into {args.table} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
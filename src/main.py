@@ -1,4 +1,5 @@
 from utils.config import get_db_connection
+from utils.converter import close_default_converter
 from utils.report import SamplePriceComp
 """
 Build using docker
@@ -26,8 +27,9 @@ def main():
         price_comp.run_sample_report()
 
     finally:
-        # Close the database connection
+        # Close the database connection and remove the LibreOffice profile
         conn.close()
+        close_default_converter()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,418 @@
+import argparse
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as ResultTimeout
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.cache import DEFAULT_MAX_BYTES, QueryCache, ReportCache, text_hash
+from utils.config import CONTRACTS_CSV, EXTRACT_VERSION, ConnectionPool
+from utils.contracts import get_contract_registry
+from utils.converter import ConverterPool
+from utils.instrument import StageRecorder
+from utils.queries import get_query_registry
+from utils.render import DEFAULT_HTML_TEMPLATE, DEFAULT_TEMPLATE, SCRATCH_DIR, get_docx_renderer, get_html_renderer
+from utils.report import QUERY_NAMES, REPORT_FORMATS, SamplePriceComp
+from utils.sampling import REFERENCE_ITEMS_SQL, SampleSpec
+"""
+Long-running report service for the web app, instead of a `docker run` of main.py per report.
+
+The process starts once and keeps everything warm: the SQL files, the contract metadata, the compiled
+templates, a database ConnectionPool and a ConverterPool of LibreOffice instances. Reports run on a
+fixed number of worker threads (bounded concurrency); at most max_queue reports wait for a worker,
+further requests are answered 503 with Retry-After.
+
+A request for a report that is already being generated with the same inputs waits for that run instead
+of starting another one, and a report generated before with the same inputs is served from the report
+cache. The inputs are the contract, the format, the query mode and sample options, the extract version,
+the templates and the day (the report counts the days until the contract ends). Without a seed the
+sample is random, so a cached report is one random sample of the day.
+
+    GET /reports/<contract_number>?format=pdf&query_mode=rows&sample_size=100&seed=1&wait=300
+        The report file. 202 if it is not ready after wait seconds (it keeps running, ask again).
+    GET /metrics
+        Queue depth, running reports, counters and the queue wait, run and request latencies.
+    GET /health
+
+Run from the project root:
+    EXAMPLE -$ python3 src/service.py --port 8080 --workers 4 --converters 2
+    EXAMPLE -$ curl -o report.pdf "http://localhost:8080/reports/47QSEA20D003B?seed=1"
+    EXAMPLE -$ curl http://localhost:8080/metrics
+"""
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'html': 'text/html; charset=utf-8',
+}
+DEFAULT_REPORT_CACHE = "/app/output/.report_cache"
+# Latencies kept per metric for the percentiles
+LATENCY_WINDOW = 1_000
+
+
+class ServiceBusy(Exception):
+    """Raised when max_queue reports are already waiting for a worker."""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(round(fraction * (len(ordered) - 1)), len(ordered) - 1)]
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 4)
+
+
+class ServiceMetrics:
+    """
+    Thread-safe counters and latency windows of the report service.
+
+    Attributes:
+    -----------
+    counters : dict
+        requests, cache_hits, deduplicated, started, completed, failed and rejected reports.
+    latencies : dict
+        The last LATENCY_WINDOW queue_wait, run and request durations in seconds.
+    """
+
+    COUNTERS = ('requests', 'cache_hits', 'deduplicated', 'started', 'completed', 'failed', 'rejected')
+    LATENCIES = ('queue_wait', 'run', 'request')
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.latencies = {name: deque(maxlen=window) for name in self.LATENCIES}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+
+    def snapshot(self):
+        """Counters and count, mean, p50, p95 and max seconds of every latency."""
+        with self._lock:
+            latencies = {name: list(values) for name, values in self.latencies.items()}
+            snapshot = dict(self.counters)
+        for name, values in latencies.items():
+            snapshot[f"{name}_seconds"] = {
+                'count': len(values),
+                'mean': _round(sum(values) / len(values)) if values else None,
+                'p50': _round(percentile(values, 0.5)),
+                'p95': _round(percentile(values, 0.95)),
+                'max': _round(max(values, default=None)),
+            }
+        return snapshot
+
+
+def template_version(paths=(DEFAULT_TEMPLATE, DEFAULT_HTML_TEMPLATE)):
+    """Hash of the report templates, part of the report key."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def report_key(contract_number, output_format, options, templates, extract_version=EXTRACT_VERSION, day=None):
+    """Key of a report: the contract, the format, the request options, the templates, the extract and the day."""
+    parts = [contract_number, output_format, extract_version, templates, (day or date.today()).isoformat(),
+             *[f"{name}={options[name]!r}" for name in sorted(options)]]
+    return text_hash("\x1f".join(parts))
+
+
+class ReportService:
+    """
+    Runs reports on a bounded pool of worker threads, coalescing and caching them by their inputs.
+
+    Attributes:
+    -----------
+    pool : ConnectionPool
+        Database connections shared by the reports.
+    converter : ConverterPool
+        Warm LibreOffice converters for PDF reports, or None to only serve Word and HTML reports.
+    report_cache : ReportCache
+        Generated report files, served again while the inputs are unchanged.
+    report_options : dict
+        Options passed to every SamplePriceComp (query cache, instrument, ...).
+    defaults : dict
+        Default format and request options, overridden by the query string of a request.
+    workers : int
+        Reports generated at the same time.
+    max_queue : int
+        Reports waiting for a worker before new requests are rejected.
+    wait_timeout : float
+        Seconds a request waits for its report before it is answered 202 (default of ?wait=).
+    metrics : ServiceMetrics
+        Counters and latencies, see status().
+    """
+
+    def __init__(self, pool, report_cache, converter=None, workers=4, max_queue=32, wait_timeout=300,
+                 report_options=None, defaults=None, contracts_csv=CONTRACTS_CSV):
+        self.pool = pool
+        self.converter = converter
+        self.report_cache = report_cache
+        self.workers = workers
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self.report_options = report_options or {}
+        self.defaults = {'format': 'pdf', 'query_mode': 'rows', 'sample_size': 100, 'sample_method': 'random',
+                         'seed': None, 'match_manufacturer': False, **(defaults or {})}
+        self.contracts = get_contract_registry(contracts_csv)
+        self.templates = template_version()
+        self.metrics = ServiceMetrics()
+        self.queued = 0
+        self.running = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def parse_request(self, params):
+        """Format and options of a report request from its query parameters. Raise ValueError if invalid."""
+        output_format = params.get('format', self.defaults['format'])
+        if output_format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown format {output_format!r}, expected one of {list(REPORT_FORMATS)}.")
+        if output_format == 'pdf' and self.converter is None:
+            raise ValueError("PDF reports are disabled on this service (no converters), ask for docx or html.")
+        options = {
+            'query_mode': params.get('query_mode', self.defaults['query_mode']),
+            'sample_size': int(params.get('sample_size', self.defaults['sample_size'])),
+            'sample_method': params.get('sample_method', self.defaults['sample_method']),
+            'seed': params.get('seed', self.defaults['seed']),
+            'match_manufacturer': params.get('match_manufacturer', str(self.defaults['match_manufacturer'])).lower()
+            in ('1', 'true', 'yes'),
+        }
+        if options['query_mode'] not in QUERY_NAMES:
+            raise ValueError(f"Unknown query mode {options['query_mode']!r}, expected one of {list(QUERY_NAMES)}.")
+        if options['sample_method'] not in REFERENCE_ITEMS_SQL:
+            raise ValueError(f"Unknown sample method {options['sample_method']!r}, "
+                             f"expected one of {list(REFERENCE_ITEMS_SQL)}.")
+        if not 0 < options['sample_size'] <= 10_000:
+            raise ValueError("sample_size must be between 1 and 10000.")
+        return output_format, options
+
+    def knows_contract(self, contract_number):
+        return self.contracts.get(contract_number) is not None
+
+    def submit(self, contract_number, output_format, options):
+        """Return a Future resolving to the report path: the cached report, the run already generating it,
+            or a new run. Raise ServiceBusy when the queue is full.
+        """
+        self.metrics.count('requests')
+        key = report_key(contract_number, output_format, options, self.templates)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.metrics.count('deduplicated')
+                return future
+            cached_path = self.report_cache.get(key, output_format)
+            if cached_path is not None:
+                self.metrics.count('cache_hits')
+                future = Future()
+                future.set_result(cached_path)
+                return future
+            if self.queued >= self.max_queue:
+                self.metrics.count('rejected')
+                raise ServiceBusy(f"{self.queued} reports are waiting for a worker.")
+            self.queued += 1
+            future = self._executor.submit(self._run, key, contract_number, output_format, options,
+                                           time.perf_counter())
+            self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._finish(key))
+        return future
+
+    def _finish(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _run(self, key, contract_number, output_format, options, submitted):
+        """Generate a report into a scratch directory and move it into the report cache."""
+        start = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        self.metrics.count('started')
+        self.metrics.observe('queue_wait', start - submitted)
+        try:
+            with tempfile.TemporaryDirectory(prefix="gsa_service_", dir=SCRATCH_DIR) as scratch_path:
+                price_comp = SamplePriceComp(
+                    self.pool, contract_number, output_path=scratch_path, converter=self.converter,
+                    query_mode=options['query_mode'], match_manufacturer=options['match_manufacturer'],
+                    sample=SampleSpec(size=options['sample_size'], seed=options['seed'],
+                                      method=options['sample_method']),
+                    contracts=self.contracts, **self.report_options)
+                report_path = price_comp.run_sample_report(output_format=output_format)
+                cached_path = self.report_cache.put(key, report_path, output_format)
+            self.metrics.count('completed')
+            return cached_path
+        except Exception:
+            self.metrics.count('failed')
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+            self.metrics.observe('run', time.perf_counter() - start)
+
+    def status(self):
+        """Queue depth, running reports, counters, latencies and the report cache size."""
+        with self._lock:
+            status = {'queue_depth': self.queued, 'running': self.running, 'in_flight': len(self._in_flight)}
+        status.update(workers=self.workers, max_queue=self.max_queue, **self.metrics.snapshot())
+        status['report_cache'] = self.report_cache.stats()
+        return status
+
+    def close(self):
+        """Finish the queued reports, then stop the converters and close the connections."""
+        self._executor.shutdown(wait=True)
+        if self.converter is not None:
+            self.converter.close()
+        self.pool.close()
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of the ReportService set as server.service."""
+
+    server_version = "GSAReportService/1.0"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if url.path == "/health":
+            self.send_json(HTTPStatus.OK, {'ok': True})
+        elif url.path == "/metrics":
+            self.send_json(HTTPStatus.OK, self.server.service.status())
+        elif len(parts) == 2 and parts[0] == "reports":
+            self.send_report(parts[1], params)
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f"Unknown path {url.path}."})
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, indent=2, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_report(self, contract_number, params):
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            output_format, options = service.parse_request(params)
+            wait = float(params.get('wait', service.wait_timeout))
+        except ValueError as exc:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(exc)})
+            return
+        if not service.knows_contract(contract_number):
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f"Contract {contract_number} not found."})
+            return
+
+        try:
+            report_path = service.submit(contract_number, output_format, options).result(timeout=wait)
+            with open(report_path, 'rb') as file:
+                body = file.read()
+        except ServiceBusy as exc:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(exc)}, {"Retry-After": "5"})
+            return
+        except ResultTimeout:
+            self.send_json(HTTPStatus.ACCEPTED, {'status': 'pending', 'contract_number': contract_number})
+            return
+        except FileNotFoundError:
+            # Evicted from the report cache between the run and the read
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Report evicted, retry."}, {"Retry-After": "1"})
+            return
+        except Exception as exc:
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(exc).__name__}: {exc}"})
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPES[output_format])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition",
+                         f'attachment; filename="GSA_Report_{contract_number}.{output_format}"')
+        self.end_headers()
+        self.wfile.write(body)
+        service.metrics.observe('request', time.perf_counter() - start)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve price comparison reports over HTTP from warm resources.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help="Reports generated at the same time (default: 4).")
+    parser.add_argument('--max-queue', type=int, default=32,
+                        help="Reports waiting for a worker before requests are rejected with 503 (default: 32).")
+    parser.add_argument('--converters', type=int, default=1,
+                        help="Warm LibreOffice instances for PDF reports, 0 to serve only docx and html.")
+    parser.add_argument('--wait-timeout', type=float, default=300,
+                        help="Seconds a request waits for its report before a 202 answer (default: 300).")
+    parser.add_argument('--format', choices=list(REPORT_FORMATS), default='pdf', help="Default report format.")
+    parser.add_argument('--query-mode', choices=list(QUERY_NAMES), default='rows', help="Default query mode.")
+    parser.add_argument('--sample-size', type=int, default=100, help="Default reference items per report.")
+    parser.add_argument('--sample-method', choices=list(REFERENCE_ITEMS_SQL), default='random',
+                        help="Default sample method.")
+    parser.add_argument('--report-cache', default=DEFAULT_REPORT_CACHE, help="Directory of the generated reports.")
+    parser.add_argument('--report-cache-max-gb', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3,
+                        help="Size limit of the report cache.")
+    parser.add_argument('--cache-dir', default=None, help="Also cache the query results here.")
+    parser.add_argument('--contracts-csv', default=CONTRACTS_CSV,
+                        help="Contract metadata CSV (utils.contracts export) instead of the database.")
+    parser.add_argument('--stages', default=None,
+                        help="Append per-stage time, rows and memory of every report to this JSON lines file.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Load the SQL files, the contract metadata and the templates once, before the first request
+    get_query_registry()
+    get_contract_registry(args.contracts_csv)
+    get_docx_renderer()
+    get_html_renderer()
+
+    report_options = {
+        'cache': QueryCache(args.cache_dir) if args.cache_dir else None,
+        'instrument': StageRecorder(args.stages) if args.stages else None,
+    }
+    defaults = {'format': args.format if args.converters else 'html', 'query_mode': args.query_mode,
+                'sample_size': args.sample_size, 'sample_method': args.sample_method}
+    service = ReportService(ConnectionPool(minconn=1, maxconn=args.workers),
+                            ReportCache(args.report_cache, int(args.report_cache_max_gb * 1024 ** 3)),
+                            converter=ConverterPool(instances=args.converters) if args.converters else None,
+                            workers=args.workers, max_queue=args.max_queue, wait_timeout=args.wait_timeout,
+                            report_options=report_options, defaults=defaults, contracts_csv=args.contracts_csv)
+    server = ThreadingHTTPServer((args.host, args.port), ReportRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving reports on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
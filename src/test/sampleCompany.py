@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import date
+from functools import lru_cache
 from typing import Optional
 
 @dataclass
@@ -51,7 +52,9 @@ class Company:
     def __str__(self):
         return self.vendor or "Unknown Vendor"
 
-def get_sample_company(contract_number: str) -> Company:
+@lru_cache(maxsize=None)
+def sample_companies():
+    """The sample companies, built once per process."""
     # 10G Federal Supply
     company_full = Company(
         large_category="Facilities",
@@ -239,9 +242,10 @@ def get_sample_company(contract_number: str) -> Company:
         view_catalog="https://www.gsaelibrary.gsa.gov/ElibMain/advRedirect.do?contract=GS-07F-177AA&sin=238160&app=cat"
     )
     
-    company_list = [company_full, company_full_2, company_under_100, company_labor]
+    return (company_full, company_full_2, company_under_100, company_labor)
 
-    for company in company_list:
+def get_sample_company(contract_number: str) -> Company:
+    for company in sample_companies():
         if company.contract_number != contract_number:
             continue
         else:
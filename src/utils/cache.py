@@ -0,0 +1,201 @@
+"""
+On-disk cache of price comparison query results.
+
+Results are stored as Parquet files under one directory per extract version:
+
+    <cache_dir>/<extract_version>/<key>.parquet
+
+The key combines the contract number, a hash of the SQL, the extract version and anything else
+that changes the result (query mode, sample spec). The total size is bounded: when it grows past
+max_bytes the least recently used files are evicted (a hit refreshes the file's modification time).
+When a new monthly extract is loaded, invalidate() drops the entries of the older versions.
+
+ReportCache keeps generated report files (PDF, Word, HTML) the same way, for the report service.
+
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.cache stats
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.cache invalidate --keep gsa_product_extract_feb2024
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import polars as pl
+
+from .config import EXTRACT_VERSION
+
+DEFAULT_CACHE_DIR = "/app/output/.query_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def text_hash(text):
+    """sha256 of a string."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class QueryCache:
+    """
+    Size-bounded LRU cache of query result DataFrames.
+
+    Attributes:
+    -----------
+    cache_dir : str
+        Root directory of the cache.
+    max_bytes : int
+        Size limit of all the cached files together.
+    hits, misses, evictions : int
+        Counters for this process.
+    """
+
+    # Cached files (temporary files being written do not match)
+    FILE_PATTERNS = ("*.parquet",)
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(contract_number, query_sql, extract_version=EXTRACT_VERSION, *extra):
+        """Build the cache key of a query result."""
+        parts = [contract_number, text_hash(query_sql), extract_version, *[str(part) for part in extra]]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _path(self, key, extract_version):
+        return os.path.join(self.cache_dir, extract_version, f"{key}.parquet")
+
+    def get(self, key, extract_version=EXTRACT_VERSION):
+        """Return the cached DataFrame, or None on a miss."""
+        path = self._path(key, extract_version)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            df = pl.read_parquet(path)
+        except Exception:
+            # Unreadable (e.g. evicted while reading), treat as a miss
+            self.misses += 1
+            return None
+        # Mark as recently used
+        os.utime(path)
+        self.hits += 1
+        return df
+
+    def put(self, key, df, extract_version=EXTRACT_VERSION):
+        """Store a DataFrame, then evict the least recently used entries if the cache is too big."""
+        path = self._path(key, extract_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        df.write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """All cached files as (path, size, last used) tuples, oldest first."""
+        entries = []
+        paths = [path for pattern in self.FILE_PATTERNS
+                 for path in glob.glob(os.path.join(self.cache_dir, "*", pattern))]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, keep_version=None):
+        """Drop every cached result, or every result not from keep_version (e.g. the newly loaded extract)."""
+        for version_dir in glob.glob(os.path.join(self.cache_dir, "*")):
+            if os.path.isdir(version_dir) and os.path.basename(version_dir) != keep_version:
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def stats(self):
+        """Counters and current size of the cache."""
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
+
+
+class ReportCache(QueryCache):
+    """
+    Size-bounded LRU cache of generated report files, stored as <cache_dir>/<extract_version>/<key>.<format>.
+
+    The key has to cover every input of the report (see service.report_key), a hit is the finished file.
+    """
+
+    FILE_PATTERNS = ("*.pdf", "*.docx", "*.html")
+
+    def _path(self, key, extract_version, output_format='pdf'):
+        return os.path.join(self.cache_dir, extract_version, f"{key}.{output_format}")
+
+    def get(self, key, output_format='pdf', extract_version=EXTRACT_VERSION):
+        """Return the path of the cached report, or None on a miss."""
+        path = self._path(key, extract_version, output_format)
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, report_path, output_format='pdf', extract_version=EXTRACT_VERSION):
+        """Copy a generated report into the cache, evict if the cache is too big and return the cached path."""
+        path = self._path(key, extract_version, output_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Copy to a temporary file first so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(report_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the query result cache.")
+    parser.add_argument('command', choices=['stats', 'invalidate'])
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--keep', default=None, help="Extract version to keep when invalidating (default: none).")
+    args = parser.parse_args(argv)
+
+    cache = QueryCache(args.cache_dir)
+    if args.command == 'invalidate':
+        cache.invalidate(keep_version=args.keep)
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Full-catalog price comparison: every item of a contract priced against its competitors.
+
+The contract's part numbers are walked in chunks of chunk_size (keyset pagination on the part number,
+byte order), and each chunk runs through the 'aggregate' price comparison query, so the competitor
+rows are summarized in Postgres and only one row per contract item comes back. The comparison rows
+of every chunk are spilled to Parquet, and the summary statistics and the manufacturer overview are
+then computed over the spilled files with one streaming collect. Memory is bounded by the chunk
+size, whatever the size of the catalog.
+
+The report gets the same analysis results as a sample report. comparison_items holds the top_items
+items with the largest price differences, and the full comparison is written next to the report.
+
+    EXAMPLE -$
+        CatalogPriceComp(conn, '47QSEA20D003B', chunk_size=2_000).run_sample_report()
+"""
+import glob
+import os
+import shutil
+import tempfile
+
+import polars as pl
+
+from .report import QUERY_NAMES, SamplePriceComp
+from .result_schema import FETCH_SCHEMA, column_fragments, conform, memory_footprint
+
+DEFAULT_CHUNK_SIZE = 1_000
+DEFAULT_TOP_ITEMS = 200
+
+# Reference items of one chunk: all the contract's items whose part number is among the next
+# chunk_size part numbers after after_part_number. COLLATE "C" makes the order match Polars' string order.
+CATALOG_CHUNK_SQL = """
+            SELECT ci.*
+            FROM gsa_product_extract_jan2024 ci
+            JOIN (
+                SELECT DISTINCT manufacturer_part_number COLLATE "C" AS part_number
+                FROM gsa_product_extract_jan2024
+                WHERE contract_number = %(contract_number)s
+                AND manufacturer_part_number COLLATE "C" > %(after_part_number)s
+                ORDER BY 1
+                LIMIT %(chunk_size)s
+            ) chunk_parts ON ci.manufacturer_part_number = chunk_parts.part_number
+            WHERE ci.contract_number = %(contract_number)s
+"""
+
+
+class CatalogPriceComp(SamplePriceComp):
+    """
+    SamplePriceComp over the whole contract catalog instead of a sample.
+
+    Items without a manufacturer part number cannot be matched to competitors and are left out.
+
+    Attributes:
+    -----------
+    chunk_size : int
+        Part numbers per chunk (bounds the rows held in memory).
+    top_items : int
+        Number of comparison items listed in the report, largest absolute percent difference first.
+    spill_dir : str
+        Directory for the temporary chunk files (defaults to the output path).
+    comparison_file : str
+        Parquet file with the full comparison, written next to the report (None to skip it).
+    chunk_count : int
+        Number of chunks processed by the last run.
+    result_mb : float
+        Estimated size of the largest chunk of query results in MB.
+    """
+
+    def __init__(self, conn, contract_number, chunk_size=DEFAULT_CHUNK_SIZE, top_items=DEFAULT_TOP_ITEMS,
+                 spill_dir=None, write_comparison=True, **kwargs):
+        # Chunks always use the aggregate query, the sample options do not apply
+        kwargs['query_mode'] = 'aggregate'
+        kwargs.pop('sample', None)
+        super().__init__(conn, contract_number, **kwargs)
+        self.chunk_size = chunk_size
+        self.top_items = top_items
+        self.spill_dir = spill_dir
+        self.comparison_file = (os.path.join(self.output_path, f"GSA_Comparison_{self.company.contract_number}.parquet")
+                                if write_comparison else None)
+        self.chunk_count = 0
+
+    def run_sample_report(self, convert=True, output_format=None):
+        with self.stage('total') as total:
+            # The chunks are queried and aggregated together, recorded as one query stage
+            with self.stage('query') as record:
+                self.get_contractor_info()
+                self.run_catalog_comparison()
+                record['rows_out'] = self.comparison_df.height
+                record['chunks'] = self.chunk_count
+                record['result_mb'] = self.result_mb
+            self.format_analysis_results()
+            report_path = self.generate_report(output_format or ('pdf' if convert else 'docx'))
+            total['rows_out'] = len(self.analysis_results['comparison_items'])
+        return report_path
+
+    def query_catalog_chunk(self, after_part_number):
+        """Aggregate query results for the chunk of part numbers following after_part_number."""
+        params = {
+            'contract_number': self.company.contract_number,
+            'after_part_number': after_part_number,
+            'chunk_size': self.chunk_size,
+        }
+        query_name = QUERY_NAMES['aggregate']
+        with self.connection() as conn:
+            results = self.queries.fetch_df(conn, query_name, params,
+                                            fragments={'reference_items': CATALOG_CHUNK_SQL,
+                                                       **column_fragments(self.queries[query_name])},
+                                            batch_size=self.fetch_batch_size, schema_overrides=FETCH_SCHEMA)
+        return conform(results, 'aggregate')
+
+    def spill_chunks(self, spill_path):
+        """Compare every chunk and write its comparison rows to spill_path; return the product count."""
+        product_count = 0
+        after_part_number = ""
+        self.chunk_count = 0
+        self.result_mb = None
+        while True:
+            results = self.query_catalog_chunk(after_part_number)
+            self.result_mb = max(self.result_mb or 0.0, memory_footprint(results))
+            # The first chunk is written even when empty so the spilled files always have a schema
+            if results.height == 0 and self.chunk_count > 0:
+                break
+            comparison = self._compare(self._select_contractor_items(results), self._competitor_summary(results))
+            comparison.write_parquet(os.path.join(spill_path, f"chunk-{self.chunk_count:05d}.parquet"))
+            self.chunk_count += 1
+            if results.height == 0:
+                break
+            product_count += results.unique("manufacturer_part_number").get_column("competitor_count").sum()
+            after_part_number = results.get_column("manufacturer_part_number").max()
+        return product_count
+
+    def run_catalog_comparison(self):
+        """Process the catalog chunk by chunk, then compute the report results over the spilled chunks.
+            Fills the same attributes and analysis results as the sample steps (comparison_df holds the top items).
+        """
+        spill_path = tempfile.mkdtemp(prefix=f"catalog_{self.company.contract_number}_",
+                                      dir=self.spill_dir or self.output_path)
+        try:
+            self.analysis_results['product_count'] = self.spill_chunks(spill_path)
+
+            comparison = pl.scan_parquet(sorted(glob.glob(os.path.join(spill_path, "chunk-*.parquet"))))
+            top_items = comparison.sort(pl.col("percent_difference").abs(), descending=True,
+                                        nulls_last=True).head(self.top_items)
+            manufacture_avg_diff_df, stats_df, top_items_df = pl.collect_all(
+                [self._manufacture_average_diff(comparison), self.stats_spec.aggregation(comparison), top_items],
+                engine="streaming")
+            if self.comparison_file:
+                comparison.sink_parquet(self.comparison_file)
+        finally:
+            shutil.rmtree(spill_path, ignore_errors=True)
+
+        self.comparison_df = top_items_df
+        self.contractor_items_df = top_items_df.select([
+            "contractor_name", "contract_number", "manufacturer_part_number", "manufacturer_name",
+            "product_name", "price"])
+        self.manufacture_avg_diff_df = manufacture_avg_diff_df.sort("manufacturer_name")
+        self.analysis_results.update(self.stats_spec.format(stats_df.row(0, named=True)))
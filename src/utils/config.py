@@ -1,6 +1,10 @@
 from dotenv import load_dotenv
+import asyncio
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool as pg_pool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,12 +16,157 @@ DB_PASSWORD = os.getenv("GSADB_PASSWORD")
 DB_HOST = os.getenv("GSADB_HOST")
 DB_PORT = os.getenv("GSADB_PORT")
 
-def get_db_connection():
-    """Establish and return a connection to the PostgreSQL database."""
-    return psycopg2.connect(
+# Connection pool settings (statement timeout in milliseconds, 0 means no timeout)
+DB_POOL_MIN = int(os.getenv("GSADB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("GSADB_POOL_MAX", "8"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("GSADB_STATEMENT_TIMEOUT_MS", "0"))
+
+# Version of the product extract loaded in the database, used to invalidate cached results
+EXTRACT_VERSION = os.getenv("GSADB_EXTRACT_VERSION", "gsa_product_extract_jan2024")
+
+# CSV snapshot of the contract metadata, used instead of the database when set (see utils.contracts)
+CONTRACTS_CSV = os.getenv("GSADB_CONTRACTS_CSV")
+
+
+def _connection_kwargs(statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS):
+    kwargs = dict(
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
         host=DB_HOST,
         port=DB_PORT
     )
+    if statement_timeout_ms:
+        kwargs['options'] = f"-c statement_timeout={int(statement_timeout_ms)}"
+    return kwargs
+
+
+def get_db_connection(statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS):
+    """Establish and return a connection to the PostgreSQL database."""
+    return psycopg2.connect(**_connection_kwargs(statement_timeout_ms))
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections.
+
+    Connections are opened once and reused, so a report does not pay the TCP, TLS and authentication
+    setup again. Checking out blocks while all maxconn connections are in use (up to wait_timeout
+    seconds). Every checked out connection is health checked (a dead one is replaced) and is rolled
+    back when it is returned, so no transaction or session setting leaks into the next user.
+
+        EXAMPLE -$
+            pool = ConnectionPool(minconn=2, maxconn=10, statement_timeout_ms=60_000)
+            with pool.connection() as conn:
+                ...
+            SamplePriceComp(pool, '47QSEA20D003B').run_sample_report()
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+                 health_check=True, wait_timeout=None):
+        self.maxconn = maxconn
+        self.health_check = health_check
+        self.wait_timeout = wait_timeout
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **_connection_kwargs(statement_timeout_ms))
+        # ThreadedConnectionPool raises when it is exhausted, the semaphore makes callers wait instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def is_healthy(conn):
+        """Check that the connection is open and the server answers."""
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        if self.health_check and not self.is_healthy(conn):
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    def _return(self, conn, reset_timeout):
+        if conn.closed:
+            self._pool.putconn(conn, close=True)
+            return
+        try:
+            conn.rollback()
+            if reset_timeout:
+                with conn.cursor() as cursor:
+                    cursor.execute("RESET statement_timeout")
+                conn.commit()
+            self._pool.putconn(conn)
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self, statement_timeout_ms=None):
+        """Check out a connection, optionally with its own statement timeout for the queries run on it."""
+        # wait_timeout None blocks until a connection is returned
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise pg_pool.PoolError(f"No database connection available after {self.wait_timeout}s.")
+        try:
+            conn = self._checkout()
+            try:
+                if statement_timeout_ms is not None:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SET statement_timeout = %s", (int(statement_timeout_ms),))
+                yield conn
+            finally:
+                self._return(conn, statement_timeout_ms is not None)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close every connection of the pool."""
+        self._pool.closeall()
+
+
+class AsyncConnectionPool:
+    """
+    asyncio front end for a ConnectionPool.
+
+    psycopg2 is blocking, so every call runs on a worker thread with its own pooled connection;
+    awaiting several of them keeps that many queries in flight over the one pool.
+
+        EXAMPLE -$
+            async with AsyncConnectionPool(maxconn=10) as pool:
+                results = await asyncio.gather(*[pool.run(query_contract, number) for number in numbers])
+    """
+
+    def __init__(self, pool=None, **pool_kwargs):
+        self.pool = pool or ConnectionPool(**pool_kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _run(self, func, args, statement_timeout_ms):
+        with self.pool.connection(statement_timeout_ms=statement_timeout_ms) as conn:
+            return func(conn, *args)
+
+    async def run(self, func, *args, statement_timeout_ms=None):
+        """Call func(conn, *args) with a pooled connection without blocking the event loop."""
+        return await asyncio.to_thread(self._run, func, args, statement_timeout_ms)
+
+    async def run_blocking(self, func, *args):
+        """Call a blocking func(*args) that checks connections out of the pool itself (e.g. a report
+        built on this pool's ConnectionPool)."""
+        return await asyncio.to_thread(func, *args)
+
+    async def close(self):
+        await asyncio.to_thread(self.pool.close)
@@ -0,0 +1,187 @@
+"""
+Registry of the MAS contract metadata (vendor, address, option and ultimate end dates, socio-economic
+flags), loaded once per process.
+
+All the contracts are held in one columnar Polars table, with the repeated text columns (categories,
+state, flags) as Categorical, plus dict indexes from contract number and from SAM UEI to table rows.
+A lookup is O(1) and a Company object is only built for the contracts that are asked for.
+
+The table comes from the CSV snapshot in GSADB_CONTRACTS_CSV when it is set, otherwise from the
+contract metadata query on the database, and falls back to the sample companies of test.sampleCompany
+when neither is available.
+
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.contracts export /app/output/contracts.csv
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.contracts lookup 47QSEA20D003B
+"""
+import argparse
+from collections import defaultdict
+from dataclasses import fields
+from functools import lru_cache
+
+import polars as pl
+import psycopg2
+
+from .config import CONTRACTS_CSV, get_db_connection
+from .queries import get_query_registry
+from test.sampleCompany import Company, sample_companies
+
+CONTRACT_METADATA_QUERY = 'contract_metadata'
+
+COMPANY_FIELDS = [field.name for field in fields(Company)]
+DATE_FIELDS = ['current_option_period_end_date', 'ultimate_contract_end_date', 'a8a_sole_source_exit_date']
+# Few distinct values over thousands of contracts, stored as Categorical
+CATEGORICAL_FIELDS = [
+    'large_category', 'sub_category', 'source', 'category', 'closed_for_new_award', 'state', 'country',
+    'small_business', 'other_than_small_business', 'woman_owned', 'women_owned_wosb', 'women_owned_edwosb',
+    'veteran_owned', 'service_disabled_veteran_owned', 'small_disadvantaged', 'a8a', 'a8a_sole_source_pool',
+    'hub_zone', 'tribally_owned_firm', 'american_indian_owned', 'alaskan_native_corporation_owned_firm',
+    'native_hawaiian_organization_owned_firm', 'a8a_joint_venture_eligible', 'women_owned_joint_venture_eligible',
+    'service_disabled_veteran_owned_joint_venture_eligible', 'hubzone_joint_venture_eligible', 'state_local',
+]
+
+
+def _field_expr(name, df):
+    if name not in df.columns:
+        dtype = pl.Date if name in DATE_FIELDS else pl.Utf8
+        expr = pl.lit(None, dtype=dtype)
+    elif name in DATE_FIELDS:
+        column = pl.col(name)
+        expr = column.str.to_date(strict=False) if df.schema[name] == pl.Utf8 else column.cast(pl.Date)
+    else:
+        expr = pl.col(name).cast(pl.Utf8)
+    if name in CATEGORICAL_FIELDS:
+        expr = expr.cast(pl.Categorical)
+    elif name in ('contract_number', 'sam_uei'):
+        expr = expr.str.strip_chars()
+    return expr.alias(name)
+
+
+def normalize_contracts(df):
+    """Company columns in field order with compact types, one row per contract number."""
+    return df.select([_field_expr(name, df) for name in COMPANY_FIELDS]).filter(
+        pl.col("contract_number").is_not_null() & (pl.col("contract_number") != "")
+    ).unique(subset="contract_number", keep="first", maintain_order=True)
+
+
+class ContractRegistry:
+    """
+    Contract metadata table with O(1) lookups by contract number and SAM UEI.
+
+    Attributes:
+    -----------
+    df : DataFrame
+        One row per contract, columns named after the Company fields.
+    source : str
+        Where the table was loaded from.
+    """
+
+    def __init__(self, df, source=None):
+        self.df = normalize_contracts(df)
+        self.source = source
+        self._by_contract = {number: row for row, number in enumerate(self.df.get_column("contract_number"))}
+        by_sam_uei = defaultdict(list)
+        for row, sam_uei in enumerate(self.df.get_column("sam_uei")):
+            if sam_uei:
+                by_sam_uei[sam_uei].append(row)
+        self._by_sam_uei = dict(by_sam_uei)
+
+    def __repr__(self):
+        return f"ContractRegistry({len(self)} contracts from {self.source})"
+
+    def __len__(self):
+        return self.df.height
+
+    def __contains__(self, contract_number):
+        return contract_number in self._by_contract
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a CSV snapshot (e.g. written by write_csv) with one column per Company field."""
+        return cls(pl.read_csv(path, infer_schema_length=0), source=path)
+
+    @classmethod
+    def from_db(cls, conn, queries=None):
+        """Load every contract with the contract metadata query."""
+        df = (queries or get_query_registry()).fetch_df(conn, CONTRACT_METADATA_QUERY)
+        return cls(df, source="database")
+
+    @classmethod
+    def from_companies(cls, companies):
+        """Build the table from Company objects (the sample companies)."""
+        rows = [{name: getattr(company, name) for name in COMPANY_FIELDS} for company in companies]
+        schema = {name: pl.Date if name in DATE_FIELDS else pl.Utf8 for name in COMPANY_FIELDS}
+        return cls(pl.DataFrame(rows, schema=schema), source="sample companies")
+
+    def company(self, row):
+        """Company object of a table row."""
+        return Company(**self.df.row(row, named=True))
+
+    def get(self, contract_number):
+        """Company of a contract number, or None."""
+        row = self._by_contract.get((contract_number or "").strip())
+        return None if row is None else self.company(row)
+
+    def by_sam_uei(self, sam_uei):
+        """Companies of every contract held by a SAM UEI (a vendor can hold several contracts)."""
+        return [self.company(row) for row in self._by_sam_uei.get((sam_uei or "").strip(), [])]
+
+    def write_csv(self, path):
+        """Write the table as a CSV snapshot for from_csv."""
+        self.df.write_csv(path)
+
+
+def load_contract_registry(csv_path=CONTRACTS_CSV):
+    """Load the registry from the CSV snapshot, the database or the sample companies (in that order)."""
+    if csv_path:
+        return ContractRegistry.from_csv(csv_path)
+    try:
+        conn = get_db_connection()
+        try:
+            return ContractRegistry.from_db(conn)
+        finally:
+            conn.close()
+    except psycopg2.Error as exc:
+        print(f"Contract metadata not available from the database ({str(exc).strip()}), "
+              f"using the sample companies.")
+        return ContractRegistry.from_companies(sample_companies())
+
+
+@lru_cache(maxsize=None)
+def get_contract_registry(csv_path=CONTRACTS_CSV):
+    """The process wide registry, loaded on first use."""
+    return load_contract_registry(csv_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or query the contract metadata registry.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="Write the contract metadata from the database to a CSV snapshot.")
+    export.add_argument('path')
+    lookup = subparsers.add_parser('lookup', help="Print the metadata of a contract number or SAM UEI.")
+    lookup.add_argument('key')
+    lookup.add_argument('--csv', default=CONTRACTS_CSV, help="CSV snapshot to read instead of the database.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        conn = get_db_connection()
+        try:
+            registry = ContractRegistry.from_db(conn)
+        finally:
+            conn.close()
+        registry.write_csv(args.path)
+        print(f"Wrote {len(registry)} contracts to {args.path}")
+        return
+
+    registry = get_contract_registry(args.csv)
+    company = registry.get(args.key)
+    companies = [company] if company else registry.by_sam_uei(args.key)
+    if not companies:
+        print(f"No contract or SAM UEI {args.key} in {registry}.")
+    for company in companies:
+        print(company)
+        for name in COMPANY_FIELDS:
+            print(f"    {name}: {getattr(company, name)}")
+
+
+if __name__ == "__main__":
+    main()
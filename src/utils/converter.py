@@ -0,0 +1,240 @@
+import glob
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+# Converter shared by the reports of the current process (see get_default_converter)
+_default_converter = None
+_default_converter_pid = None
+
+
+class SofficeConverter:
+    """
+    Convert Word documents to PDF with a headless LibreOffice instance.
+
+    Every converter owns a private LibreOffice user profile, so several converters can run at the same
+    time (in threads or processes) without colliding on the profile lock. The profile is created once by
+    warm_up() and reused, which removes the first-start cost from every later conversion. Converting many
+    documents in one call pays the LibreOffice start-up only once for the whole batch.
+
+    Attributes:
+    -----------
+    profile_dir : str
+        Directory holding the private LibreOffice user profile.
+    timings : list
+        One dictionary per converted document with 'file', 'seconds', 'batch_size' and 'ok'. In a batch
+        the seconds are the batch wall time split evenly across its documents.
+    """
+
+    def __init__(self, profile_dir=None, soffice='soffice', timeout=300):
+        self.soffice = soffice
+        self.timeout = timeout
+        self._owns_profile = profile_dir is None
+        self.profile_dir = profile_dir or tempfile.mkdtemp(prefix="soffice-profile-")
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def _command(self, word_file_paths, output_dir):
+        return [self.soffice,
+                f"-env:UserInstallation=file://{os.path.abspath(self.profile_dir)}",
+                '--headless',
+                '--norestore',
+                '--convert-to',
+                'pdf',
+                '--outdir',
+                output_dir,
+                *word_file_paths]
+
+    def warm_up(self):
+        """Start LibreOffice once so the user profile exists before the first real conversion."""
+        with self._lock:
+            subprocess.run([self.soffice,
+                            f"-env:UserInstallation=file://{os.path.abspath(self.profile_dir)}",
+                            '--headless',
+                            '--terminate_after_init'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout)
+
+    def convert(self, word_file_path, output_dir):
+        """Convert a single Word document and return the PDF path."""
+        return self.convert_many([word_file_path], output_dir)[0]
+
+    def convert_many(self, word_file_paths, output_dir):
+        """Convert all the Word documents with a single LibreOffice call and return the PDF paths."""
+        pdf_paths = self.try_convert_many(word_file_paths, output_dir)
+        for word_file_path, pdf_path in zip(word_file_paths, pdf_paths):
+            if pdf_path is None:
+                raise RuntimeError(f"LibreOffice failed to convert {word_file_path}")
+        return pdf_paths
+
+    def try_convert_many(self, word_file_paths, output_dir):
+        """Like convert_many(), but return None for the documents that failed instead of raising."""
+        if not word_file_paths:
+            return []
+
+        # Remove stale PDFs so a failed conversion is not mistaken for a finished one
+        expected_paths = []
+        for word_file_path in word_file_paths:
+            base_name = os.path.splitext(os.path.basename(word_file_path))[0]
+            pdf_path = os.path.join(output_dir, base_name + '.pdf')
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+            expected_paths.append(pdf_path)
+
+        # LibreOffice only allows one running instance per profile
+        with self._lock:
+            start = time.perf_counter()
+            subprocess.run(self._command(word_file_paths, output_dir),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout)
+            seconds = time.perf_counter() - start
+
+        pdf_paths = []
+        for word_file_path, pdf_path in zip(word_file_paths, expected_paths):
+            converted = os.path.exists(pdf_path)
+            pdf_paths.append(pdf_path if converted else None)
+            self.timings.append({'file': word_file_path,
+                                 'seconds': seconds / len(word_file_paths),
+                                 'batch_size': len(word_file_paths),
+                                 'ok': converted})
+        return pdf_paths
+
+    def convert_directory(self, input_dir, output_dir=None):
+        """Convert every .docx file in a directory with a single LibreOffice call."""
+        word_file_paths = sorted(glob.glob(os.path.join(input_dir, '*.docx')))
+        return self.convert_many(word_file_paths, output_dir or input_dir)
+
+    def close(self):
+        """Remove the private profile if this converter created it."""
+        if self._owns_profile:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class ConverterPool:
+    """
+    Serve DOCX to PDF conversions from a queue with one or more warm LibreOffice converters.
+
+    Each worker thread owns a SofficeConverter with its own profile. When a worker picks up a request it
+    also drains whatever else is waiting in the queue (up to max_batch documents) and converts them all in
+    one LibreOffice call, so the start-up cost is shared by everything submitted in the meantime.
+
+        EXAMPLE -$
+            with ConverterPool(instances=2) as pool:
+                futures = [pool.submit(path, "/app/output/") for path in word_files]
+                pdf_paths = [future.result() for future in futures]
+    """
+
+    def __init__(self, instances=1, max_batch=50, soffice='soffice', timeout=300, warm=True):
+        self.max_batch = max_batch
+        self.converters = [SofficeConverter(soffice=soffice, timeout=timeout) for _ in range(instances)]
+        self._queue = queue.Queue()
+        self._threads = []
+        for converter in self.converters:
+            if warm:
+                converter.warm_up()
+            thread = threading.Thread(target=self._worker, args=(converter,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def timings(self):
+        """Per-conversion timings from all the converters."""
+        return [timing for converter in self.converters for timing in converter.timings]
+
+    def submit(self, word_file_path, output_dir):
+        """Queue a Word document for conversion and return a Future resolving to the PDF path."""
+        future = Future()
+        self._queue.put((word_file_path, output_dir, future))
+        return future
+
+    def convert(self, word_file_path, output_dir):
+        """Convert a single Word document and wait for the PDF path."""
+        return self.submit(word_file_path, output_dir).result()
+
+    def convert_many(self, word_file_paths, output_dir):
+        """Convert the documents across all the converters and return the PDF paths in order."""
+        futures = [self.submit(word_file_path, output_dir) for word_file_path in word_file_paths]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Leave the shutdown signal for this worker's next loop
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _worker(self, converter):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # One LibreOffice call per output directory in the batch
+            by_output_dir = {}
+            for word_file_path, output_dir, future in batch:
+                by_output_dir.setdefault(output_dir, []).append((word_file_path, future))
+
+            for output_dir, jobs in by_output_dir.items():
+                try:
+                    pdf_paths = converter.try_convert_many([path for path, _ in jobs], output_dir)
+                except Exception as exc:
+                    for _, future in jobs:
+                        future.set_exception(exc)
+                    continue
+                for (word_file_path, future), pdf_path in zip(jobs, pdf_paths):
+                    if pdf_path is None:
+                        future.set_exception(RuntimeError(f"LibreOffice failed to convert {word_file_path}"))
+                    else:
+                        future.set_result(pdf_path)
+
+    def close(self):
+        """Stop the workers after the queued conversions finish and remove the profiles."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        for converter in self.converters:
+            converter.close()
+
+
+def get_default_converter():
+    """Return the converter shared by the current process, creating it on first use.
+
+    The converter is recreated after a fork so every worker process gets its own profile. The process
+    removes that profile with close_default_converter() when it is done with the reports.
+    """
+    global _default_converter, _default_converter_pid
+    if _default_converter is None or _default_converter_pid != os.getpid():
+        _default_converter = SofficeConverter()
+        _default_converter_pid = os.getpid()
+    return _default_converter
+
+
+def close_default_converter():
+    """Remove the profile of the current process's default converter, if it created one.
+        A converter inherited through a fork belongs to the parent and is left alone.
+    """
+    global _default_converter, _default_converter_pid
+    if _default_converter is not None and _default_converter_pid == os.getpid():
+        _default_converter.close()
+    _default_converter = None
+    _default_converter_pid = None
@@ -2,31 +2,53 @@ import polars as pl
 
 
 class DataFrameCleaner:
-    """A class of just static methods to clean the DataFrame columns and format the data."""
+    """A class of just static methods to clean the DataFrame columns and format the data.
+
+    The formatting is built from native Polars expressions (no per-cell Python callbacks), and every
+    requested column is formatted in a single with_columns pass. Works on DataFrames and LazyFrames.
+    Missing and non-finite values are formatted as "N/A".
+    """
 
     def __init__(self):
         pass
 
+    @staticmethod
+    def two_decimal_expr(expr):
+        # Format a float expression with exactly 2 decimals: work in integer hundredths so the
+        # fractional part can be zero padded ("1.5" -> "1.50"); NaN/inf fail the cast and become null
+        hundredths = expr.round(2).mul(100).round(0).cast(pl.Int64, strict=False)
+        sign = pl.when(hundredths < 0).then(pl.lit("-")).otherwise(pl.lit(""))
+        whole = (hundredths.abs() // 100).cast(pl.Utf8)
+        fraction = (hundredths.abs() % 100).cast(pl.Utf8).str.zfill(2)
+        return pl.concat_str([sign, whole, pl.lit("."), fraction])
+
+    @staticmethod
+    def percent_expr(column):
+        # 0.1234 -> "12.34%"
+        formatted = DataFrameCleaner.two_decimal_expr(pl.col(column) * 100)
+        return pl.concat_str([formatted, pl.lit("%")]).fill_null("N/A").alias(column)
+
+    @staticmethod
+    def price_expr(column):
+        # 12.3 -> "$12.30"
+        formatted = DataFrameCleaner.two_decimal_expr(pl.col(column))
+        return pl.concat_str([pl.lit("$"), formatted]).fill_null("N/A").alias(column)
+
+    @staticmethod
+    def format_columns(df, percent_columns=(), price_columns=()):
+        # Format the percent and price columns together in one pass
+        exprs = [DataFrameCleaner.percent_expr(column) for column in percent_columns]
+        exprs += [DataFrameCleaner.price_expr(column) for column in price_columns]
+        if not exprs:
+            return df
+        return df.with_columns(exprs)
+
     @staticmethod
     def format_percent_columns(df, column_list):
-        # Format the percent_difference column to limit decimal places to 2
-        for column in column_list:
-            df = df.with_columns(
-                (pl.col(column) * 100).round(2).map_elements(
-                    lambda x: f"{x:.2f}%" if x is not None else "N/A",
-                    return_dtype=pl.Utf8
-                )
-            )
-        return df
+        # Format the percent columns as percentages limited to 2 decimal places
+        return DataFrameCleaner.format_columns(df, percent_columns=column_list)
 
     @staticmethod
     def format_price_columns(df, column_list):
-        # Format the percent_difference column to limit decimal places to 2
-        for column in column_list:
-            df = df.with_columns(
-                pl.col(column).round(2).map_elements(
-                    lambda x: f"${x:.2f}" if x is not None else "N/A",
-                    return_dtype=pl.Utf8
-                )
-            )
-        return df
+        # Format the price columns as dollars limited to 2 decimal places
+        return DataFrameCleaner.format_columns(df, price_columns=column_list)
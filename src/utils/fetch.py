@@ -0,0 +1,70 @@
+"""
+Streaming query results into Polars (Arrow memory) in bounded batches.
+
+pl.read_database on a psycopg2 connection fetches the whole result as Python tuples before the
+columns are built, then price has to be re-cast from Decimal. Here the rows are pulled from a
+server-side cursor batch_size rows at a time and every batch is turned into columnar data right away,
+with the column types taken from the Postgres result description instead of being inferred from the
+values. numeric is decoded straight to float, so no Decimal objects are created. Peak Python object
+memory is one batch, whatever the size of the result.
+"""
+import uuid
+
+import polars as pl
+import psycopg2.extensions
+
+DEFAULT_BATCH_SIZE = 50_000
+
+# Postgres type OIDs (psycopg2 type_code) mapped to Polars types
+PG_TYPES = {
+    16: pl.Boolean,
+    20: pl.Int64, 21: pl.Int64, 23: pl.Int64,
+    700: pl.Float64, 701: pl.Float64, 1700: pl.Float64,
+    18: pl.Utf8, 19: pl.Utf8, 25: pl.Utf8, 1042: pl.Utf8, 1043: pl.Utf8,
+    1082: pl.Date,
+    1114: pl.Datetime, 1184: pl.Datetime,
+}
+
+# Decode numeric columns straight to float instead of Decimal
+DECIMAL_TO_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    'DECIMAL_TO_FLOAT',
+    lambda value, cursor: float(value) if value is not None else None,
+)
+
+
+def result_schema(description, schema_overrides=None):
+    """Polars schema of a cursor result, from the Postgres column types (unknown types are inferred)."""
+    schema_overrides = schema_overrides or {}
+    return [(column.name, schema_overrides.get(column.name, PG_TYPES.get(column.type_code)))
+            for column in description]
+
+
+def iter_batches(conn, query, params=None, batch_size=DEFAULT_BATCH_SIZE, schema_overrides=None, server_side=True):
+    """Run the query on a server-side cursor and yield the result as DataFrames of up to batch_size rows.
+
+    Every batch has the same explicit schema, so they can be concatenated or written out as they come.
+    With server_side=False a regular cursor is used (needed for EXECUTE of a prepared statement, which
+    cannot be declared as a cursor): libpq then holds the whole result, but the Python objects are
+    still only built one batch at a time.
+    """
+    cursor_name = f"fetch_{uuid.uuid4().hex}" if server_side else None
+    with conn.cursor(name=cursor_name) as cursor:
+        psycopg2.extensions.register_type(DECIMAL_TO_FLOAT, cursor)
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+
+        rows = cursor.fetchmany(batch_size)
+        schema = result_schema(cursor.description, schema_overrides)
+        if not rows:
+            yield pl.DataFrame(schema=[(name, dtype or pl.Null) for name, dtype in schema])
+            return
+        while rows:
+            yield pl.DataFrame(rows, schema=schema, orient="row", strict=False, infer_schema_length=None)
+            rows = cursor.fetchmany(batch_size)
+
+
+def fetch_df(conn, query, params=None, batch_size=DEFAULT_BATCH_SIZE, schema_overrides=None, server_side=True):
+    """Fetch the whole result as one DataFrame, built batch by batch (see iter_batches)."""
+    batches = list(iter_batches(conn, query, params, batch_size, schema_overrides, server_side))
+    return pl.concat(batches, how="vertical_relaxed", rechunk=False)
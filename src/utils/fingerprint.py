@@ -0,0 +1,151 @@
+"""
+Fingerprints of the inputs of a report and the manifest they are kept in, for incremental batch runs.
+
+A report depends on
+    - the contract's own items (report_fingerprint_contract: a hash of its rows),
+    - the competitor items of its sampled part numbers (report_fingerprint_competitors: a hash of the
+      count, sum, sum of squares, min and max of the price per part number),
+    - the analysis: query mode, sample, deviation thresholds, the SQL and the analysis code (analysis_version),
+    - for the file itself, the formatted analysis results, the contract dates, the template and the format.
+
+SamplePriceComp.run_incremental_report() compares them with the manifest entry of the last run: when the
+data fingerprint is unchanged the query, aggregation and formatting stages are skipped and the stored
+analysis results are reused, and when the render fingerprint is unchanged (and the file still exists)
+the render and convert stages are skipped too. Every contract has its own entry file, so the worker
+processes of a batch run never write the same file:
+
+    <output_path>/.manifest/<contract_number>.json
+
+The competitor fingerprint uses the exact part numbers, so in 'normalized' mode the extract version is
+part of the data fingerprint as well (other spellings of a part number are not covered by the hash).
+
+    EXAMPLE -$ python3 src/batch.py --file contracts.txt --incremental
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.fingerprint show /app/output/
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+
+import polars as pl
+
+from .queries import get_query_registry
+
+CONTRACT_QUERY = 'report_fingerprint_contract'
+COMPETITORS_QUERY = 'report_fingerprint_competitors'
+MANIFEST_DIR = ".manifest"
+
+# Source files of the analysis; any change to them invalidates the stored analysis results
+ANALYSIS_MODULES = ('report.py', 'stats.py', 'dfc.py', 'market_index.py', 'part_keys.py', 'sampling.py',
+                    'bootstrap.py', 'result_schema.py')
+# Context keys the templates do not show, left out of the render fingerprint
+UNRENDERED_KEYS = ('current_date',)
+
+
+def fingerprint(*parts):
+    """sha256 of JSON serializable parts (other values by their str())."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_hash(path):
+    """sha256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def analysis_version():
+    """Hash of the source of the analysis modules."""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    return fingerprint(*[file_hash(os.path.join(module_dir, name)) for name in ANALYSIS_MODULES])
+
+
+def render_fingerprint(context, output_format, template_path):
+    """Fingerprint of a report file: the rendered context, the format and the template."""
+    rendered = {key: value for key, value in context.items() if key not in UNRENDERED_KEYS}
+    return fingerprint(rendered, output_format, file_hash(template_path))
+
+
+def contract_fingerprint(conn, contract_number, queries=None):
+    """Row count and hash of a contract's own items."""
+    df = (queries or get_query_registry()).fetch_df(conn, CONTRACT_QUERY, {'contract_number': contract_number})
+    return df.row(0, named=True)
+
+
+def competitor_fingerprint(conn, contract_number, part_numbers, queries=None):
+    """Part numbers with competitors and hash of the competitor price aggregates of the given part numbers."""
+    df = (queries or get_query_registry()).fetch_df(conn, COMPETITORS_QUERY, {
+        'contract_number': contract_number, 'part_numbers': list(part_numbers),
+    })
+    return df.row(0, named=True)
+
+
+class ReportManifest:
+    """
+    Fingerprints, report path and analysis results of the last run of every contract.
+
+    Attributes:
+    -----------
+    path : str
+        Directory holding one JSON entry per contract (<output_path>/.manifest by default).
+    """
+
+    def __init__(self, output_path, path=None):
+        self.path = path or os.path.join(output_path, MANIFEST_DIR)
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return f"ReportManifest({self.path!r})"
+
+    def _entry_path(self, contract_number):
+        return os.path.join(self.path, f"{contract_number}.json")
+
+    def get(self, contract_number):
+        """The entry of a contract, or None if it was never run (or the entry is unreadable)."""
+        try:
+            with open(self._entry_path(contract_number), 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, contract_number, entry):
+        """Store the entry of a contract, replacing the previous one atomically."""
+        entry = {**entry, 'contract_number': contract_number,
+                 'updated_at': datetime.now().isoformat(timespec='seconds')}
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, 'w') as file:
+            json.dump(entry, file, default=str)
+        os.replace(tmp_path, self._entry_path(contract_number))
+
+    def entries(self):
+        """All the entries, without their analysis results."""
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.path, "*.json"))):
+            with open(path, 'r') as file:
+                entry = json.load(file)
+            entry.pop('analysis_results', None)
+            entries.append(entry)
+        return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the report manifest of an output directory.")
+    parser.add_argument('command', choices=['show'])
+    parser.add_argument('output_path')
+    args = parser.parse_args(argv)
+
+    entries = ReportManifest(args.output_path).entries()
+    columns = ['contract_number', 'output_format', 'updated_at', 'analysis_reused', 'report_reused', 'report_path']
+    with pl.Config(tbl_rows=-1, tbl_width_chars=200, fmt_str_lengths=80):
+        print(pl.DataFrame([{column: entry.get(column) for column in columns} for entry in entries]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Per-stage instrumentation of the report runs: wall time, rows in and out, and memory of every stage.
+
+SamplePriceComp.run_sample_report() goes through the stages query, aggregation, formatting, render and
+convert (plus a 'total' record per report, and a 'fingerprint' stage in incremental runs, which skip the
+stages whose inputs are unchanged). Given a StageRecorder as its instrument, every stage is
+written as one JSON line, so the output of a batch run can be aggregated (see summarize()):
+
+    {"contract_number": "47QSEA20D003B", "stage": "query", "rows_in": null, "rows_out": 18342, "ok": true,
+     "seconds": 0.412, "rss_mb": 212.4, "peak_rss_mb": 230.1, "children_peak_rss_mb": 0.0, "pid": 4242, ...}
+
+The query stage also records result_mb, the estimated size of the query results.
+rss_mb is the resident memory at the end of the stage and peak_rss_mb the peak of the process so far
+(it never decreases, so the stage that raised it is the first one reporting the new value).
+children_peak_rss_mb is the largest child process so far, i.e. LibreOffice after a convert stage.
+
+profile_report() runs a single report under cProfile and dumps the stats (the Python side only, the
+LibreOffice conversion runs in another process).
+
+    EXAMPLE -$ python3 src/batch.py --file contracts.txt --stages output/stages.jsonl
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.instrument summarize output/stages.jsonl
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.instrument profile 47QSEA20D003B --profile-output output/report.prof
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import polars as pl
+
+from .config import get_db_connection
+from .converter import close_default_converter
+from .report import QUERY_NAMES, REPORT_FORMATS, SamplePriceComp
+
+STAGES = ('fingerprint', 'query', 'aggregation', 'formatting', 'render', 'convert', 'total')
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_MAXRSS_PER_MB = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+
+def _current_rss_mb():
+    """Resident memory of this process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def memory_usage():
+    """Current and peak resident memory in MB of this process, and the peak of its child processes."""
+    rss_mb = _current_rss_mb()
+    return {
+        'rss_mb': None if rss_mb is None else round(rss_mb, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / _MAXRSS_PER_MB, 1),
+        'children_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / _MAXRSS_PER_MB, 1),
+    }
+
+
+class StageRecorder:
+    """
+    Records the stages of report runs as JSON lines.
+
+    Every line is written with a single append, so the worker processes of a batch run can share one file.
+
+    Attributes:
+    -----------
+    path : str
+        JSON lines file the records are appended to.
+    stream : file object
+        Stream the records are written to (e.g. sys.stderr), in addition to or instead of path.
+    records : list
+        The records, kept only when there is neither a path nor a stream.
+    """
+
+    def __init__(self, path=None, stream=None):
+        self.path = path
+        self.stream = stream
+        self.records = []
+
+    def __repr__(self):
+        return f"StageRecorder({self.path or self.stream!r})"
+
+    @contextmanager
+    def stage(self, contract_number, name, rows_in=None, **fields):
+        """Time the block and emit its record. The block can set record['rows_out'] (and other fields)."""
+        record = {'contract_number': contract_number, 'stage': name, 'rows_in': rows_in, 'rows_out': None,
+                  **fields}
+        start = time.perf_counter()
+        try:
+            yield record
+            record['ok'] = True
+        except BaseException as exc:
+            record['ok'] = False
+            record['error'] = type(exc).__name__
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            record.update(memory_usage())
+            self.emit(record)
+
+    def emit(self, record):
+        record['pid'] = os.getpid()
+        record['timestamp'] = datetime.now().isoformat(timespec='milliseconds')
+        line = json.dumps(record, default=str) + "\n"
+        if self.path:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+        if self.stream is not None:
+            self.stream.write(line)
+            self.stream.flush()
+        if not self.path and self.stream is None:
+            self.records.append(record)
+
+
+def summarize(path):
+    """Count, total, mean, p50, p95 and max seconds, rows out and peak memory by stage of a JSON lines file."""
+    records = pl.read_ndjson(path, infer_schema_length=None)
+    seconds = pl.col("seconds")
+    order = {stage: position for position, stage in enumerate(STAGES)}
+    return records.group_by("stage").agg(
+        pl.len().alias("count"),
+        (~pl.col("ok")).sum().alias("failed"),
+        seconds.sum().round(3).alias("total_seconds"),
+        seconds.mean().round(3).alias("mean_seconds"),
+        seconds.median().round(3).alias("p50_seconds"),
+        seconds.quantile(0.95).round(3).alias("p95_seconds"),
+        seconds.max().round(3).alias("max_seconds"),
+        pl.col("rows_out").mean().round(1).alias("mean_rows_out"),
+        pl.col("peak_rss_mb").max().alias("peak_rss_mb"),
+        # Size of the query results (see utils.result_schema), on the query stages
+        *([pl.col("result_mb").max().alias("max_result_mb")] if "result_mb" in records.columns else []),
+    ).sort(pl.col("stage").replace_strict(order, default=len(STAGES), return_dtype=pl.Int64))
+
+
+def profile_report(price_comp, profile_path, sort='cumulative', limit=30, **run_options):
+    """Run one report under cProfile, dump the stats to profile_path and print the top functions.
+        Return the report path.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(price_comp.run_sample_report, **run_options)
+    finally:
+        # Also dumped when the report fails
+        profiler.dump_stats(profile_path)
+        pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize stage records or profile a single report.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary = subparsers.add_parser('summarize', help="Aggregate a JSON lines file of stage records by stage.")
+    summary.add_argument('path')
+    profile = subparsers.add_parser('profile', help="Run one contract's report under cProfile.")
+    profile.add_argument('contract_number')
+    profile.add_argument('--profile-output', default="/app/output/report.prof", help="cProfile stats file.")
+    profile.add_argument('--output', default="/app/output/", help="Directory for the generated report.")
+    profile.add_argument('--query-mode', choices=list(QUERY_NAMES), default='rows')
+    profile.add_argument('--format', choices=list(REPORT_FORMATS), default='pdf')
+    profile.add_argument('--lazy', action='store_true', help="Run the analysis as one LazyFrame query.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'summarize':
+        with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+            print(summarize(args.path))
+        return
+
+    conn = get_db_connection()
+    try:
+        price_comp = SamplePriceComp(conn, args.contract_number, output_path=args.output,
+                                     query_mode=args.query_mode, lazy=args.lazy,
+                                     instrument=StageRecorder(stream=sys.stdout))
+        report_path = profile_report(price_comp, args.profile_output, output_format=args.format)
+    finally:
+        conn.close()
+        close_default_converter()
+    print(f"Wrote {report_path} and the profile {args.profile_output}")
+
+
+if __name__ == "__main__":
+    main()
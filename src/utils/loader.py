@@ -0,0 +1,263 @@
+"""
+Incremental loader of a new monthly GSA Advantage product extract into gsa_product_extract_jan2024.
+
+Instead of reloading the whole table (or deleting rows with large IN (SELECT ...) statements), a load:
+    1. copies the new extract (CSV or Parquet) into an unlogged, unindexed staging table with COPY,
+       streaming it in chunks over several connections in parallel,
+    2. diffs the staging table against the current table by jprod_id and an md5 hash of the loaded
+       columns (extract_load_diff), so only new, changed and removed rows are touched,
+    3. deletes, updates and inserts those rows in batches of batch_size jprod_ids, one transaction per
+       batch, so locks and WAL stay bounded and the reports keep running during the load,
+    4. fills in and indexes sample_key for the new rows (sample_key_migration), rebuilds the indexes
+       when a large share of the table changed, and vacuums and analyzes the table,
+    5. records the extract version in gsa_extract_versions, optionally rebuilds the market price index
+       and the part key index, and drops the cached query results of the older extracts.
+
+The table keeps its name, so the report queries are unchanged; set GSADB_EXTRACT_VERSION to the loaded
+version for the reports and the cache.
+
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.loader /data/gsa_advantage_feb2024.csv --extract-version gsa_product_extract_feb2024
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.loader /data/feb2024.parquet --extract-version feb2024 --dry-run
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+import polars as pl
+from psycopg2.extensions import quote_ident
+
+from .cache import QueryCache
+from .config import get_db_connection
+from .market_index import build_market_index
+from .part_keys import build_part_key_index
+from .queries import get_query_registry
+from .sampling import ensure_sample_key
+
+STAGING_TABLE = "gsa_product_extract_staging"
+# Columns the loader never takes from the extract file: the key and the precomputed sampling key
+KEY_COLUMN = "jprod_id"
+DERIVED_COLUMNS = ("sample_key",)
+# Rebuild the indexes when more than this share of the table was inserted, updated or deleted
+REINDEX_FRACTION = 0.2
+# Smaller than any jprod_id, the start of the batch keyset
+_MIN_ID = -2 ** 63
+ACTIONS = {'D': 'extract_load_delete', 'U': 'extract_load_update', 'I': 'extract_load_insert'}
+
+
+def scan_extract(path):
+    """Lazily scan an extract file. CSV columns are read as text, so Postgres parses every value itself
+    (leading zeros of part numbers survive)."""
+    if path.endswith(".parquet"):
+        return pl.scan_parquet(path)
+    return pl.scan_csv(path, infer_schema=False)
+
+
+def extract_columns(conn, queries):
+    """Columns of the product extract table."""
+    return queries.fetch_df(conn, 'extract_columns').get_column("column_name").to_list()
+
+
+def load_columns(file_columns, table_columns):
+    """Columns to load from the file: those of the table, without the key and the derived columns."""
+    if KEY_COLUMN not in file_columns:
+        raise ValueError(f"The extract has no {KEY_COLUMN} column.")
+    unknown = [column for column in file_columns if column not in table_columns]
+    if unknown:
+        raise ValueError(f"Extract columns not in the table: {unknown}.")
+    return [column for column in file_columns if column != KEY_COLUMN and column not in DERIVED_COLUMNS]
+
+
+def _copy_worker(batches, columns, errors, counts):
+    """Copy the batches of the queue into the staging table over one connection until a None arrives."""
+    conn = get_db_connection()
+    copy_sql = f"COPY {STAGING_TABLE} ({', '.join(quote_ident(column, conn) for column in columns)}) " \
+               f"FROM STDIN WITH (FORMAT csv)"
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if errors:
+                continue  # drain the queue after a failure
+            try:
+                buffer = io.BytesIO()
+                batch.write_csv(buffer, include_header=False)
+                buffer.seek(0)
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(copy_sql, buffer)
+                conn.commit()
+                counts.append(batch.height)
+            except Exception as exc:
+                conn.rollback()
+                errors.append(exc)
+    finally:
+        conn.close()
+
+
+def copy_to_staging(path, columns, workers=4, chunk_rows=200_000):
+    """Stream the extract file into the staging table in chunks, COPYing over workers connections in parallel.
+        Return the number of rows copied.
+    """
+    batches = queue.Queue(maxsize=workers * 2)
+    errors, counts = [], []
+    threads = [threading.Thread(target=_copy_worker, args=(batches, columns, errors, counts), daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for batch in scan_extract(path).select(columns).collect_batches(chunk_size=chunk_rows):
+            if errors:
+                break
+            batches.put(batch)
+    finally:
+        for _ in threads:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return sum(counts)
+
+
+def apply_changes(conn, action, fragments, batch_size, queries):
+    """Apply the diff rows of one action ('D', 'U' or 'I') in batches of jprod_ids, one commit per batch.
+        Return the number of rows changed.
+    """
+    changed = 0
+    after_id = _MIN_ID
+    while True:
+        last_id = queries.fetch_df(conn, 'extract_load_next_batch', {
+            'action': action, 'after_id': after_id, 'batch_size': batch_size,
+        }).get_column("last_id")[0]
+        if last_id is None:
+            return changed
+        changed += queries.execute(conn, ACTIONS[action], {'after_id': after_id, 'last_id': last_id},
+                                   fragments=fragments if action != 'D' else None)
+        conn.commit()
+        after_id = last_id
+
+
+def vacuum(conn, queries):
+    """VACUUM (ANALYZE) the extract table, which cannot run inside a transaction."""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        queries.execute(conn, 'extract_vacuum')
+    finally:
+        conn.autocommit = autocommit
+
+
+def load_extract(path, extract_version, workers=4, batch_size=50_000, chunk_rows=200_000,
+                 reindex_fraction=REINDEX_FRACTION, market_index=False, part_keys=False, cache_dir=None,
+                 dry_run=False, queries=None):
+    """Load a new extract file incrementally (see the module docstring) and return a summary of the load.
+        With dry_run the diff is computed and reported, but the table is not changed.
+    """
+    queries = queries or get_query_registry()
+    summary = {'extract_version': extract_version, 'source_path': path, 'seconds': {}}
+
+    def phase(name, start):
+        summary['seconds'][name] = round(time.perf_counter() - start, 1)
+
+    conn = get_db_connection()
+    try:
+        file_columns = scan_extract(path).collect_schema().names()
+        columns = load_columns(file_columns, extract_columns(conn, queries))
+        quoted = [quote_ident(column, conn) for column in columns]
+        fragments = {
+            'columns': ", ".join(quoted),
+            'staged_columns': ", ".join(f"staged.{column}" for column in quoted),
+        }
+
+        start = time.perf_counter()
+        queries.execute(conn, 'extract_load_staging')
+        conn.commit()
+        summary['row_count'] = copy_to_staging(path, [KEY_COLUMN, *columns], workers, chunk_rows)
+        phase('copy', start)
+
+        check = queries.fetch_df(conn, 'extract_load_check').row(0, named=True)
+        if check['duplicate_ids'] or check['missing_ids']:
+            raise ValueError(f"The extract has {check['duplicate_ids']} duplicate and {check['missing_ids']} "
+                             f"missing {KEY_COLUMN} values.")
+
+        start = time.perf_counter()
+        queries.execute(conn, 'extract_load_diff', fragments={'columns': fragments['columns']})
+        conn.commit()
+        counts = dict(queries.fetch_df(conn, 'extract_load_counts').iter_rows())
+        summary.update(inserted=counts.get('I', 0), updated=counts.get('U', 0), deleted=counts.get('D', 0))
+        phase('diff', start)
+        if dry_run:
+            queries.execute(conn, 'extract_load_cleanup')
+            conn.commit()
+            return summary
+
+        start = time.perf_counter()
+        for action, name in (('D', 'deleted'), ('U', 'updated'), ('I', 'inserted')):
+            summary[name] = apply_changes(conn, action, fragments, batch_size, queries)
+        queries.execute(conn, 'extract_load_cleanup')
+        conn.commit()
+        phase('apply', start)
+
+        start = time.perf_counter()
+        ensure_sample_key(conn, queries=queries)
+        changed = summary['inserted'] + summary['updated'] + summary['deleted']
+        summary['reindexed'] = changed > reindex_fraction * max(summary['row_count'], 1)
+        if summary['reindexed']:
+            queries.execute(conn, 'extract_reindex')
+            conn.commit()
+        vacuum(conn, queries)
+        phase('indexes', start)
+
+        queries.execute(conn, 'extract_version_record', {
+            'extract_version': extract_version, 'source_path': os.path.abspath(path),
+            'row_count': summary['row_count'], 'inserted': summary['inserted'],
+            'updated': summary['updated'], 'deleted': summary['deleted'],
+        })
+        conn.commit()
+
+        if market_index:
+            start = time.perf_counter()
+            build_market_index(conn, extract_version, queries)
+            phase('market_index', start)
+        if part_keys:
+            start = time.perf_counter()
+            build_part_key_index(conn, extract_version, queries)
+            phase('part_keys', start)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if cache_dir:
+        QueryCache(cache_dir).invalidate(keep_version=extract_version)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load a new product extract incrementally.")
+    parser.add_argument('path', help="Extract file (.csv or .parquet) with a jprod_id column.")
+    parser.add_argument('--extract-version', required=True, help="Version name, e.g. gsa_product_extract_feb2024.")
+    parser.add_argument('--workers', type=int, default=4, help="Parallel COPY connections (default: 4).")
+    parser.add_argument('--batch-size', type=int, default=50_000, help="Rows per delete/update/insert batch.")
+    parser.add_argument('--chunk-rows', type=int, default=200_000, help="Rows per COPY chunk.")
+    parser.add_argument('--market-index', action='store_true', help="Rebuild the market price index afterwards.")
+    parser.add_argument('--part-keys', action='store_true', help="Rebuild the part key index afterwards.")
+    parser.add_argument('--cache-dir', default=None, help="Drop the cached query results of older extracts here.")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the number of changed rows.")
+    args = parser.parse_args(argv)
+
+    summary = load_extract(args.path, args.extract_version, args.workers, args.batch_size, args.chunk_rows,
+                           market_index=args.market_index, part_keys=args.part_keys, cache_dir=args.cache_dir,
+                           dry_run=args.dry_run)
+    print(json.dumps(summary, indent=2))
+    if not args.dry_run:
+        print(f"Set GSADB_EXTRACT_VERSION={args.extract_version} for the reports.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Market price index: price statistics per manufacturer part number, computed once per extract.
+
+The build step (market_index_build.txt) aggregates every item of the extract into the
+gsa_market_price_index table: count, mean, m2 (sum of squared deviations), std, min, max and the
+25th/50th/75th percentiles of the price. The 'index' query mode of SamplePriceComp looks the sampled
+part numbers up in that table together with the contract's own contribution, and
+add_competitor_summary() subtracts the contract's items from the market statistics, so the
+competitor summary is an index lookup instead of a scan of all the competitor rows.
+
+The index can also be exported to an Arrow IPC file sorted by part number, which is memory-mapped
+and binary searched (MarketIndex) for runs on a local snapshot.
+
+min, max and the percentiles cannot be un-merged, so they describe the whole market including the
+contract's own items. The count, the competitor average and both deviations are exact.
+
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.market_index build
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.market_index export /app/output/market_index.arrow
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import polars as pl
+
+from .config import EXTRACT_VERSION, get_db_connection
+from .queries import get_query_registry
+
+BUILD_QUERY = 'market_index_build'
+EXPORT_QUERY = 'market_index_export'
+VERSION_QUERY = 'market_index_version'
+
+# Index table columns and their names in the report query results
+INDEX_COLUMNS = {
+    'item_count': 'market_count',
+    'mean_price': 'market_mean',
+    'm2': 'market_m2',
+    'min_price': 'market_min',
+    'max_price': 'market_max',
+    'p25_price': 'market_p25',
+    'p50_price': 'market_p50',
+    'p75_price': 'market_p75',
+}
+
+
+def _m2_expr(price):
+    """Sum of squared deviations from the mean of a group (0 for a single value)."""
+    return (price.var(ddof=0) * price.count()).fill_null(0.0)
+
+
+def add_competitor_summary(results):
+    """Derive the competitor summary columns of the 'aggregate' query from the market index columns.
+
+    results has one row per reference item with the market_* columns of its part number and the
+    contract's own_count, own_mean and own_m2 for that part number. The competitor statistics are the
+    market statistics minus the contract's items, and price_deviation merges them with the sampled
+    reference items again (Chan et al. update formulas), like the 'rows' and 'aggregate' modes compute it.
+    """
+    part = "manufacturer_part_number"
+    market_count = pl.col("market_count").fill_null(0).cast(pl.Int64)
+    own_count = pl.col("own_count").fill_null(0).cast(pl.Int64)
+    own_mean = pl.col("own_mean")
+    competitor_count = market_count - own_count
+    has_competitors = competitor_count > 0
+
+    results = results.with_columns(
+        competitor_count.alias("competitor_count"),
+        pl.when(has_competitors).then(
+            (market_count * pl.col("market_mean") - own_count * own_mean.fill_null(0.0)) / competitor_count
+        ).alias("average_price_on_gsa"),
+        # Sampled reference items of the part number
+        pl.col("price").count().over(part).alias("_reference_count"),
+        pl.col("price").mean().over(part).alias("_reference_mean"),
+        _m2_expr(pl.col("price")).over(part).alias("_reference_m2"),
+    )
+
+    competitor_mean = pl.col("average_price_on_gsa")
+    own_delta = (competitor_mean - own_mean).fill_null(0.0)
+    competitor_m2 = (pl.col("market_m2") - pl.col("own_m2").fill_null(0.0)
+                     - own_delta ** 2 * own_count * competitor_count / market_count).clip(lower_bound=0.0)
+    results = results.with_columns(competitor_m2.alias("_competitor_m2"))
+
+    reference_count = pl.col("_reference_count")
+    total_count = reference_count + competitor_count
+    reference_delta = competitor_mean - pl.col("_reference_mean")
+    total_m2 = (pl.col("_reference_m2") + pl.col("_competitor_m2")
+                + reference_delta ** 2 * reference_count * competitor_count / total_count)
+    return results.with_columns(
+        pl.when(has_competitors & (total_count > 1)).then((total_m2 / (total_count - 1)).sqrt())
+        .alias("price_deviation"),
+        pl.when(competitor_count > 1).then((pl.col("_competitor_m2") / (competitor_count - 1)).sqrt())
+        .alias("competitor_price_deviation"),
+        pl.when(has_competitors).then(pl.col("market_min")).alias("min_price_on_gsa"),
+        pl.when(has_competitors).then(pl.col("market_max")).alias("max_price_on_gsa"),
+    ).drop(["_reference_count", "_reference_mean", "_reference_m2", "_competitor_m2"])
+
+
+def own_contribution(items):
+    """own_count, own_mean and own_m2 per part number of a contract's items (what the index query computes)."""
+    price = pl.col("price").drop_nulls()
+    return items.group_by("manufacturer_part_number").agg(
+        price.count().alias("own_count"),
+        price.mean().alias("own_mean"),
+        _m2_expr(price).alias("own_m2"),
+    )
+
+
+def build_market_index(conn, extract_version=EXTRACT_VERSION, queries=None):
+    """(Re)build the gsa_market_price_index table for the loaded extract."""
+    (queries or get_query_registry()).execute(conn, BUILD_QUERY, {'extract_version': extract_version})
+    conn.commit()
+
+
+def index_version(conn, queries=None):
+    """Extract version the index table was built from (None if it was never built)."""
+    df = (queries or get_query_registry()).fetch_df(conn, VERSION_QUERY)
+    return df.get_column("extract_version")[0]
+
+
+def export_market_index(conn, path, batch_size=200_000, queries=None):
+    """Write the index table to an uncompressed Arrow IPC file (memory-mappable) and return its metadata."""
+    queries = queries or get_query_registry()
+    extract_version = index_version(conn, queries)
+    batches = queries.iter_batches(conn, EXPORT_QUERY, prepared=False, batch_size=batch_size)
+    df = pl.concat(list(batches), how="vertical_relaxed")
+    conn.commit()
+
+    df.write_ipc(path, compression='uncompressed')
+    metadata = {
+        'extract_version': extract_version,
+        'part_numbers': df.height,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(f"{path}.json", 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+class MarketIndex:
+    """
+    Memory-mapped market index file written by export_market_index().
+
+    Rows are sorted by part number, so a lookup is a binary search on the mapped column and only the
+    pages of the rows found are read.
+
+    Attributes:
+    -----------
+    path : str
+        The Arrow IPC file.
+    metadata : dict
+        Extract version, number of part numbers and creation time of the export.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        metadata_path = f"{path}.json"
+        self.metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as file:
+                self.metadata = json.load(file)
+        # An uncompressed IPC file read from a path is memory-mapped, not copied into memory
+        self.df = pl.read_ipc(path)
+        self._part_numbers = self.df.get_column("manufacturer_part_number")
+
+    def __repr__(self):
+        return f"MarketIndex({self.path!r}, {self.df.height} part numbers)"
+
+    def lookup(self, part_numbers):
+        """Index rows of the part numbers found, with the column names of the report query results."""
+        keys = pl.Series("manufacturer_part_number", sorted(set(part_numbers) - {None}), dtype=pl.Utf8)
+        positions = self._part_numbers.search_sorted(keys, side="left")
+        found = [position for key, position in zip(keys, positions)
+                 if position < self.df.height and self._part_numbers[position] == key]
+        return self.df[found].rename(INDEX_COLUMNS).select(["manufacturer_part_number", *INDEX_COLUMNS.values()])
+
+    def sample_products(self, snapshot, contract_number, sample):
+        """Reference items sampled from a ProductSnapshot with their market index and own contribution,
+        the same rows as the 'index' query returns."""
+        items = snapshot.contract_items(contract_number)
+        reference = snapshot.sample_reference(items, sample)
+        part_numbers = reference.get_column("manufacturer_part_number").to_list()
+        own = own_contribution(items.filter(pl.col("manufacturer_part_number").is_in(part_numbers)))
+        return reference.with_columns(pl.lit("reference").alias("source")).join(
+            self.lookup(part_numbers), on="manufacturer_part_number", how="left"
+        ).join(own, on="manufacturer_part_number", how="left").sort("jprod_id")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or export the market price index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Rebuild the gsa_market_price_index table.")
+    build.add_argument('--extract-version', default=EXTRACT_VERSION)
+    export = subparsers.add_parser('export', help="Export the index table to a memory-mappable Arrow file.")
+    export.add_argument('path')
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection()
+    try:
+        if args.command == 'build':
+            build_market_index(conn, args.extract_version)
+            print(f"Built gsa_market_price_index for {args.extract_version}")
+        else:
+            print(json.dumps(export_market_index(conn, args.path), indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
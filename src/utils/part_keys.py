@@ -0,0 +1,181 @@
+"""
+Normalized part number index: competitor matching on canonical part numbers instead of exact strings.
+
+The same part is listed as '06628-PWR', '06628 PWR' and '06628pwr' by different contracts, so an exact
+comparison of manufacturer_part_number misses those competitors (and ILIKE workarounds scan the whole
+extract). The part key of a part number is the part number in uppercase with everything but letters
+and digits removed (normalize_part_number). The build step (part_key_index_build.txt) computes it, and
+the same key of the manufacturer name, for every item of the extract once into the gsa_part_key_index
+table with an index on (part_key, manufacturer_key). The 'normalized' query mode of SamplePriceComp
+matches the sampled items through it, an indexed equality join that also finds the other spellings;
+with match_manufacturer the manufacturer keys have to be equal as well.
+
+The coverage report compares how many items have competitors with exact and with normalized matching,
+and lists the part keys with several spellings (and several manufacturers, i.e. likely false matches).
+coverage_df() and variants_df() compute the same on a DataFrame, e.g. a local snapshot.
+
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.part_keys build
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.part_keys coverage
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.part_keys variants --snapshot /app/output/snapshot --limit 50
+"""
+import argparse
+import json
+import re
+
+import polars as pl
+
+from .config import EXTRACT_VERSION, get_db_connection
+from .queries import get_query_registry
+from .snapshot import ProductSnapshot
+
+BUILD_QUERY = 'part_key_index_build'
+VERSION_QUERY = 'part_key_index_version'
+COVERAGE_QUERY = 'part_key_coverage'
+VARIANTS_QUERY = 'part_key_variants'
+
+# Everything but uppercase letters and digits is dropped (the regexp_replace of the SQL files)
+_NOT_KEY_CHARACTERS = r"[^A-Z0-9]"
+_NOT_KEY_PATTERN = re.compile(_NOT_KEY_CHARACTERS)
+
+# Manufacturer condition of the competitor join in price_comp_normalized_sample
+MANUFACTURER_MATCH_SQL = "AND pk.manufacturer_key = rk.manufacturer_key"
+
+
+def normalize_part_number(part_number):
+    """Part key of a part number: uppercase letters and digits only, None when nothing is left."""
+    if part_number is None:
+        return None
+    return _NOT_KEY_PATTERN.sub("", part_number.upper()) or None
+
+
+def part_key_expr(column):
+    """normalize_part_number() as a Polars expression on a string column."""
+    key = pl.col(column).str.to_uppercase().str.replace_all(_NOT_KEY_CHARACTERS, "")
+    return pl.when(key.str.len_bytes() > 0).then(key)
+
+
+def with_part_keys(items):
+    """Add the part_key and manufacturer_key columns to a DataFrame or LazyFrame of extract items."""
+    return items.with_columns(
+        part_key_expr("manufacturer_part_number").alias("part_key"),
+        part_key_expr("manufacturer_name").alias("manufacturer_key"),
+    )
+
+
+def manufacturer_match_sql(match_manufacturer):
+    """Fragment of the normalized query restricting the matches to the same manufacturer (or not)."""
+    return MANUFACTURER_MATCH_SQL if match_manufacturer else ""
+
+
+def build_part_key_index(conn, extract_version=EXTRACT_VERSION, queries=None):
+    """(Re)build the gsa_part_key_index table for the loaded extract."""
+    (queries or get_query_registry()).execute(conn, BUILD_QUERY, {'extract_version': extract_version})
+    conn.commit()
+
+
+def index_version(conn, queries=None):
+    """Extract version the index table was built from (None if it was never built)."""
+    df = (queries or get_query_registry()).fetch_df(conn, VERSION_QUERY)
+    return df.get_column("extract_version")[0]
+
+
+def _with_rates(coverage):
+    """Add the matched shares and the gain of normalized over exact matching to a coverage dict."""
+    item_count = coverage['item_count'] or 1
+    coverage['exact_match_rate'] = round(coverage['exact_matched_items'] / item_count, 4)
+    coverage['normalized_match_rate'] = round(coverage['normalized_matched_items'] / item_count, 4)
+    coverage['additional_matched_items'] = coverage['normalized_matched_items'] - coverage['exact_matched_items']
+    return coverage
+
+
+def part_key_coverage(conn, queries=None):
+    """Exact versus normalized match coverage of the whole extract, from the index table."""
+    queries = queries or get_query_registry()
+    coverage = queries.fetch_df(conn, COVERAGE_QUERY).row(0, named=True)
+    coverage['extract_version'] = index_version(conn, queries)
+    return _with_rates(coverage)
+
+
+def part_key_variants(conn, limit=20, queries=None):
+    """Part keys with several spellings of the part number, most contracts first."""
+    return (queries or get_query_registry()).fetch_df(conn, VARIANTS_QUERY, {'limit': limit})
+
+
+def coverage_df(items):
+    """part_key_coverage() computed with Polars on a DataFrame or LazyFrame of extract items."""
+    keyed = with_part_keys(items.lazy())
+    exact = keyed.group_by("manufacturer_part_number").agg(
+        pl.col("contract_number").n_unique().alias("exact_contracts"))
+    normalized = keyed.filter(pl.col("part_key").is_not_null()).group_by("part_key").agg(
+        pl.col("contract_number").n_unique().alias("contracts"),
+        pl.col("manufacturer_part_number").n_unique().alias("variants"),
+        pl.col("manufacturer_key").n_unique().alias("manufacturers"),
+    )
+    counts = keyed.join(exact, on="manufacturer_part_number", how="left", nulls_equal=True).join(
+        normalized, on="part_key", how="left"
+    ).select(
+        pl.len().alias("item_count"),
+        pl.col("part_key").is_null().sum().alias("unkeyed_items"),
+        (pl.col("exact_contracts") > 1).sum().alias("exact_matched_items"),
+        (pl.col("contracts") > 1).sum().alias("normalized_matched_items"),
+        (pl.col("variants") > 1).sum().alias("items_with_variants"),
+        (pl.col("manufacturers") > 1).sum().alias("items_with_several_manufacturers"),
+        pl.col("manufacturer_part_number").n_unique().alias("distinct_part_numbers"),
+        pl.col("part_key").drop_nulls().n_unique().alias("distinct_part_keys"),
+    ).collect()
+    return _with_rates(counts.row(0, named=True))
+
+
+def variants_df(items, limit=20):
+    """part_key_variants() computed with Polars on a DataFrame or LazyFrame of extract items."""
+    return with_part_keys(items.lazy()).filter(pl.col("part_key").is_not_null()).group_by("part_key").agg(
+        pl.col("manufacturer_part_number").n_unique().alias("variants"),
+        pl.col("contract_number").n_unique().alias("contracts"),
+        pl.col("manufacturer_key").n_unique().alias("manufacturers"),
+        pl.col("manufacturer_part_number").unique().sort().head(5).str.join(" | ").alias("examples"),
+    ).filter(pl.col("variants") > 1).sort(
+        ["contracts", "variants", "part_key"], descending=[True, True, False]
+    ).head(limit).collect()
+
+
+def _snapshot_items(path):
+    """The items of a local Parquet snapshot, only the columns the coverage needs."""
+    return ProductSnapshot(path).scan().select("contract_number", "manufacturer_part_number", "manufacturer_name")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the normalized part number index or report its coverage.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Rebuild the gsa_part_key_index table.")
+    build.add_argument('--extract-version', default=EXTRACT_VERSION)
+    coverage = subparsers.add_parser('coverage', help="Exact versus normalized match coverage.")
+    coverage.add_argument('--snapshot', default=None, help="Compute it on a local Parquet snapshot instead.")
+    variants = subparsers.add_parser('variants', help="Part keys listed under several spellings.")
+    variants.add_argument('--snapshot', default=None, help="Compute it on a local Parquet snapshot instead.")
+    variants.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'snapshot', None):
+        if args.command == 'coverage':
+            print(json.dumps(coverage_df(_snapshot_items(args.snapshot)), indent=2))
+        else:
+            with pl.Config(tbl_rows=-1, fmt_str_lengths=120):
+                print(variants_df(_snapshot_items(args.snapshot), args.limit))
+        return
+
+    conn = get_db_connection()
+    try:
+        if args.command == 'build':
+            build_part_key_index(conn, args.extract_version)
+            print(f"Built gsa_part_key_index for {args.extract_version}")
+        elif args.command == 'coverage':
+            print(json.dumps(part_key_coverage(conn), indent=2, default=str))
+        else:
+            with pl.Config(tbl_rows=-1, fmt_str_lengths=120):
+                print(part_key_variants(conn, args.limit))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Registry of the SQL files in src/querys, loaded and validated once per process.
+
+Values are never spliced into the SQL text. A query file declares its parameters in psycopg2 style,
+%(contract_number)s, and only structural pieces of SQL (e.g. the {reference_items} sample of a
+SampleSpec) are filled in with {name} fragments. A literal % is written %%.
+
+SELECT queries run as server-side prepared statements: the first execution on a connection sends
+PREPARE (the %(name)s parameters become $1, $2, ...) and every later one only sends EXECUTE with the
+values, so Postgres parses and plans the query once per connection instead of once per contract.
+A prepared EXECUTE cannot be declared as a cursor, so its whole result is held by libpq: queries with
+an unbounded result are run with prepared=False, on a server-side cursor that streams the batches.
+The execution time of every query is recorded per query name.
+
+    EXAMPLE -$
+        queries = get_query_registry()
+        df = queries.fetch_df(conn, 'price_comp_random_sample', {'contract_number': '47QSEA20D003B', ...},
+                              fragments={'reference_items': sample.reference_items_sql(),
+                                         **column_fragments(queries['price_comp_random_sample'])})
+        queries.timing_stats()
+"""
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+import weakref
+from collections import defaultdict
+from functools import lru_cache
+
+import polars as pl
+import psycopg2
+import psycopg2.errors
+
+from .fetch import DEFAULT_BATCH_SIZE, iter_batches
+
+QUERY_DIR = 'src/querys'
+
+# %(name)s parameter or %% escape
+PARAMETER_PATTERN = re.compile(r"%\((\w+)\)s|%%")
+# {name} fragment of SQL filled in before the query is prepared
+FRAGMENT_PATTERN = re.compile(r"\{(\w+)\}")
+COMMENT_PATTERN = re.compile(r"--[^\n]*")
+
+
+def parameter_names(sql):
+    """Names of the %(name)s parameters of a query, in order of first appearance."""
+    names = []
+    for match in PARAMETER_PATTERN.finditer(sql):
+        if match.group(1) and match.group(1) not in names:
+            names.append(match.group(1))
+    return names
+
+
+def to_positional(sql):
+    """Rewrite the %(name)s parameters to $1, $2, ... for PREPARE; return the SQL and the parameter order."""
+    names = parameter_names(sql)
+
+    def replace(match):
+        return "%" if match.group(1) is None else f"${names.index(match.group(1)) + 1}"
+
+    return PARAMETER_PATTERN.sub(replace, sql), names
+
+
+class Query:
+    """
+    One SQL file of the registry.
+
+    Attributes:
+    -----------
+    name : str
+        File name without extension.
+    path : str
+        The SQL file.
+    text : str
+        SQL template with its {fragments} and %(parameters)s.
+    fragments : tuple
+        Names of the {fragments} to fill in with render().
+    digest : str
+        sha256 of the text, changes when the file is edited.
+    """
+
+    def __init__(self, name, path, text):
+        self.name = name
+        self.path = path
+        self.text = text.strip().rstrip(';').strip()
+        self.fragments = tuple(dict.fromkeys(FRAGMENT_PATTERN.findall(self.text)))
+        self.digest = hashlib.sha256(self.text.encode()).hexdigest()
+        self.validate()
+
+    def __repr__(self):
+        return f"Query({self.name!r}, fragments={self.fragments}, parameters={parameter_names(self.text)})"
+
+    def validate(self):
+        """Reject files that cannot be bound safely."""
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", self.name):
+            raise ValueError(f"{self.path}: query names must be lowercase identifiers.")
+        if not self.text:
+            raise ValueError(f"{self.path}: empty query.")
+        # A parameter inside a string literal would be sent as text instead of being bound
+        literals = COMMENT_PATTERN.sub("", self.text).split("'")[1::2]
+        for literal in literals:
+            if PARAMETER_PATTERN.search(literal):
+                raise ValueError(f"{self.path}: parameter inside quotes '{literal}', remove the quotes to bind it.")
+        # A lone % that is not a parameter would break psycopg2's parameter parsing
+        if "%" in PARAMETER_PATTERN.sub("", self.text):
+            raise ValueError(f"{self.path}: literal % must be written %%.")
+
+    @property
+    def is_select(self):
+        """Single SELECT (or WITH ... SELECT) statement, which can be prepared."""
+        statement = COMMENT_PATTERN.sub("", self.text).strip()
+        return re.match(r"(SELECT|WITH)\b", statement, re.IGNORECASE) is not None and ";" not in statement
+
+    def render(self, **fragments):
+        """SQL with the {fragments} filled in (the %(parameters)s are left for binding)."""
+        missing = set(self.fragments) - set(fragments)
+        unknown = set(fragments) - set(self.fragments)
+        if missing or unknown:
+            raise KeyError(f"{self.name}: missing fragments {sorted(missing)}, unknown fragments {sorted(unknown)}.")
+        sql = self.text
+        for name, fragment in fragments.items():
+            sql = sql.replace(f"{{{name}}}", fragment.strip())
+        return sql
+
+
+class QueryRegistry:
+    """
+    All the queries of a directory, with prepared execution and timing.
+
+    Attributes:
+    -----------
+    queries : dict
+        Query by name.
+    timings : dict
+        Execution times in seconds by query name (this process).
+    """
+
+    def __init__(self, query_dir=QUERY_DIR):
+        self.query_dir = query_dir
+        self.queries = {}
+        for path in sorted(glob.glob(os.path.join(query_dir, "*.txt"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path, 'r') as file:
+                self.queries[name] = Query(name, path, file.read())
+        if not self.queries:
+            raise FileNotFoundError(f"No query files found in {query_dir}.")
+        self.timings = defaultdict(list)
+        # Prepared statement names per connection, dropped with the connection (ids are reused)
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        try:
+            return self.queries[name]
+        except KeyError:
+            raise KeyError(f"Unknown query {name!r}, expected one of {sorted(self.queries)}.") from None
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def sql(self, name, fragments=None):
+        """Rendered SQL of a query."""
+        return self[name].render(**(fragments or {}))
+
+    @staticmethod
+    def bind(sql, params):
+        """Parameter values in the order of the SQL's parameters (raises on a missing one)."""
+        params = params or {}
+        names = parameter_names(sql)
+        missing = [name for name in names if name not in params]
+        if missing:
+            raise KeyError(f"Missing query parameters {missing}.")
+        return {name: params[name] for name in names}
+
+    def _prepare(self, conn, sql):
+        """PREPARE the SQL on the connection once and return the EXECUTE statement and its parameter order."""
+        positional_sql, names = to_positional(sql)
+        statement = f"q_{hashlib.sha256(sql.encode()).hexdigest()[:16]}"
+        with self._lock:
+            prepared = statement in self._prepared.get(conn, ())
+        if not prepared:
+            with conn.cursor() as cursor:
+                cursor.execute(f"PREPARE {statement} AS {positional_sql}")
+            with self._lock:
+                self._prepared.setdefault(conn, set()).add(statement)
+        placeholders = ", ".join(["%s"] * len(names))
+        return (f"EXECUTE {statement} ({placeholders})" if names else f"EXECUTE {statement}"), names
+
+    def _iter_prepared(self, conn, sql, values, batch_size, schema_overrides):
+        statement, names = self._prepare(conn, sql)
+        return iter_batches(conn, statement, [values[name] for name in names] or None, batch_size,
+                            schema_overrides, server_side=False)
+
+    def forget(self, conn):
+        """Drop the record of the statements prepared on a connection (e.g. after DISCARD ALL)."""
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    def iter_batches(self, conn, name, params=None, fragments=None, prepared=True,
+                     batch_size=DEFAULT_BATCH_SIZE, schema_overrides=None):
+        """Run a query and yield its result in DataFrame batches (see utils.fetch.iter_batches).
+
+        A prepared SELECT is executed on a regular cursor, so libpq holds its whole result while the
+        batches are built. prepared=False runs the plain SQL on a server-side cursor instead, which
+        streams the result batch_size rows at a time: use it for results that are not bounded (e.g. the
+        'rows' query mode or the snapshot export).
+        """
+        query = self[name]
+        sql = query.render(**(fragments or {}))
+        values = self.bind(sql, params)
+        start = time.perf_counter()
+        try:
+            if prepared and query.is_select:
+                try:
+                    batches = self._iter_prepared(conn, sql, values, batch_size, schema_overrides)
+                    first = next(batches)
+                except psycopg2.errors.InvalidSqlStatementName:
+                    # The session lost its prepared statements (DISCARD ALL, pooler), prepare again
+                    conn.rollback()
+                    self.forget(conn)
+                    batches = self._iter_prepared(conn, sql, values, batch_size, schema_overrides)
+                    first = next(batches)
+                yield first
+                yield from batches
+            else:
+                yield from iter_batches(conn, sql, values or None, batch_size, schema_overrides)
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def fetch_df(self, conn, name, params=None, fragments=None, prepared=True,
+                 batch_size=DEFAULT_BATCH_SIZE, schema_overrides=None):
+        """Run a query and return its whole result as one DataFrame."""
+        batches = list(self.iter_batches(conn, name, params, fragments, prepared, batch_size, schema_overrides))
+        return pl.concat(batches, how="vertical_relaxed", rechunk=False)
+
+    def execute(self, conn, name, params=None, fragments=None):
+        """Run a statement that returns no rows (migrations, DDL, DML), without preparing it.
+        Return the number of rows affected by the last statement (-1 when not applicable).
+        """
+        sql = self.sql(name, fragments)
+        values = self.bind(sql, params)
+        start = time.perf_counter()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, values or None)
+                return cursor.rowcount
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def total_seconds(self):
+        """Time spent in queries by this process so far."""
+        with self._lock:
+            return sum(sum(seconds) for seconds in self.timings.values())
+
+    def timing_stats(self):
+        """Count, total, mean and max execution seconds by query name."""
+        with self._lock:
+            return {
+                name: {
+                    'count': len(seconds),
+                    'total': sum(seconds),
+                    'mean': sum(seconds) / len(seconds),
+                    'max': max(seconds),
+                }
+                for name, seconds in self.timings.items() if seconds
+            }
+
+
+@lru_cache(maxsize=None)
+def get_query_registry(query_dir=QUERY_DIR):
+    """The process wide registry of a query directory, loaded on first use."""
+    return QueryRegistry(query_dir)
@@ -1,13 +1,47 @@
 import os
+import tempfile
 import polars as pl
+from contextlib import contextmanager
 from datetime import date
-from docxtpl import DocxTemplate
-import subprocess
+from .bootstrap import DEFAULT_CONFIDENCE, DEFAULT_RESAMPLES, comparison_intervals
+from .config import EXTRACT_VERSION, ConnectionPool
+from .contracts import get_contract_registry
+from .converter import get_default_converter
 from .dfc import DataFrameCleaner
-from test.sampleCompany import get_sample_company
+from .fetch import DEFAULT_BATCH_SIZE
+from .fingerprint import (analysis_version, competitor_fingerprint, contract_fingerprint, fingerprint,
+                          render_fingerprint)
+from .market_index import add_competitor_summary
+from .part_keys import manufacturer_match_sql
+from .queries import get_query_registry
+from .render import SCRATCH_DIR, get_docx_renderer, get_html_renderer
+from .result_schema import FETCH_SCHEMA, column_fragments, conform, memory_footprint
+from .sampling import SampleSpec
+from .stats import deviation_name, format_percent, format_price, format_threshold, price_comparison_stats
 
 dfc = DataFrameCleaner()
 
+# Query (see utils.queries) used by each query mode:
+#   rows      - every matching competitor row is returned and aggregated in Polars
+#   aggregate - Postgres returns one row per reference item with the competitor summary already computed
+#   index     - one row per reference item with the precomputed market index of its part number, the
+#               competitor summary is derived from it (see utils.market_index)
+#   normalized - like 'aggregate', but competitors are matched on the normalized part number through the
+#                part key index, so other spellings of the part number match too (see utils.part_keys)
+QUERY_NAMES = {
+    'rows': 'price_comp_random_sample',
+    'aggregate': 'price_comp_aggregate_sample',
+    'index': 'price_comp_index_sample',
+    'normalized': 'price_comp_normalized_sample',
+}
+# Query modes whose results carry the competitor summary on the reference items
+SUMMARY_MODES = ('aggregate', 'index', 'normalized')
+# Context keys of the bootstrap confidence intervals (see calculate_confidence_intervals)
+CONFIDENCE_KEYS = ('avg_percent_diff_ci_lower', 'avg_percent_diff_ci_upper', 'avg_price_deviation_ci_lower',
+                   'avg_price_deviation_ci_upper', 'confidence_level', 'bootstrap_resamples')
+# Report files: PDF (Word template converted by LibreOffice), the Word document itself, or HTML without either
+REPORT_FORMATS = ('pdf', 'docx', 'html')
+
 
 # TODO: Add the DataFrameCleaner class to the SamplePriceComp class.
 class SamplePriceComp:
@@ -17,13 +51,60 @@ class SamplePriceComp:
     Attributes:
     -----------
     conn : object
-        Database connection object.
+        Database connection object, or a ConnectionPool to check connections out of per query.
     company : Company
         Company information object.
     output_path : str
-        Path to save the output files.
+        Path to save the output files (defaults to "/app/output/").
+    converter : SofficeConverter or ConverterPool
+        Converter used for DOCX to PDF, or None to use the process-wide default converter.
+    query_mode : str
+        'rows' (default) to pull every competitor row into Polars, 'aggregate' to let Postgres return
+        one summarized row per reference item, 'index' to look the summary up in the market price
+        index, or 'normalized' to match competitors on the normalized part number (see QUERY_NAMES).
+    match_manufacturer : bool
+        In 'normalized' mode, only match competitors of the same (normalized) manufacturer name.
+    sample : SampleSpec
+        Size, seed and method used to sample the reference items (defaults to 100 random items).
+    snapshot : ProductSnapshot
+        Local Parquet snapshot to read the products from instead of the database (conn can be None).
+    market_index : MarketIndex
+        Memory-mapped market index file, used by snapshot runs in 'index' mode.
+    cache : QueryCache
+        On-disk cache of the query results, keyed by contract, SQL, extract version and sample.
+    fetch_batch_size : int
+        Rows turned into a DataFrame per batch (bounds the Python row objects in memory).
+    queries : QueryRegistry
+        Loaded SQL files, run as prepared statements (defaults to the process wide registry).
+    contracts : ContractRegistry
+        Contract metadata the company is looked up in (defaults to the process wide registry).
+    renderer : DocxRenderer
+        Word template renderer (defaults to the process wide renderer of the report template).
+    html_renderer : HtmlRenderer
+        HTML template renderer, or None to use the process wide renderer of the HTML report template.
+    instrument : StageRecorder
+        Records the time, rows and memory of every stage of run_sample_report (see utils.instrument), or None.
+    manifest : ReportManifest
+        Fingerprints of the last run of every contract; with a manifest run_sample_report only redoes the
+        stages whose inputs changed (see run_incremental_report and utils.fingerprint), or None.
+    reused : dict
+        Whether the last incremental run reused the 'analysis' results and the 'report' file (None otherwise).
+    deviation_thresholds : list
+        Price deviations the report counts the items above (defaults to 1, 10 and 100).
+    stats_spec : StatsSpec
+        Summary statistics of the report, with one deviate_more_than_<n> count per deviation threshold.
+    bootstrap_resamples : int
+        Resamples of the bootstrap confidence intervals of the averages (see utils.bootstrap), 0 for none.
+    confidence : float
+        Confidence level of those intervals (defaults to 0.95).
+    lazy : bool
+        Run the analysis steps as one LazyFrame query (see build_lazy_pipeline) instead of eagerly.
+    streaming : bool
+        Collect the lazy pipeline with the streaming engine.
     query_results_df : DataFrame
-        DataFrame to store the query results.
+        DataFrame to store the query results, with the schema of the query mode (see utils.result_schema).
+    result_mb : float
+        Estimated size of the query results in MB, recorded with the query stage.
     contractor_items_df : DataFrame
         DataFrame to store the contractor items.
     comparison_df : DataFrame
@@ -39,6 +120,7 @@ class SamplePriceComp:
             - 'days_until_option_end': int, Days until option end date or "N/A".
             - 'ultimate_end_date': str, Ultimate end date in "Month Day, Year" format or "N/A".
             - 'days_until_ultimate_end': int, Days until ultimate end date or "N/A".
+            - 'exact_product_count': int, Competitor offerings matching the exact part number ('normalized' mode).
             - 'below_competitor': int, Number of items below competitor price.
             - 'above_competitor': int, Number of items above competitor price.
             - 'avg_percent_diff': float, Average percent difference.
@@ -47,46 +129,111 @@ class SamplePriceComp:
             - 'avg_price_deviation': float, Average price deviation.
             - 'max_price_deviation': float, Maximum price deviation.
             - 'min_price_deviation': float, Minimum price deviation.
-            - 'deviate_more_than_1': int, Number of items deviating more than 1.
-            - 'deviate_more_than_10': int, Number of items deviating more than 10.
-            - 'deviate_more_than_100': int, Number of items deviating more than 100.
+            - 'avg_percent_diff_ci_lower', 'avg_percent_diff_ci_upper': str, Confidence interval of the
+              average percent difference (with bootstrap_resamples).
+            - 'avg_price_deviation_ci_lower', 'avg_price_deviation_ci_upper': str, Confidence interval of the
+              average price deviation (with bootstrap_resamples).
+            - 'confidence_level': str, Confidence level of the intervals, e.g. "95%".
+            - 'bootstrap_resamples': int, Number of bootstrap resamples.
+            - 'deviate_more_than_<n>': int, Number of items deviating more than n, for each deviation
+              threshold (1, 10 and 100 by default).
+            - 'deviation_counts': list, (threshold, count) pairs of the deviation thresholds, e.g. ("$10", 4),
+              which the templates loop over.
             - 'manufacture_avg_diff': list, List of dictionaries with manufacturer average differences.
             - 'comparison_items': list, List of dictionaries with comparison items.
 
     Methods:
     --------
-    run_sample_report():
-        Runs the sample report generation process.
+    run_sample_report(convert=True):
+        Runs the sample report generation process and returns the PDF path (or the Word path if convert is False).
+    run_incremental_report(output_format):
+        Runs the report, skipping the stages whose inputs are unchanged since the manifest entry of the last run.
+    analyze():
+        Runs the query, aggregation and formatting stages into the analysis_results dictionary.
     get_contractor_info():
         Stores the company information in the analysis_results dictionary.
     check_expiration_dates():
         Checks and formats the expiration dates, and calculates days until those dates.
-    get_sample_products(query_file='src/querys/price_comp_random_sample.txt'):
-        Gets 100 random items from the specific contract and matching items from competitors.
+    get_sample_products(query_name=None):
+        Gets a sample of items (100 random by default) from the specific contract and matching items (or their summary) from competitors.
+    connection():
+        Context manager yielding the connection to query with (checked out of the pool if conn is a pool).
+    query_sample_products(query_name):
+        Runs the price comparison query (or reads its result from the cache).
     get_contractor_items():
         Selects the columns to include in the final report from the original contractor's items.
+    get_competitor_summary():
+        Returns the average competitor price and the price deviation for each manufacturer part number.
     calculate_comparison_df():
-        Calculates the average price for competitor products and the standard deviation of prices.
+        Joins the competitor summary to the contractor items and calculates the percent difference.
     comparison_statements():
         Stores the analysis results in the analysis_results dictionary.
+    build_lazy_pipeline():
+        Builds the comparison, manufacturer and statistics steps as LazyFrames.
+    explain_lazy_pipeline(optimized=True):
+        Returns the query plans of the lazy pipeline.
+    run_lazy_pipeline():
+        Collects the lazy pipeline once and stores the same results as the eager steps.
     calculate_manufacture_average_diff():
         Provides manufacturer pricing overview and classifies as 'More Expensive' or 'Cheaper'.
-    generate_pdf():
+    calculate_confidence_intervals():
+        Adds bootstrap confidence intervals of the averages, overall and per manufacturer.
+    generate_docx():
         Generates a Word document report based on the analysis results using a template.
+    generate_pdf():
+        Generates the Word document report and converts it to PDF.
+    generate_html():
+        Generates the report as a standalone HTML file, without Word or LibreOffice.
+    generate_report(output_format):
+        Generates the report in one of the REPORT_FORMATS.
     docx_to_pdf(word_file_path):
         Converts a Word document to PDF.
     """
 
-    def __init__(self, conn, contract_number):
+    def __init__(self, conn, contract_number, output_path="/app/output/", converter=None, query_mode='rows',
+                 sample=None, snapshot=None, cache=None, fetch_batch_size=DEFAULT_BATCH_SIZE,
+                 deviation_thresholds=(1, 10, 100), lazy=False, streaming=False, queries=None, contracts=None,
+                 market_index=None, renderer=None, html_renderer=None, instrument=None, match_manufacturer=False,
+                 manifest=None, bootstrap_resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE):
+        if query_mode not in QUERY_NAMES:
+            raise ValueError(f"Unknown query mode {query_mode!r}, expected one of {list(QUERY_NAMES)}.")
+        if snapshot is not None and query_mode in ('aggregate', 'normalized'):
+            raise ValueError("Snapshot runs only support the 'rows' and 'index' query modes.")
+        if snapshot is not None and query_mode == 'index' and market_index is None:
+            raise ValueError("Snapshot runs in 'index' mode need a market_index file.")
+        if snapshot is not None and manifest is not None:
+            raise ValueError("Incremental runs need the database to fingerprint the inputs, not a snapshot.")
         self.conn = conn
-        self.company = get_sample_company(contract_number)
+        self.converter = converter
+        self.query_mode = query_mode
+        self.match_manufacturer = match_manufacturer
+        self.sample = sample or SampleSpec()
+        self.snapshot = snapshot
+        self.market_index = market_index
+        self.cache = cache
+        self.queries = queries or get_query_registry()
+        self.renderer = renderer or get_docx_renderer()
+        self.html_renderer = html_renderer
+        self.instrument = instrument
+        self.manifest = manifest
+        self.reused = None
+        self.fetch_batch_size = fetch_batch_size
+        self.deviation_thresholds = list(deviation_thresholds)
+        self.stats_spec = price_comparison_stats(deviation_thresholds)
+        self.bootstrap_resamples = bootstrap_resamples
+        self.confidence = confidence
+        self.lazy = lazy
+        self.streaming = streaming
+        self.contracts = contracts if contracts is not None else get_contract_registry()
+        self.company = self.contracts.get(contract_number)
         if not self.company:
             raise ValueError(f"Company with contract number {contract_number} not found.")
 
-        self.output_path = "/app/output/"
+        self.output_path = output_path
 
         # DataFrames to store the query results and comparison data
         self.query_results_df = None
+        self.result_mb = None
         self.contractor_items_df = None
         self.comparison_df = None
         self.manufacture_avg_diff_df = None  # Manufacture Average Difference
@@ -94,15 +241,118 @@ class SamplePriceComp:
         # Analysis results Dictionary
         self.analysis_results = {}
 
-    def run_sample_report(self):
-        self.get_contractor_info()
-        self.get_sample_products()
-        self.get_contractor_items()
-        self.calculate_comparison_df()
-        self.comparison_statements()
-        self.calculate_manufacture_average_diff()
-        self.get_analysis_results_dict()
-        self.generate_pdf()
+    def run_sample_report(self, convert=True, output_format=None):
+        """Run the analysis and generate the report. output_format is one of REPORT_FORMATS,
+            by default 'pdf', or 'docx' with convert=False.
+        """
+        output_format = output_format or ('pdf' if convert else 'docx')
+        if self.manifest is not None:
+            return self.run_incremental_report(output_format)
+        with self.stage('total') as total:
+            self.analyze()
+            report_path = self.generate_report(output_format)
+            total['rows_out'] = len(self.analysis_results['comparison_items'])
+        return report_path
+
+    def analyze(self):
+        """Run the query, aggregation and formatting stages, leaving the template context in analysis_results."""
+        with self.stage('query') as record:
+            self.get_contractor_info()
+            self.get_sample_products()
+            record['rows_out'] = self.query_results_df.height
+            record['result_mb'] = self.result_mb
+        with self.stage('aggregation', rows_in=self.query_results_df.height) as record:
+            if self.lazy:
+                self.run_lazy_pipeline()
+            else:
+                self.get_contractor_items()
+                self.calculate_comparison_df()
+                self.comparison_statements()
+                self.calculate_manufacture_average_diff()
+            self.calculate_confidence_intervals()
+            record['rows_out'] = self.comparison_df.height
+        self.format_analysis_results()
+
+    def run_incremental_report(self, output_format='pdf'):
+        """Run the report against the manifest entry of the contract's last run and return the report path.
+            The analysis is only redone when the fingerprint of its inputs (contract items, competitor
+            aggregates of the sampled part numbers, options and code) changed, otherwise the stored analysis
+            results are reused. The report is only rendered (and converted) when the analysis results, the
+            contract dates, the template or the format changed, or the file is gone.
+        """
+        contract_number = self.company.contract_number
+        entry = self.manifest.get(contract_number) or {}
+        with self.stage('total') as total:
+            with self.stage('fingerprint') as record:
+                inputs = self.input_fingerprints(entry.get('part_numbers', []))
+                data_fingerprint = fingerprint(inputs, self.analysis_options())
+                analysis_reused = data_fingerprint == entry.get('data_fingerprint') and 'analysis_results' in entry
+                record['reused'] = analysis_reused
+
+            if analysis_reused:
+                part_numbers = entry['part_numbers']
+                self.get_contractor_info()
+                # Stored template context, with the contract dates of today
+                self.analysis_results = {**entry['analysis_results'], **self.analysis_results}
+            else:
+                self.analyze()
+                part_numbers = sorted(self._select_contractor_items(self.query_results_df)
+                                      .get_column("manufacturer_part_number").unique().drop_nulls().to_list())
+                # The competitor fingerprint of the part numbers this run sampled
+                with self.connection() as conn:
+                    inputs['competitors'] = competitor_fingerprint(conn, contract_number, part_numbers, self.queries)
+                data_fingerprint = fingerprint(inputs, self.analysis_options())
+
+            template_path = (self.html_renderer or get_html_renderer() if output_format == 'html'
+                             else self.renderer).template_path
+            report_fingerprint = render_fingerprint(self.analysis_results, output_format, template_path)
+            report_path = entry.get('report_path')
+            report_reused = (report_fingerprint == entry.get('render_fingerprint')
+                             and report_path is not None and os.path.exists(report_path))
+            if not report_reused:
+                report_path = self.generate_report(output_format)
+
+            self.reused = {'analysis': analysis_reused, 'report': report_reused}
+            self.manifest.put(contract_number, {
+                'output_format': output_format,
+                'report_path': report_path,
+                'inputs': inputs,
+                'part_numbers': part_numbers,
+                'data_fingerprint': data_fingerprint,
+                'render_fingerprint': report_fingerprint,
+                'analysis_reused': analysis_reused,
+                'report_reused': report_reused,
+                'analysis_results': self.analysis_results,
+            })
+            total['rows_out'] = len(self.analysis_results['comparison_items'])
+        return report_path
+
+    def input_fingerprints(self, part_numbers):
+        """Fingerprints of the contract's items and of the competitor items of the given part numbers."""
+        with self.connection() as conn:
+            return {
+                'contract': contract_fingerprint(conn, self.company.contract_number, self.queries),
+                'competitors': competitor_fingerprint(conn, self.company.contract_number, part_numbers,
+                                                      self.queries),
+            }
+
+    def analysis_options(self):
+        """Everything besides the data that changes the analysis results: options, SQL and code."""
+        query_name = QUERY_NAMES[self.query_mode]
+        options = {
+            'query_mode': self.query_mode,
+            'match_manufacturer': self.match_manufacturer,
+            'sample': repr(self.sample),
+            'statistics': self.stats_spec.names,
+            'bootstrap': (self.bootstrap_resamples, self.confidence),
+            'query_sql': self.queries.sql(query_name, {
+                fragment: '' for fragment in self.queries[query_name].fragments}),
+            'analysis_version': analysis_version(),
+        }
+        if self.query_mode == 'normalized':
+            # The competitor fingerprint does not cover the other spellings of the part numbers
+            options['extract_version'] = EXTRACT_VERSION
+        return options
 
     def get_contractor_info(self):
         """Store the company information in the dictionary attribute."""
@@ -131,31 +381,95 @@ class SamplePriceComp:
             self.analysis_results['ultimate_end_date'] = "N/A"
             self.analysis_results['days_until_ultimate_end'] = "N/A"
 
-    def get_sample_products(self, query_file='src/querys/price_comp_random_sample.txt'):
+    def get_sample_products(self, query_name=None):
         """Get 100 random items from the specific contract, along with all
           the matching items from competitors found from the database
            and return a DataFrame with the results.
+           In the SUMMARY_MODES the competitors come back already summarized on each reference item.
+           With a snapshot the same rows are read from the local Parquet files instead.
         """
-        # Load the SQL query from a file
-        sql_query = query_file
-        with open(sql_query, 'r') as file:
-            query = file.read()
-
-        # Replace the placeholder with the actual contract number & Query DB
-        query = query.replace("{contract_number}", self.company.contract_number)
-
-        # Cast the price column to float
-        self.query_results_df = pl.read_database(query, self.conn).with_columns(
-            pl.col("price").cast(pl.Float64)
-        )
-        # get the number of items in the query results
-        self.analysis_results['product_count'] = self.query_results_df.shape[0] - 100
+        if self.snapshot is not None and self.query_mode == 'index':
+            self.query_results_df = self.market_index.sample_products(self.snapshot, self.company.contract_number,
+                                                                      self.sample)
+        elif self.snapshot is not None:
+            self.query_results_df = self.snapshot.sample_products(self.company.contract_number, self.sample)
+        else:
+            self.query_results_df = self.query_sample_products(query_name or QUERY_NAMES[self.query_mode])
+        # Only the columns the report uses, with the text columns dictionary encoded
+        self.query_results_df = conform(self.query_results_df, self.query_mode)
+        self.result_mb = memory_footprint(self.query_results_df)
+
+        if self.query_mode == 'index':
+            # Market statistics minus the contract's own items
+            self.query_results_df = add_competitor_summary(self.query_results_df)
+
+        # get the number of competitor items found for the sample
+        if self.query_mode in SUMMARY_MODES:
+            per_part_number = self.query_results_df.unique("manufacturer_part_number")
+            self.analysis_results['product_count'] = per_part_number.get_column("competitor_count").sum()
+            if self.query_mode == 'normalized':
+                # Match quality: how many of the competitor offerings an exact part number match finds too
+                self.analysis_results['exact_product_count'] = per_part_number.get_column(
+                    "exact_competitor_count").sum()
+        else:
+            self.analysis_results['product_count'] = self.query_results_df.filter(
+                pl.col("source") == "competitor").shape[0]
 
         return
 
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Record a stage of the report with the instrument, yielding its record (a no-op without instrument)."""
+        if self.instrument is None:
+            yield {}
+            return
+        with self.instrument.stage(self.company.contract_number, name, rows_in, query_mode=self.query_mode) as record:
+            yield record
+
+    @contextmanager
+    def connection(self):
+        """Yield the raw connection, or a connection checked out of the pool for the duration of a query."""
+        if isinstance(self.conn, ConnectionPool):
+            with self.conn.connection() as conn:
+                yield conn
+        else:
+            yield self.conn
+
+    def query_sample_products(self, query_name):
+        """Run the price comparison query, going through the query cache when there is one."""
+        # Fill in the reference item sample, the contract number & sample are bound as parameters
+        fragments = {'reference_items': self.sample.reference_items_sql(),
+                     **column_fragments(self.queries[query_name])}
+        if 'manufacturer_match' in self.queries[query_name].fragments:
+            fragments['manufacturer_match'] = manufacturer_match_sql(self.match_manufacturer)
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.company.contract_number, self.queries.sql(query_name, fragments),
+                                            EXTRACT_VERSION, self.query_mode, repr(self.sample))
+            cached_df = self.cache.get(cache_key)
+            if cached_df is not None:
+                return cached_df
+
+        with self.connection() as conn:
+            self.sample.prepare(conn)
+
+            # Built in batches with the result schema (price decoded as float, the repeated text columns as
+            # Categorical). The summary modes return one row per reference item and run as a prepared
+            # statement, 'rows' returns every competitor row and is streamed from a server-side cursor.
+            query_results_df = self.queries.fetch_df(conn, query_name, self.sample.params(self.company.contract_number),
+                                                     fragments=fragments, prepared=self.query_mode in SUMMARY_MODES,
+                                                     batch_size=self.fetch_batch_size, schema_overrides=FETCH_SCHEMA)
+        if self.cache is not None:
+            self.cache.put(cache_key, query_results_df)
+        return query_results_df
+
     def get_contractor_items(self):
         # Select the columns to include in the final report from the original contractors items
-        self.contractor_items_df = self.query_results_df.select([
+        self.contractor_items_df = self._select_contractor_items(self.query_results_df)
+        return
+
+    def _select_contractor_items(self, results):
+        # Works on a DataFrame or a LazyFrame (see build_lazy_pipeline)
+        return results.select([
             "contractor_name",
             "contract_number",
             "manufacturer_part_number",
@@ -163,67 +477,99 @@ class SamplePriceComp:
             "product_name",
             "price",
         ]).filter(pl.col("contract_number") == self.company.contract_number)
-        return
 
-    def calculate_comparison_df(self):
+    def get_competitor_summary(self):
         """Calculate the average price for competitor products and the standard deviation of prices for each product.
-            Return a DataFrame with the results.
+            Return a DataFrame with one row per manufacturer_part_number that has competitors.
         """
-        # average price for competitor products found in the query results
-        # (excluding the contractor's items from average calculation)
-        comp_average_price = self.query_results_df.filter(pl.col("source") == "competitor").group_by(
-            "manufacturer_part_number").agg(
-            pl.col("price").mean().alias("average_price_on_gsa")
-        )
-        # standard deviation of prices for each manufacturer_part_number
-        price_deviation = self.query_results_df.group_by("manufacturer_part_number").agg(
-            pl.col("price").std().alias("price_deviation")
-        )
-        # Combine the average price and price deviation into a single DataFrame
-        average_and_deviation = comp_average_price.join(price_deviation, on="manufacturer_part_number", how="left")
-        contractor_items_with_comps = self.contractor_items_df.join(average_and_deviation,
-                                                                    on="manufacturer_part_number", how="left")
+        return self._competitor_summary(self.query_results_df)
+
+    def _competitor_summary(self, results):
+        if self.query_mode in SUMMARY_MODES:
+            # Already summarized (by Postgres or from the market index), only keep the part numbers with competitors
+            return results.filter(pl.col("competitor_count") > 0).select([
+                "manufacturer_part_number",
+                "average_price_on_gsa",
+                "price_deviation",
+            ]).unique("manufacturer_part_number")
+
+        # One group_by for both statistics:
+        # - average price for competitor products found in the query results
+        #   (excluding the contractor's items from average calculation)
+        # - standard deviation of prices for each manufacturer_part_number (all items)
+        is_competitor = pl.col("source") == "competitor"
+        return results.group_by("manufacturer_part_number").agg(
+            pl.col("price").filter(is_competitor).mean().alias("average_price_on_gsa"),
+            pl.col("price").std().alias("price_deviation"),
+            is_competitor.any().alias("has_competitors"),
+        ).filter(pl.col("has_competitors")).drop("has_competitors")
+
+    def calculate_comparison_df(self):
+        """Join the competitor summary to the contractor items and calculate the percent difference."""
+        self.comparison_df = self._compare(self.contractor_items_df, self.get_competitor_summary())
+
+    def _compare(self, contractor_items, average_and_deviation):
+        contractor_items_with_comps = contractor_items.join(average_and_deviation,
+                                                            on="manufacturer_part_number", how="left")
 
         # Calculate the percent difference from the Contractors price vs the average price on GSA
-        #TODO fomat the percent difference so its not decimal value.
-        self.comparison_df = contractor_items_with_comps.with_columns(
+        return contractor_items_with_comps.with_columns(
             ((pl.col("price") - pl.col("average_price_on_gsa")) / pl.col("average_price_on_gsa")).alias(
                 "percent_difference")
         )
 
     def comparison_statements(self):
         """Store the analysis results in the class attributes."""
-        # Calculate general statements based on the Price % difference From GSA Average
-        self.analysis_results['below_competitor'] = self.comparison_df.filter(pl.col("percent_difference") < 0).shape[0]
-        self.analysis_results['above_competitor'] = self.comparison_df.filter(pl.col("percent_difference") > 0).shape[0]
-        self.analysis_results[
-            'avg_percent_diff'] = f"{self.comparison_df.select(pl.col('percent_difference').mean()).item() * 100:.2f}%"
-        self.analysis_results[
-            'max_percent_diff'] = f"{self.comparison_df.select(pl.col('percent_difference').max()).item() * 100:.2f}%"
-        self.analysis_results[
-            'min_percent_diff'] = f"{self.comparison_df.select(pl.col('percent_difference').min()).item() * 100:.2f}%"
-        self.analysis_results[
-            'avg_price_deviation'] = f"${self.comparison_df.select(pl.col('price_deviation').mean()).item():.2f}"
-        self.analysis_results[
-            'max_price_deviation'] = f"${self.comparison_df.select(pl.col('price_deviation').max()).item():.2f}"
-        self.analysis_results[
-            'min_price_deviation'] = f"${self.comparison_df.select(pl.col('price_deviation').min()).item():.2f}"
-        self.analysis_results['deviate_more_than_1'] = self.comparison_df.filter(pl.col("price_deviation") > 1).shape[0]
-        self.analysis_results['deviate_more_than_10'] = self.comparison_df.filter(pl.col("price_deviation") > 10).shape[
-            0]
-        self.analysis_results['deviate_more_than_100'] = \
-        self.comparison_df.filter(pl.col("price_deviation") > 100).shape[0]
+        # Calculate general statements based on the Price % difference From GSA Average (one pass over the data)
+        stats = self.stats_spec.evaluate(self.comparison_df)
+        self.analysis_results.update(self.stats_spec.format(stats))
+
+    def build_lazy_pipeline(self):
+        """Build the steps from get_contractor_items through calculate_manufacture_average_diff (and the
+            summary statistics) as LazyFrames over the query results, to be collected together.
+        """
+        results = self.query_results_df.lazy()
+        comparison = self._compare(self._select_contractor_items(results), self._competitor_summary(results))
+        return {
+            'comparison': comparison,
+            'manufacture_avg_diff': self._manufacture_average_diff(comparison),
+            'stats': self.stats_spec.aggregation(comparison),
+        }
+
+    def explain_lazy_pipeline(self, optimized=True):
+        """Return the (optimized) query plan of every output of the lazy pipeline, for debugging."""
+        return "\n\n".join(f"{name}:\n{lf.explain(optimized=optimized)}"
+                            for name, lf in self.build_lazy_pipeline().items())
+
+    def run_lazy_pipeline(self):
+        """Run the lazy pipeline with a single collect_all so Polars can share the common scans.
+            Fills the same attributes and analysis results as the eager steps.
+        """
+        pipeline = self.build_lazy_pipeline()
+        engine = "streaming" if self.streaming else "auto"
+        comparison_df, manufacture_avg_diff_df, stats_df = pl.collect_all(
+            [pipeline['comparison'], pipeline['manufacture_avg_diff'], pipeline['stats']], engine=engine)
+
+        self.comparison_df = comparison_df
+        self.contractor_items_df = comparison_df.select([
+            "contractor_name", "contract_number", "manufacturer_part_number", "manufacturer_name",
+            "product_name", "price"])
+        self.manufacture_avg_diff_df = manufacture_avg_diff_df
+        self.analysis_results.update(self.stats_spec.format(stats_df.row(0, named=True)))
 
     def calculate_manufacture_average_diff(self):
         """ Provides Manufacture Pricing Overview -  Calculates the average percent difference for pricing based on
             manufacturer and classify as 'More Expensive' or 'Cheaper'.
         """
+        self.manufacture_avg_diff_df = self._manufacture_average_diff(self.comparison_df)
+
+    def _manufacture_average_diff(self, comparison):
         # Group by manufacturer_name and calculate the average percent difference
-        man_avg_percent_diff = self.comparison_df.group_by("manufacturer_name").agg(
+        man_avg_percent_diff = comparison.group_by("manufacturer_name").agg(
             pl.col("percent_difference").mean().alias("average_percent_difference")
         )
         # Add Column to Classify average percent difference
-        self.manufacture_avg_diff_df = man_avg_percent_diff.with_columns(
+        return man_avg_percent_diff.with_columns(
             pl.when(pl.col("average_percent_difference") > 0)
             .then(pl.lit("Higher Price Average vs Competitor"))
             .when(pl.col("average_percent_difference") == 0)
@@ -234,10 +580,37 @@ class SamplePriceComp:
             .alias("comparison_string")
         )
 
+    def calculate_confidence_intervals(self):
+        """Bootstrap confidence intervals of the average percent difference and price deviation, and of the
+            average percent difference of every manufacturer (see utils.bootstrap). The resamples are seeded
+            by the sample seed, and a 'stratified' sample is resampled within its manufacturers.
+        """
+        if not self.bootstrap_resamples:
+            return
+        seed = None if self.sample.seed is None else int(self.sample.unit_value() * 2 ** 32)
+        summary, manufacturer_intervals = comparison_intervals(
+            self.comparison_df,
+            strata_column="manufacturer_name" if self.sample.method == 'stratified' else None,
+            resamples=self.bootstrap_resamples, confidence=self.confidence, seed=seed)
+        self.manufacture_avg_diff_df = self.manufacture_avg_diff_df.join(
+            manufacturer_intervals.rename({"percent_difference_lower": "average_percent_difference_lower",
+                                           "percent_difference_upper": "average_percent_difference_upper"}),
+            on="manufacturer_name", how="left", nulls_equal=True)
+        for column, name, formatter in (("percent_difference", "avg_percent_diff", format_percent),
+                                        ("price_deviation", "avg_price_deviation", format_price)):
+            lower, upper = summary[column]
+            self.analysis_results[f"{name}_ci_lower"] = formatter(lower)
+            self.analysis_results[f"{name}_ci_upper"] = formatter(upper)
+        self.analysis_results['confidence_level'] = f"{self.confidence:.0%}"
+        self.analysis_results['bootstrap_resamples'] = self.bootstrap_resamples
+
     def get_analysis_results_dict(self):
-        self.comparison_df = dfc.format_percent_columns(self.comparison_df, ["percent_difference"])
-        self.comparison_df = dfc.format_price_columns(self.comparison_df, ["price", "average_price_on_gsa", "price_deviation"])
-        self.manufacture_avg_diff_df = dfc.format_percent_columns(self.manufacture_avg_diff_df, ["average_percent_difference"])
+        self.comparison_df = dfc.format_columns(self.comparison_df,
+                                                percent_columns=["percent_difference"],
+                                                price_columns=["price", "average_price_on_gsa", "price_deviation"])
+        self.manufacture_avg_diff_df = dfc.format_percent_columns(
+            self.manufacture_avg_diff_df,
+            [column for column in self.manufacture_avg_diff_df.columns if column.startswith("average_percent_difference")])
         context = {
             'company_name': self.analysis_results['company_name'],
             'current_date': self.analysis_results['current_date'],
@@ -248,61 +621,74 @@ class SamplePriceComp:
             'ultimate_end_date': self.analysis_results['ultimate_end_date'],
             'days_until_ultimate_end': self.analysis_results['days_until_ultimate_end'],
             'product_count': self.analysis_results['product_count'],
-            'below_competitor': self.analysis_results['below_competitor'],
-            'above_competitor': self.analysis_results['above_competitor'],
-            'avg_percent_diff': self.analysis_results['avg_percent_diff'],
-            'max_percent_diff': self.analysis_results['max_percent_diff'],
-            'min_percent_diff': self.analysis_results['min_percent_diff'],
-            'avg_price_deviation': self.analysis_results['avg_price_deviation'],
-            'max_price_deviation': self.analysis_results['max_price_deviation'],
-            'min_price_deviation': self.analysis_results['min_price_deviation'],
-            'deviate_more_than_1': self.analysis_results['deviate_more_than_1'],
-            'deviate_more_than_10': self.analysis_results['deviate_more_than_10'],
-            'deviate_more_than_100': self.analysis_results['deviate_more_than_100'],
+            'exact_product_count': self.analysis_results.get('exact_product_count'),
+            # below/above_competitor, avg/max/min_percent_diff, avg/max/min_price_deviation, deviate_more_than_*
+            **{name: self.analysis_results[name] for name in self.stats_spec.names},
+            # The templates loop over these pairs, they cannot reference keys like deviate_more_than_2.5
+            'deviation_counts': [(format_threshold(threshold), self.analysis_results[deviation_name(threshold)])
+                                 for threshold in self.deviation_thresholds],
+            # Bootstrap confidence intervals, when they were calculated
+            **{name: self.analysis_results[name] for name in CONFIDENCE_KEYS if name in self.analysis_results},
             'manufacture_avg_diff': self.manufacture_avg_diff_df.to_dicts(),  # Convert DataFrame to list of dicts
             'comparison_items': self.comparison_df.to_dicts(),  # Convert DataFrame to list of dicts
         }
         self.analysis_results = context
 
-    def generate_pdf(self):
-        """Generate a Word document report based on the analysis results using a template.
-            Return the path to the generated PDF file.
-            TODO: Create Separate Class for Report Generation for all reports: will take context & template and save as pdf
-        """
-        # Load the Word template
-        template_path = "src/templates/template_report.docx"  # Update with the actual path to your template
-        doc = DocxTemplate(template_path)
+    def format_analysis_results(self):
+        """get_analysis_results_dict() as the formatting stage."""
+        with self.stage('formatting', rows_in=self.comparison_df.height) as record:
+            self.get_analysis_results_dict()
+            record['rows_out'] = len(self.analysis_results['comparison_items'])
 
-        # Render the template with the context
-        doc.render(self.analysis_results)
+    def render_stage(self):
+        """Stage record of a template render."""
+        return self.stage('render', rows_in=len(self.analysis_results['comparison_items']))
 
-        # Save the rendered Word document
+    def generate_docx(self):
+        """Generate a Word document report based on the analysis results using a template.
+            Return the path to the generated Word file.
+        """
         file_name = f"GSA_Report_{self.company.contract_number}.docx"
         word_file_path = os.path.join(self.output_path, file_name)
-        doc.save(word_file_path)
-
-        # Convert the Word document to PDF
-        pdf_file_path = self.docx_to_pdf(word_file_path)
+        with self.render_stage():
+            return self.renderer.render_to_file(self.analysis_results, word_file_path)
 
-        # remove the Word file
-        os.remove(word_file_path)
-
-        return pdf_file_path
+    def generate_pdf(self):
+        """Generate the Word document report and convert it to PDF.
+            Return the path to the generated PDF file.
+            The Word document is only written to a scratch directory for the converter, not to the output path.
+        """
+        with tempfile.TemporaryDirectory(prefix="gsa_report_", dir=SCRATCH_DIR) as scratch_path:
+            word_file_path = os.path.join(scratch_path, f"GSA_Report_{self.company.contract_number}.docx")
+            with self.render_stage():
+                self.renderer.render_to_file(self.analysis_results, word_file_path)
+
+            # Convert the Word document to PDF
+            with self.stage('convert', rows_in=1) as record:
+                pdf_file_path = self.docx_to_pdf(word_file_path)
+                record['rows_out'] = 1
+            return pdf_file_path
+
+    def generate_html(self):
+        """Generate the report as a standalone HTML file from the analysis results.
+            Return the path to the generated HTML file.
+        """
+        file_name = f"GSA_Report_{self.company.contract_number}.html"
+        html_file_path = os.path.join(self.output_path, file_name)
+        with self.render_stage():
+            return (self.html_renderer or get_html_renderer()).render_to_file(self.analysis_results, html_file_path)
+
+    def generate_report(self, output_format='pdf'):
+        """Generate the report in one of the REPORT_FORMATS and return its path."""
+        if output_format == 'pdf':
+            return self.generate_pdf()
+        if output_format == 'docx':
+            return self.generate_docx()
+        if output_format == 'html':
+            return self.generate_html()
+        raise ValueError(f"Unknown report format {output_format!r}, expected one of {list(REPORT_FORMATS)}.")
 
     def docx_to_pdf(self, word_file_path):
-        subprocess.call(['soffice',
-                         '--headless',
-                         '--convert-to',
-                         'pdf',
-                         '--outdir',
-                         self.output_path,
-                         word_file_path])
-
-        # Get the base name of the input document (without extension)
-        base_name = os.path.splitext(os.path.basename(word_file_path))[0]
-
-        # Create the output PDF file path
-        pdf_path = os.path.join(self.output_path, base_name + '.pdf')
-
-        # Return the PDF file path
-        return pdf_path
+        """Convert the Word document to PDF with the report's converter (or the process-wide default)."""
+        converter = self.converter or get_default_converter()
+        return converter.convert(word_file_path, self.output_path)
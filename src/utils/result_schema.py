@@ -0,0 +1,92 @@
+"""
+Explicit schema of the price comparison query results: only the columns the report uses, typed up front.
+
+The price comparison queries returned every column of the extract (SELECT ref.*) with the text columns
+as full strings on every row. Every row of a contract repeats its contractor name and contract number,
+and the competitor rows mostly repeat a few manufacturer names, so those columns are Categorical (each
+string stored once, a small integer per row, and faster group-bys) and source is an Enum of its two
+values. price is decoded straight to Float64 by the fetch (see utils.fetch), never as Decimal.
+
+The queries list the item columns with the {reference_columns} (and {competitor_columns}) fragments,
+so Postgres only sends these columns, and the fetch builds every batch with their types right away
+(FETCH_SCHEMA). conform() selects and casts the results of the snapshot and market index runs
+(and of the cache) the same way, and memory_footprint() reports the size of a result, recorded with
+the query stage of the report.
+
+manufacturer_part_number stays a string: the reference items have nearly as many part numbers as rows,
+the market index file is looked up by string, and the catalog walks the part numbers in byte order.
+
+    EXAMPLE -$
+        results = conform(snapshot.sample_products(contract_number, sample), 'rows')
+        memory_footprint(results)
+"""
+import polars as pl
+
+SOURCE = pl.Enum(["reference", "competitor"])
+
+# Columns of the extract items used by the report (jprod_id orders the rows)
+ITEM_SCHEMA = {
+    'jprod_id': pl.Int64,
+    'contractor_name': pl.Categorical,
+    'contract_number': pl.Categorical,
+    'manufacturer_part_number': pl.Utf8,
+    'manufacturer_name': pl.Categorical,
+    'product_name': pl.Utf8,
+    'price': pl.Float64,
+}
+
+# Competitor summary of the 'aggregate' and 'normalized' queries (and of add_competitor_summary)
+SUMMARY_SCHEMA = {
+    'competitor_count': pl.Int64,
+    'average_price_on_gsa': pl.Float64,
+    'price_deviation': pl.Float64,
+    'competitor_price_deviation': pl.Float64,
+    'min_price_on_gsa': pl.Float64,
+    'max_price_on_gsa': pl.Float64,
+}
+
+# Market index columns add_competitor_summary derives the competitor summary from
+INDEX_SCHEMA = {
+    'market_count': pl.Int64,
+    'market_mean': pl.Float64,
+    'market_m2': pl.Float64,
+    'market_min': pl.Float64,
+    'market_max': pl.Float64,
+    'own_count': pl.Int64,
+    'own_mean': pl.Float64,
+    'own_m2': pl.Float64,
+}
+
+# Query results schema of every query mode (see utils.report.QUERY_NAMES)
+RESULT_SCHEMAS = {
+    'rows': {**ITEM_SCHEMA, 'source': SOURCE},
+    'aggregate': {**ITEM_SCHEMA, 'source': SOURCE, **SUMMARY_SCHEMA},
+    'index': {**ITEM_SCHEMA, 'source': SOURCE, **INDEX_SCHEMA},
+    'normalized': {**ITEM_SCHEMA, 'source': SOURCE, **SUMMARY_SCHEMA, 'exact_competitor_count': pl.Int64},
+}
+
+# Schema overrides of the fetch, the other columns get the types of the Postgres result (see utils.fetch)
+FETCH_SCHEMA = {**ITEM_SCHEMA, 'source': SOURCE}
+
+# Column list fragments of the price comparison queries and the table alias they select from
+COLUMN_FRAGMENTS = {'reference_columns': 'ref', 'competitor_columns': 'comp'}
+
+
+def item_columns_sql(alias):
+    """Item columns of the schema qualified with a table alias, e.g. "ref.jprod_id, ref.contractor_name, ..."."""
+    return ", ".join(f"{alias}.{column}" for column in ITEM_SCHEMA)
+
+
+def column_fragments(query):
+    """The column list fragments a Query has, filled with the item columns."""
+    return {name: item_columns_sql(alias) for name, alias in COLUMN_FRAGMENTS.items() if name in query.fragments}
+
+
+def conform(results, query_mode):
+    """Select the schema columns of the query mode out of a DataFrame or LazyFrame and cast them to their types."""
+    return results.select([pl.col(name).cast(dtype) for name, dtype in RESULT_SCHEMAS[query_mode].items()])
+
+
+def memory_footprint(df):
+    """Estimated size of a DataFrame in MB."""
+    return round(df.estimated_size("mb"), 3)
@@ -0,0 +1,125 @@
+"""
+Sampling of the reference items used by the sample price comparison queries.
+
+The query files select their reference items with a {reference_items} fragment that is filled in
+with the SQL of a SampleSpec (see utils.queries); the contract number, sample size and start point are
+bound as parameters (SampleSpec.params). Methods:
+    random      - ORDER BY RANDOM() LIMIT n. Sorts the whole contract catalog on every run. A seed is
+                  applied with setseed() so the sample is reproducible for an unchanged table.
+    random_key  - Walks the precomputed, indexed sample_key column (see SAMPLE_KEY_MIGRATION) from a
+                  start point derived from the seed. Reads only about n index entries, whatever the
+                  catalog size, and the same seed always returns the same items.
+    stratified  - Proportional sample per manufacturer: the items of every manufacturer are shuffled and
+                  spread evenly over [0, 1), so the first n positions hold each manufacturer's share of
+                  the contract (within one item). Small manufacturers are not left out by chance, and
+                  the bootstrap intervals of the report resample within the manufacturers
+                  (see utils.bootstrap). Seeded with setseed() like 'random'.
+"""
+import hashlib
+import random
+
+from .queries import get_query_registry
+
+
+SAMPLE_KEY_MIGRATION = 'sample_key_migration'
+
+REFERENCE_ITEMS_SQL = {
+    'random': """
+            SELECT *
+            FROM gsa_product_extract_jan2024
+            WHERE contract_number = %(contract_number)s
+            ORDER BY RANDOM()  -- Randomize the selection of the items
+            LIMIT %(sample_size)s
+    """,
+    'random_key': """
+            SELECT *
+            FROM (
+                -- Walk the (contract_number, sample_key) index from the start point, wrapping around
+                (SELECT *
+                 FROM gsa_product_extract_jan2024
+                 WHERE contract_number = %(contract_number)s AND sample_key >= %(sample_start)s
+                 ORDER BY sample_key
+                 LIMIT %(sample_size)s)
+                UNION ALL
+                (SELECT *
+                 FROM gsa_product_extract_jan2024
+                 WHERE contract_number = %(contract_number)s AND sample_key < %(sample_start)s
+                 ORDER BY sample_key
+                 LIMIT %(sample_size)s)
+            ) keyed_sample
+            LIMIT %(sample_size)s
+    """,
+    'stratified': """
+            SELECT items.*
+            FROM gsa_product_extract_jan2024 items
+            JOIN (
+                -- Position of every item within its manufacturer, spread over [0, 1)
+                SELECT jprod_id,
+                       (ROW_NUMBER() OVER (PARTITION BY manufacturer_name ORDER BY RANDOM()) - RANDOM())
+                           / COUNT(*) OVER (PARTITION BY manufacturer_name) AS stratum_position
+                FROM gsa_product_extract_jan2024
+                WHERE contract_number = %(contract_number)s
+            ) positions ON positions.jprod_id = items.jprod_id
+            ORDER BY positions.stratum_position
+            LIMIT %(sample_size)s
+    """,
+}
+
+
+class SampleSpec:
+    """
+    How the reference items are sampled from a contract.
+
+    Attributes:
+    -----------
+    size : int
+        Number of reference items to sample (default 100).
+    seed : int, float or str
+        Makes the sample reproducible; None draws a new sample on every run.
+    method : str
+        'random' (default), 'random_key' or 'stratified', see REFERENCE_ITEMS_SQL.
+    """
+
+    def __init__(self, size=100, seed=None, method='random'):
+        if method not in REFERENCE_ITEMS_SQL:
+            raise ValueError(f"Unknown sample method {method!r}, expected one of {list(REFERENCE_ITEMS_SQL)}.")
+        if size <= 0:
+            raise ValueError("Sample size must be positive.")
+        self.size = int(size)
+        self.seed = seed
+        self.method = method
+
+    def __repr__(self):
+        return f"SampleSpec(size={self.size}, seed={self.seed!r}, method={self.method!r})"
+
+    def unit_value(self):
+        """Map the seed to a float in [0, 1), or a random value when there is no seed."""
+        if self.seed is None:
+            return random.random()
+        digest = hashlib.sha256(str(self.seed).encode()).hexdigest()
+        return int(digest[:13], 16) / 16 ** 13
+
+    def reference_items_sql(self):
+        """Return the SQL selecting the reference items, with its parameters still to be bound."""
+        return REFERENCE_ITEMS_SQL[self.method].strip()
+
+    def params(self, contract_number):
+        """Parameter values of the reference items SQL (and of the queries it is part of)."""
+        return {
+            'contract_number': contract_number,
+            'sample_size': self.size,
+            'sample_start': self.unit_value(),
+        }
+
+    def prepare(self, conn):
+        """Seed RANDOM() on the connection when the 'random' or 'stratified' method needs a reproducible sample."""
+        if self.method in ('random', 'stratified') and self.seed is not None:
+            with conn.cursor() as cursor:
+                # setseed() takes a value in [-1, 1]
+                cursor.execute("SELECT setseed(%s)", (self.unit_value() * 2 - 1,))
+
+
+def ensure_sample_key(conn, migration=SAMPLE_KEY_MIGRATION, queries=None):
+    """Add and index the sample_key column used by the 'random_key' method (safe to re-run)."""
+    (queries or get_query_registry()).execute(conn, migration)
+    conn.commit()
@@ -0,0 +1,186 @@
+"""
+Local Parquet snapshot of the product extract for report runs without database access.
+
+The extract is exported once into Parquet files hash-partitioned by manufacturer_part_number:
+
+    <snapshot>/mpn_bucket=<n>/data.parquet
+    <snapshot>/_snapshot.json
+
+A part number always lands in the bucket part_number_bucket() computes for it (the export query
+computes the same md5 based hash in Postgres), so looking up competitors only reads the buckets of
+the sampled part numbers. Within a bucket the rows are sorted by part number, so the Parquet row
+group statistics let the predicate pushdown skip most of the bucket as well.
+
+Export (from the project root):
+    EXAMPLE -$ PYTHONPATH=src python3 -m utils.snapshot export /app/output/snapshot --partitions 64
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from .config import get_db_connection
+from .queries import get_query_registry
+
+PARTITION_COLUMN = "mpn_bucket"
+DEFAULT_PARTITIONS = 64
+METADATA_FILE = "_snapshot.json"
+EXPORT_QUERY = 'snapshot_export'
+
+def part_number_bucket(part_number, partitions):
+    """Bucket of a manufacturer part number, identical to the bucket computed by EXPORT_QUERY."""
+    digest = hashlib.md5((part_number or "").encode()).hexdigest()
+    return int(digest[:8], 16) % partitions
+
+
+def _bucket_dir(path, bucket):
+    return os.path.join(path, f"{PARTITION_COLUMN}={bucket}")
+
+
+def export_snapshot(conn, path, partitions=DEFAULT_PARTITIONS, batch_size=200_000, query_name=EXPORT_QUERY,
+                    queries=None):
+    """Export the product extract into a partitioned Parquet snapshot and return its metadata.
+
+    Rows are streamed in batches from a server-side cursor (see utils.fetch), so memory is bounded by
+    batch_size during the export and by the size of one bucket while the buckets are compacted.
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    start = time.perf_counter()
+    row_count = 0
+    chunk = 0
+    queries = queries or get_query_registry()
+    batches = queries.iter_batches(conn, query_name, {'partitions': int(partitions)}, prepared=False,
+                                   batch_size=batch_size)
+    for batch_df in batches:
+        # Hive style layout: the bucket is stored in the directory name, not in the files
+        buckets = batch_df.partition_by(PARTITION_COLUMN, as_dict=True, include_key=False)
+        for (bucket,), bucket_df in buckets.items():
+            bucket_dir = _bucket_dir(path, bucket)
+            os.makedirs(bucket_dir, exist_ok=True)
+            bucket_df.write_parquet(os.path.join(bucket_dir, f"part-{chunk:05d}.parquet"))
+        row_count += batch_df.height
+        chunk += 1
+    conn.commit()
+
+    # Compact every bucket into one file sorted by part number
+    for bucket_dir in sorted(glob.glob(os.path.join(path, f"{PARTITION_COLUMN}=*"))):
+        part_files = sorted(glob.glob(os.path.join(bucket_dir, "part-*.parquet")))
+        pl.read_parquet(part_files).sort("manufacturer_part_number").write_parquet(
+            os.path.join(bucket_dir, "data.parquet"), statistics=True, row_group_size=50_000)
+        for part_file in part_files:
+            os.remove(part_file)
+
+    metadata = {
+        'source_table': 'gsa_product_extract_jan2024',
+        'partitions': partitions,
+        'row_count': row_count,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'export_seconds': round(time.perf_counter() - start, 1),
+    }
+    with open(os.path.join(path, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+class ProductSnapshot:
+    """
+    Read side of a snapshot written by export_snapshot().
+
+    Produces the same DataFrame as the 'rows' price comparison query (reference items plus their
+    competitors, with a 'source' column), so SamplePriceComp can run on it without a database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), 'r') as file:
+            self.metadata = json.load(file)
+        self.partitions = self.metadata['partitions']
+
+    def __repr__(self):
+        return f"ProductSnapshot({self.path!r})"
+
+    def scan(self):
+        """Lazily scan the whole snapshot (the bucket is exposed as the mpn_bucket column)."""
+        return pl.scan_parquet(os.path.join(self.path, f"{PARTITION_COLUMN}=*", "*.parquet"),
+                               hive_partitioning=True)
+
+    def contract_items(self, contract_number):
+        """All the items of one contract."""
+        return self.scan().filter(pl.col("contract_number") == contract_number).drop(PARTITION_COLUMN).collect()
+
+    def competitor_items(self, part_numbers, contract_number):
+        """Items of other contracts with one of the part numbers, reading only their buckets."""
+        part_numbers = list(set(part_numbers))
+        buckets = sorted({part_number_bucket(part_number, self.partitions) for part_number in part_numbers})
+        return self.scan().filter(
+            pl.col(PARTITION_COLUMN).is_in(buckets)
+            & pl.col("manufacturer_part_number").is_in(part_numbers)
+            & (pl.col("contract_number") != contract_number)
+        ).drop(PARTITION_COLUMN).collect()
+
+    def sample_reference(self, items, sample):
+        """Sample the reference items out of a contract's items.
+
+        Follows the SampleSpec: 'random_key' walks the sample_key column like the SQL does (when the
+        snapshot has it), 'stratified' spreads every manufacturer's shuffled items over [0, 1) like the
+        SQL does, otherwise a plain random sample is drawn, seeded when the spec has a seed.
+        """
+        size = min(sample.size, items.height)
+        if sample.method == 'random_key' and "sample_key" in items.columns:
+            start = sample.unit_value()
+            ordered = items.sort("sample_key")
+            return pl.concat([
+                ordered.filter(pl.col("sample_key") >= start),
+                ordered.filter(pl.col("sample_key") < start),
+            ]).head(size)
+        seed = None if sample.seed is None else int(sample.unit_value() * 2 ** 32)
+        if sample.method == 'stratified':
+            rng = np.random.default_rng(seed)
+            shuffled = items.sample(fraction=1.0, seed=seed).with_columns(
+                pl.Series("stratum_offset", rng.random(items.height)))
+            return shuffled.with_columns(
+                ((pl.int_range(1, pl.len() + 1).over("manufacturer_name") - pl.col("stratum_offset"))
+                 / pl.len().over("manufacturer_name")).alias("stratum_position")
+            ).sort("stratum_position").head(size).drop("stratum_offset", "stratum_position")
+        return items.sample(n=size, seed=seed)
+
+    def sample_products(self, contract_number, sample):
+        """Sample reference items from the contract and add all their competitor items."""
+        reference = self.sample_reference(self.contract_items(contract_number), sample)
+        competitors = self.competitor_items(reference.get_column("manufacturer_part_number").to_list(),
+                                            contract_number)
+        return pl.concat([
+            reference.with_columns(pl.lit("reference").alias("source")),
+            competitors.with_columns(pl.lit("competitor").alias("source")),
+        ]).sort("jprod_id")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local Parquet snapshot of the product extract.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="Export the product extract to a snapshot directory.")
+    export.add_argument('path')
+    export.add_argument('--partitions', type=int, default=DEFAULT_PARTITIONS)
+    export.add_argument('--batch-size', type=int, default=200_000)
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection()
+    try:
+        metadata = export_snapshot(conn, args.path, partitions=args.partitions, batch_size=args.batch_size)
+    finally:
+        conn.close()
+    print(json.dumps(metadata, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Declarative summary statistics evaluated in a single aggregation.
+
+A StatsSpec is a list of named Polars aggregation expressions. evaluate() runs all of them in one
+select over a LazyFrame, so the data is scanned once however many metrics are requested, and
+format() turns the raw values into the strings used in the report templates.
+"""
+import polars as pl
+
+
+def format_percent(value):
+    """0.1234 -> "12.34%" ("N/A" when missing)."""
+    return "N/A" if value is None else f"{value * 100:.2f}%"
+
+
+def format_price(value):
+    """12.3 -> "$12.30" ("N/A" when missing)."""
+    return "N/A" if value is None else f"${value:.2f}"
+
+
+def format_threshold(value):
+    """10 -> "$10", 2.5 -> "$2.5", 1000.0 -> "$1,000"."""
+    if float(value).is_integer():
+        value = int(value)
+    return f"${value:,}"
+
+
+def deviation_name(threshold):
+    """Name of the count of items deviating more than threshold, e.g. 'deviate_more_than_10'."""
+    return f'deviate_more_than_{threshold}'
+
+
+FORMATTERS = {
+    None: lambda value: value,
+    'percent': format_percent,
+    'price': format_price,
+}
+
+
+class Metric:
+    """A named aggregation expression and how to format its value ('percent', 'price' or None)."""
+
+    def __init__(self, name, expr, fmt=None):
+        if fmt not in FORMATTERS:
+            raise ValueError(f"Unknown format {fmt!r}, expected one of {list(FORMATTERS)}.")
+        self.name = name
+        self.expr = expr
+        self.fmt = fmt
+
+    def __repr__(self):
+        return f"Metric({self.name!r}, fmt={self.fmt!r})"
+
+
+class StatsSpec:
+    """A set of metrics evaluated together in one aggregation."""
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+
+    @property
+    def names(self):
+        return [metric.name for metric in self.metrics]
+
+    def aggregation(self, lf):
+        """LazyFrame with one row and one column per metric (can be collected with other queries)."""
+        return lf.lazy().select([metric.expr.alias(metric.name) for metric in self.metrics])
+
+    def evaluate(self, df):
+        """Raw metric values as a dictionary, computed in one pass over a DataFrame or LazyFrame."""
+        return self.aggregation(df).collect().row(0, named=True)
+
+    def format(self, values):
+        """Apply each metric's formatting to the raw values."""
+        return {metric.name: FORMATTERS[metric.fmt](values[metric.name]) for metric in self.metrics}
+
+
+def price_comparison_stats(deviation_thresholds=(1, 10, 100),
+                           percent_column="percent_difference", deviation_column="price_deviation"):
+    """Statistics of the sample price comparison report.
+
+    One deviate_more_than_<threshold> count is added for every deviation threshold.
+    """
+    percent = pl.col(percent_column)
+    deviation = pl.col(deviation_column)
+    metrics = [
+        Metric('below_competitor', (percent < 0).sum()),
+        Metric('above_competitor', (percent > 0).sum()),
+        Metric('avg_percent_diff', percent.mean(), 'percent'),
+        Metric('max_percent_diff', percent.max(), 'percent'),
+        Metric('min_percent_diff', percent.min(), 'percent'),
+        Metric('avg_price_deviation', deviation.mean(), 'price'),
+        Metric('max_price_deviation', deviation.max(), 'price'),
+        Metric('min_price_deviation', deviation.min(), 'price'),
+    ]
+    metrics += [Metric(deviation_name(threshold), (deviation > threshold).sum())
+                for threshold in deviation_thresholds]
+    return StatsSpec(metrics)
@@ -0,0 +1,85 @@
+import argparse
+import sys
+
+import polars as pl
+
+from utils.config import get_db_connection
+from utils.report import SUMMARY_MODES, SamplePriceComp
+from utils.sampling import REFERENCE_ITEMS_SQL, SampleSpec
+"""
+Diff the 'rows' query mode of SamplePriceComp against the 'aggregate' (or 'index') mode for one contract.
+
+Both queries use the same seeded SampleSpec on the same connection, so they sample the same
+reference items and their comparison DataFrames must match.
+
+    EXAMPLE -$ python3 src/verify_query_modes.py 47QSEA20D003B --seed 42 --sample-method random_key
+    EXAMPLE -$ python3 src/verify_query_modes.py 47QSEA20D003B --mode index
+"""
+
+KEY_COLUMNS = ["manufacturer_part_number", "price"]
+VALUE_COLUMNS = ["average_price_on_gsa", "price_deviation", "percent_difference"]
+# 'normalized' also matches other spellings of the part numbers, so it is not expected to equal 'rows'
+COMPARED_MODES = [mode for mode in SUMMARY_MODES if mode != 'normalized']
+
+
+def run_comparison(conn, contract_number, query_mode, sample):
+    """Run the report up to the comparison DataFrame with a seeded sample."""
+    price_comp = SamplePriceComp(conn, contract_number, query_mode=query_mode, sample=sample)
+    price_comp.get_contractor_info()
+    price_comp.get_sample_products()
+    price_comp.get_contractor_items()
+    price_comp.calculate_comparison_df()
+    return price_comp
+
+
+def diff_comparison_frames(rows_df, aggregate_df, tolerance=1e-6):
+    """Return the rows whose competitor statistics differ between the two comparison DataFrames."""
+    rows_df = rows_df.select(KEY_COLUMNS + VALUE_COLUMNS).sort(KEY_COLUMNS)
+    aggregate_df = aggregate_df.select(KEY_COLUMNS + VALUE_COLUMNS).sort(KEY_COLUMNS)
+    if rows_df.height != aggregate_df.height:
+        raise ValueError(f"Row count differs: rows={rows_df.height} aggregate={aggregate_df.height}")
+
+    joined = pl.concat([rows_df, aggregate_df.select(
+        pl.col(column).alias(f"{column}_aggregate") for column in KEY_COLUMNS + VALUE_COLUMNS
+    )], how="horizontal")
+
+    mismatch = pl.col("manufacturer_part_number") != pl.col("manufacturer_part_number_aggregate")
+    for column in ["price"] + VALUE_COLUMNS:
+        left, right = pl.col(column), pl.col(f"{column}_aggregate")
+        both_null = left.is_null() & right.is_null()
+        close = (left - right).abs() <= tolerance * pl.max_horizontal(left.abs(), right.abs(), pl.lit(1.0))
+        mismatch = mismatch | ~(both_null | close.fill_null(False))
+    return joined.filter(mismatch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff the rows query mode against a summary mode for a contract.")
+    parser.add_argument('contract_number')
+    parser.add_argument('--seed', default='42', help="Seed shared by both samples.")
+    parser.add_argument('--sample-size', type=int, default=100)
+    parser.add_argument('--sample-method', choices=list(REFERENCE_ITEMS_SQL), default='random')
+    parser.add_argument('--mode', choices=COMPARED_MODES, default='aggregate', help="Mode compared to 'rows'.")
+    args = parser.parse_args(argv)
+    sample = SampleSpec(size=args.sample_size, seed=args.seed, method=args.sample_method)
+
+    conn = get_db_connection()
+    try:
+        rows = run_comparison(conn, args.contract_number, 'rows', sample)
+        aggregate = run_comparison(conn, args.contract_number, args.mode, sample)
+    finally:
+        conn.close()
+
+    differences = diff_comparison_frames(rows.comparison_df, aggregate.comparison_df)
+    print(f"product_count: rows={rows.analysis_results['product_count']} "
+          f"{args.mode}={aggregate.analysis_results['product_count']}")
+    print(f"rows transferred: rows={rows.query_results_df.height} {args.mode}={aggregate.query_results_df.height}")
+    if differences.height:
+        print(f"{differences.height} items differ:")
+        print(differences)
+        return 1
+    print(f"All {rows.comparison_df.height} items match.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
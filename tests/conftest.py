@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts run from the repository root with src on the path (see the README)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+@pytest.fixture(autouse=True)
+def project_root(monkeypatch):
+    """Run every test from the repository root, where the query and template paths are relative to."""
+    monkeypatch.chdir(ROOT)
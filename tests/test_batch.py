@@ -0,0 +1,74 @@
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from batch import main, parse_args
+from benchmarks.synthetic import contract_numbers, generate_extract, synthetic_registry, write_snapshot
+from conftest import ROOT
+
+# A hung worker pool fails the test instead of the whole run
+BATCH_TIMEOUT = 120
+
+
+@pytest.fixture(scope="module")
+def snapshot_run(tmp_path_factory):
+    """Synthetic snapshot, contract metadata CSV, contract file and output directory of a batch run."""
+    path = tmp_path_factory.mktemp("batch")
+    df = generate_extract(20_000, contracts=20, seed=0)
+    write_snapshot(df, str(path / "snapshot"), partitions=4)
+    synthetic_registry(df).write_csv(str(path / "contracts.csv"))
+    (path / "contracts.txt").write_text("\n".join(contract_numbers(2)) + "\n")
+    (path / "output").mkdir()
+    return path
+
+
+def batch_args(path):
+    return ['--file', str(path / "contracts.txt"), '--snapshot', str(path / "snapshot"),
+            '--contracts-csv', str(path / "contracts.csv"), '--output', f"{path / 'output'}/",
+            '--format', 'html', '--workers', '1', '--bootstrap-resamples', '100']
+
+
+def test_batch_runs_the_workers_to_the_end(snapshot_run):
+    process = subprocess.Popen([sys.executable, os.path.join("src", "batch.py"), *batch_args(snapshot_run)],
+                               cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                               start_new_session=True)
+    try:
+        output, _ = process.communicate(timeout=BATCH_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        # Kill the worker processes along with the batch
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        pytest.fail(f"batch.py did not finish within {BATCH_TIMEOUT}s")
+    assert process.returncode == 0, output
+    assert "2 succeeded, 0 failed" in output
+    for contract_number in contract_numbers(2):
+        report = (snapshot_run / "output" / f"GSA_Report_{contract_number}.html").read_text()
+        for threshold in ("$1", "$10", "$100"):
+            assert f"more than {threshold}:" in report
+
+
+def test_default_arguments():
+    args = parse_args(['--file', 'contracts.txt'])
+    assert args.workers == 4 and args.format == 'pdf' and args.query_mode == 'rows'
+    assert args.deviation_thresholds == [1.0, 10.0, 100.0]
+    assert all(isinstance(threshold, float) for threshold in args.deviation_thresholds)
+    assert parse_args(['--db', '--deviation-thresholds', '2.5', '10']).deviation_thresholds == [2.5, 10.0]
+
+
+def test_conflicting_options_are_rejected(capsys):
+    assert main(['--db', '--catalog', '--snapshot', 'snapshot']) == 2
+    assert main(['--db', '--defer-convert', '--format', 'html']) == 2
+    assert "--defer-convert only applies to PDF reports." in capsys.readouterr().out
+
+
+def test_fractional_thresholds_run_end_to_end(snapshot_run, tmp_path):
+    (tmp_path / "contracts.txt").write_text(contract_numbers(1)[0] + "\n")
+    args = batch_args(snapshot_run)
+    args[1] = str(tmp_path / "contracts.txt")
+    args[args.index('--output') + 1] = f"{tmp_path}/"
+    assert main([*args, '--deviation-thresholds', '2.5', '10']) == 0
+    report = (tmp_path / f"GSA_Report_{contract_numbers(1)[0]}.html").read_text()
+    assert "more than $2.5:" in report and "more than $10:" in report
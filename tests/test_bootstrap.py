@@ -0,0 +1,60 @@
+import numpy as np
+import polars as pl
+
+from utils.bootstrap import bootstrap_means, comparison_intervals, interval, resample_counts
+
+
+def comparison(manufacturers, percent_differences):
+    return pl.DataFrame({
+        'manufacturer_name': pl.Series(manufacturers, dtype=pl.Categorical),
+        'percent_difference': pl.Series(percent_differences, dtype=pl.Float64),
+        'price_deviation': pl.Series(percent_differences, dtype=pl.Float64) * 10,
+    })
+
+
+def test_empty_comparison_has_no_bounds():
+    data = comparison([], [])
+    summary, groups = comparison_intervals(data, resamples=100, seed=1)
+    assert summary == {'percent_difference': (None, None), 'price_deviation': (None, None)}
+    assert groups.height == 0
+    assert groups.columns == ['manufacturer_name', 'percent_difference_lower', 'percent_difference_upper']
+    assert groups.schema['manufacturer_name'] == data.schema['manufacturer_name']
+
+
+def test_interval_contains_the_mean():
+    values = np.random.default_rng(0).normal(0.1, 0.05, 200)
+    lower, upper = interval(bootstrap_means(values, resample_counts(len(values), 500, np.random.default_rng(1))))
+    assert lower < values.mean() < upper
+
+
+def test_groups_without_values_or_names():
+    summary, groups = comparison_intervals(
+        comparison(["A", "A", None, None, "B"], [0.1, 0.2, 0.3, 0.4, None]), resamples=200, seed=1)
+    rows = {row['manufacturer_name']: row for row in groups.iter_rows(named=True)}
+    assert set(rows) == {"A", "B", None}
+    assert 0.1 <= rows["A"]['percent_difference_lower'] <= rows["A"]['percent_difference_upper'] <= 0.2
+    assert rows["B"]['percent_difference_lower'] is None and rows["B"]['percent_difference_upper'] is None
+    assert rows[None]['percent_difference_lower'] is not None
+
+
+def test_all_null_groups_are_one_group():
+    summary, groups = comparison_intervals(comparison([None] * 4, [0.1, 0.2, 0.3, 0.4]), resamples=200, seed=1)
+    assert groups.get_column('manufacturer_name').to_list() == [None]
+    lower, upper = summary['percent_difference']
+    assert 0.1 <= lower <= upper <= 0.4
+
+
+def test_strata_keep_their_sizes():
+    strata = np.array([0, 0, 0, 1, 1, 2])
+    counts = resample_counts(len(strata), 300, np.random.default_rng(1), strata)
+    for stratum, size in ((0, 3), (1, 2), (2, 1)):
+        assert (counts[:, strata == stratum].sum(axis=1) == size).all()
+    assert (counts[:, 5] == 1).all()
+
+
+def test_seed_makes_intervals_reproducible():
+    data = comparison(["A", "B", "A", "B"], [0.1, 0.2, 0.3, 0.4])
+    first = comparison_intervals(data, strata_column='manufacturer_name', resamples=100, seed=7)
+    second = comparison_intervals(data, strata_column='manufacturer_name', resamples=100, seed=7)
+    assert first[0] == second[0]
+    assert first[1].equals(second[1])
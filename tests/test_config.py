@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+from psycopg2 import pool as pg_pool
+
+from utils import config
+
+
+class FakeConnection:
+    closed = 0
+
+    def rollback(self):
+        pass
+
+
+class FakeThreadedPool:
+    """Stand-in for psycopg2's ThreadedConnectionPool that raises when exhausted, like the real one."""
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.maxconn = maxconn
+        self.in_use = 0
+
+    def getconn(self):
+        if self.in_use >= self.maxconn:
+            raise pg_pool.PoolError("connection pool exhausted")
+        self.in_use += 1
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        self.in_use -= 1
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(pg_pool, "ThreadedConnectionPool", FakeThreadedPool)
+    return lambda **kwargs: config.ConnectionPool(minconn=1, maxconn=1, health_check=False, **kwargs)
+
+
+def test_connection_waits_for_a_returned_connection(make_pool):
+    pool = make_pool()
+    checked_out = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def holder():
+        with pool.connection():
+            order.append("holder")
+            checked_out.set()
+            release.wait(5)
+
+    def waiter():
+        with pool.connection():
+            order.append("waiter")
+
+    first = threading.Thread(target=holder)
+    first.start()
+    checked_out.wait(5)
+    second = threading.Thread(target=waiter)
+    second.start()
+    time.sleep(0.1)
+    assert second.is_alive()
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert order == ["holder", "waiter"]
+    assert pool._pool.in_use == 0
+
+
+def test_connection_raises_after_wait_timeout(make_pool):
+    pool = make_pool(wait_timeout=0.05)
+    with pool.connection():
+        with pytest.raises(pg_pool.PoolError, match="after 0.05s"):
+            with pool.connection():
+                pass
+    with pool.connection():
+        pass
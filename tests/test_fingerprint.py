@@ -0,0 +1,117 @@
+import os
+from datetime import date
+
+import polars as pl
+import pytest
+
+from test.sampleCompany import Company
+from utils.contracts import ContractRegistry
+from utils.fingerprint import ReportManifest
+from utils.queries import QueryRegistry
+from utils.report import SamplePriceComp
+
+CONTRACT_NUMBER = "GS-00F-TEST"
+
+
+class CannedQueries(QueryRegistry):
+    """Query registry answering every query with a canned DataFrame instead of the database."""
+
+    def __init__(self):
+        super().__init__()
+        self.results = {}
+        self.runs = []
+
+    def fetch_df(self, conn, name, params=None, fragments=None, prepared=True, batch_size=None,
+                 schema_overrides=None):
+        self.runs.append(name)
+        return self.results[name]
+
+
+def price_comparison(competitor_price):
+    rows = []
+    for item, part_number in enumerate(["P-1", "P-2", "P-3"]):
+        rows.append((item, "reference", part_number, "Acme", 10.0 * (item + 1)))
+        rows.append((100 + item, "competitor", part_number, "Other", competitor_price * (item + 1)))
+    return pl.DataFrame({
+        'jprod_id': [row[0] for row in rows],
+        'contractor_name': ["Test Vendor" if row[1] == "reference" else "Competitor" for row in rows],
+        'contract_number': [CONTRACT_NUMBER if row[1] == "reference" else "GS-OTHER" for row in rows],
+        'manufacturer_part_number': [row[2] for row in rows],
+        'manufacturer_name': [row[3] for row in rows],
+        'product_name': ["Widget"] * len(rows),
+        'price': [row[4] for row in rows],
+        'source': [row[1] for row in rows],
+    })
+
+
+@pytest.fixture
+def queries():
+    queries = CannedQueries()
+    queries.results = {
+        'report_fingerprint_contract': pl.DataFrame({'item_count': [3], 'items_hash': ["a"]}),
+        'report_fingerprint_competitors': pl.DataFrame({'part_number_count': [3], 'competitors_hash': ["b"]}),
+        'price_comp_random_sample': price_comparison(12.0),
+    }
+    return queries
+
+
+@pytest.fixture
+def make_report(tmp_path, queries):
+    contracts = ContractRegistry.from_companies([Company(
+        vendor="Test Vendor", contract_number=CONTRACT_NUMBER, sam_uei="TESTUEI",
+        current_option_period_end_date=date(2030, 1, 1), ultimate_contract_end_date=date(2035, 1, 1))])
+    manifest = ReportManifest(str(tmp_path))
+
+    def make_report(**kwargs):
+        return SamplePriceComp(None, CONTRACT_NUMBER, output_path=str(tmp_path), contracts=contracts,
+                               queries=queries, manifest=manifest, bootstrap_resamples=100, **kwargs)
+    return make_report
+
+
+def run(report):
+    path = report.run_sample_report(output_format='html')
+    return path, report.reused
+
+
+def test_manifest_entries_round_trip(tmp_path):
+    manifest = ReportManifest(str(tmp_path))
+    assert manifest.get(CONTRACT_NUMBER) is None
+    manifest.put(CONTRACT_NUMBER, {'data_fingerprint': "x", 'analysis_results': {'total_items': 3}})
+    assert manifest.get(CONTRACT_NUMBER)['analysis_results'] == {'total_items': 3}
+    [entry] = manifest.entries()
+    assert entry['contract_number'] == CONTRACT_NUMBER and 'analysis_results' not in entry
+
+
+def test_unchanged_inputs_reuse_the_analysis_and_the_report(make_report, queries):
+    path, reused = run(make_report())
+    assert reused == {'analysis': False, 'report': False}
+    queries.runs.clear()
+    second_path, reused = run(make_report())
+    assert reused == {'analysis': True, 'report': True}
+    assert second_path == path
+    assert 'price_comp_random_sample' not in queries.runs
+
+
+def test_changed_competitors_invalidate_the_analysis(make_report, queries):
+    run(make_report())
+    queries.results['report_fingerprint_competitors'] = pl.DataFrame(
+        {'part_number_count': [3], 'competitors_hash': ["c"]})
+    queries.results['price_comp_random_sample'] = price_comparison(15.0)
+    queries.runs.clear()
+    _, reused = run(make_report())
+    assert reused == {'analysis': False, 'report': False}
+    assert 'price_comp_random_sample' in queries.runs
+
+
+def test_changed_options_invalidate_the_analysis(make_report):
+    run(make_report())
+    _, reused = run(make_report(deviation_thresholds=(1, 5)))
+    assert reused['analysis'] is False
+
+
+def test_missing_report_file_is_rendered_again(make_report):
+    path, _ = run(make_report())
+    os.remove(path)
+    second_path, reused = run(make_report())
+    assert reused == {'analysis': True, 'report': False}
+    assert os.path.exists(second_path)
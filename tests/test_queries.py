@@ -0,0 +1,101 @@
+import gc
+from collections import namedtuple
+
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+from utils.queries import QueryRegistry
+
+Column = namedtuple("Column", "name type_code")
+
+
+class FakeCursor:
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.rows = []
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append((self.name, sql))
+        if sql.startswith("EXECUTE") and self.conn.fail_execute:
+            self.conn.fail_execute -= 1
+            raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+        self.rows = [(1, "a"), (2, "b")]
+        self.description = [Column("id", 23), Column("label", 25)]
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, fail_execute=0):
+        self.statements = []
+        self.fail_execute = fail_execute
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self, name)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def prepares(self):
+        return [sql for _, sql in self.statements if sql.startswith("PREPARE")]
+
+
+@pytest.fixture
+def queries(tmp_path, monkeypatch):
+    monkeypatch.setattr(psycopg2.extensions, "register_type", lambda *args: None)
+    (tmp_path / "items.txt").write_text("SELECT id, label FROM items WHERE id > %(after)s")
+    return QueryRegistry(str(tmp_path))
+
+
+def test_statement_is_prepared_once_per_connection(queries):
+    conn = FakeConnection()
+    for after in (0, 1):
+        assert queries.fetch_df(conn, "items", {'after': after}).height == 2
+    assert conn.prepares() == [conn.prepares()[0]]
+    assert "$1" in conn.prepares()[0]
+
+    other = FakeConnection()
+    queries.fetch_df(other, "items", {'after': 0})
+    assert len(other.prepares()) == 1
+
+
+def test_lost_statement_is_prepared_again(queries):
+    conn = FakeConnection()
+    queries.fetch_df(conn, "items", {'after': 0})
+    conn.fail_execute = 1
+    assert queries.fetch_df(conn, "items", {'after': 0}).height == 2
+    assert conn.rollbacks == 1
+    assert len(conn.prepares()) == 2
+
+
+def test_record_is_dropped_with_the_connection(queries):
+    conn = FakeConnection()
+    queries.fetch_df(conn, "items", {'after': 0})
+    assert len(queries._prepared) == 1
+    queries.forget(conn)
+    queries.fetch_df(conn, "items", {'after': 0})
+    assert len(conn.prepares()) == 2
+    del conn
+    gc.collect()
+    assert len(queries._prepared) == 0
+
+
+def test_unprepared_query_streams_from_a_server_side_cursor(queries):
+    conn = FakeConnection()
+    batches = list(queries.iter_batches(conn, "items", {'after': 0}, prepared=False, batch_size=1))
+    assert [batch.height for batch in batches] == [1, 1]
+    assert conn.prepares() == []
+    [(cursor_name, sql)] = conn.statements
+    assert cursor_name is not None and sql.startswith("SELECT")